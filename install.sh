@@ -15,6 +15,7 @@ INSTALL_DIR="/usr/local/lib/wcli"
 BIN_DIR="/usr/local/bin"
 SCRIPT_NAME="wcli"
 PACKAGE_NAME="providers"
+API_NAME="wcli_api.py"
 
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
@@ -154,6 +155,7 @@ echo -e "${BLUE}Installing wcli files to $INSTALL_DIR...${NC}"
 sudo mkdir -p "$INSTALL_DIR"
 sudo cp "$SCRIPT_DIR/$SCRIPT_NAME" "$INSTALL_DIR/$SCRIPT_NAME"
 sudo cp -r "$SCRIPT_DIR/$PACKAGE_NAME" "$INSTALL_DIR/"
+sudo cp "$SCRIPT_DIR/$API_NAME" "$INSTALL_DIR/$API_NAME"
 
 # Set permissions
 sudo chmod +x "$INSTALL_DIR/$SCRIPT_NAME"
@@ -2,8 +2,15 @@
 import subprocess
 import shutil
 import re
+import os
+import gzip
+import json
+import urllib.parse
+import urllib.request
 from pathlib import Path
-from .base_provider import BaseProvider
+from .base_provider import BaseProvider, order_build_waves, write_root_file, dependency_closure_of, ephemeral_cmd, EPHEMERAL_EXCLUDES
+from .output import print, run_shown, ThreadPoolExecutor
+from .versions import pacman_key
 
 YELLOW = '\033[1;33m'
 NC = '\033[0m'
@@ -14,26 +21,130 @@ GREEN = '\033[0;32m'
 def run_cmd(cmd: list) -> bool:
     """Helper to run an interactive command."""
     try:
-        subprocess.run(cmd, check=True)
+        run_shown(ephemeral_cmd(cmd), check=True)
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
         
-def run_cmd_capture(cmd: list) -> subprocess.CompletedProcess:
+def run_cmd_capture(cmd: list, cwd: Path = None, check: bool = True) -> subprocess.CompletedProcess:
     """Helper to run a non-interactive command and capture output."""
-    return subprocess.run(cmd, check=True, text=True, capture_output=True, errors='ignore')
+    return subprocess.run(ephemeral_cmd(cmd), cwd=cwd, check=check, text=True, capture_output=True, errors='ignore')
+
+# --- Native AUR build pipeline ---
+#
+AUR_BUILD_DIR = Path(os.environ.get("WCLI_AUR_DIR", Path.home() / ".cache" / "wcli" / "aur"))
+AUR_PKGDEST = AUR_BUILD_DIR / "pkgs"
+AUR_GIT_URL = "https://aur.archlinux.org/{}.git"
+AUR_RPC_URL = "https://aur.archlinux.org/rpc/v5/info"
+
+PACMAN_CONF = Path("/etc/pacman.conf")
+PACMAN_IGNORE_FILE = "/etc/pacman.d/wcli-ignore.conf"
+PACMAN_CACHE_DIR = "/var/cache/pacman/pkg"
+PACMAN_LOCAL_DB = Path("/var/lib/pacman/local")
+BUNDLE_REPO = "wcli-bundle"
+BUNDLE_REPO_CONF = "/etc/pacman.d/wcli-bundle.conf"
+PACMAN_EPHEMERAL_CONF = "/etc/pacman.d/wcli-ephemeral.conf"
+
+def _strip_dep_version(dep: str) -> str:
+    """'foo>=1.2' -> 'foo'"""
+    return re.split(r"[<>=]", dep, 1)[0].strip()
+
+def aur_rpc_pkgbases(names: list) -> dict:
+    """
+    {pkgname: pkgbase} from one AUR RPC 'info' query. Names the AUR does not
+    know are left out. Raises OSError or ValueError if the query fails.
+    """
+    body = urllib.parse.urlencode([("arg[]", name) for name in sorted(names)]).encode()
+    with urllib.request.urlopen(AUR_RPC_URL, data=body, timeout=30) as response:
+        reply = json.load(response)
+    if reply.get("type") == "error":
+        raise ValueError(reply.get("error"))
+    return {result["Name"]: result["PackageBase"] for result in reply.get("results", [])}
+
+def parse_srcinfo(path: Path) -> dict:
+    """
+    Parses a .SRCINFO file into a flat dict.
+    Returns: {"pkgbase", "pkgnames", "pkgver", "pkgrel", "epoch", "arch", "depends", "provides"}
+    """
+    info = {"pkgbase": "", "pkgnames": [], "pkgver": "", "pkgrel": "", "epoch": "", "arch": [], "depends": set(), "provides": set()}
+    with open(path, 'r', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = (part.strip() for part in line.split('=', 1))
+            # Per-arch variants like 'depends_x86_64' count as plain deps
+            base_key = re.sub(r"_(x86_64|i686|aarch64|armv7h|any)$", "", key)
+            if key == "pkgbase":
+                info["pkgbase"] = value
+            elif key == "pkgname":
+                info["pkgnames"].append(value)
+            elif key in ("pkgver", "pkgrel", "epoch"):
+                info[key] = value
+            elif key == "arch":
+                info["arch"].append(value)
+            elif base_key in ("depends", "makedepends", "checkdepends"):
+                info["depends"].add(value)
+            elif base_key == "provides":
+                info["provides"].add(_strip_dep_version(value))
+    if not info["pkgnames"]:
+        info["pkgnames"] = [info["pkgbase"]]
+    return info
+
+def srcinfo_full_version(info: dict) -> str:
+    """Returns '[epoch:]pkgver-pkgrel', the version part of a built package file name."""
+    version = f"{info['pkgver']}-{info['pkgrel']}"
+    return f"{info['epoch']}:{version}" if info["epoch"] else version
+
+def order_aur_builds(srcinfos: dict) -> list:
+    """Groups pkgbases into concurrent build waves using their .SRCINFO deps."""
+    provided_by = {}
+    for base, info in srcinfos.items():
+        for name in list(info["provides"]) + info["pkgnames"]:
+            provided_by[name] = base
+    graph = {base: {provided_by.get(_strip_dep_version(d)) for d in info["depends"]}
+             for base, info in srcinfos.items()}
+    return order_build_waves(graph)
+
+
+def _mtree_files(text: str) -> list:
+    """[(path, "sha256", digest)] for the regular files of an mtree(5) listing, with its '/set' defaults."""
+    defaults, files = {}, []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        token, *keywords = line.split()
+        values = dict(k.split("=", 1) for k in keywords if "=" in k)
+        if token == "/set":
+            defaults.update(values)
+            continue
+        values = {**defaults, **values}
+        # Skips /unset and the package's own .PKGINFO, .BUILDINFO, ...
+        if token.startswith("/") or token.startswith("./.") or values.get("type") != "file" or "sha256digest" not in values:
+            continue
+        raw = re.sub(rb"\\([0-7]{3})", lambda m: bytes([int(m.group(1), 8)]), os.fsencode(token[1:]))
+        files.append((os.fsdecode(raw), "sha256", values["sha256digest"]))
+    return files
 
 class Provider(BaseProvider):
     """Arch Linux provider implementation."""
 
+    metadata_globs = ["/var/lib/pacman/sync/*.db"]
+    supports_holds = True
+    package_cache_dir = PACMAN_CACHE_DIR
+    package_cache_globs = [f"{PACMAN_CACHE_DIR}/*.pkg.tar.*", str(AUR_PKGDEST / "*.pkg.tar.*")]
+    # pacman creates db.lck for a transaction and deletes it afterwards
+    package_locks = [("exists", "/var/lib/pacman/db.lck")]
+
     def __init__(self):
+        super().__init__()
         self.helper_cmd = None
         if shutil.which("paru"):
             self.helper_cmd = "paru"
         elif shutil.which("yay"):
             self.helper_cmd = "yay"
-        else:
-            print(f"{YELLOW}Warning: No AUR helper (paru, yay) found. 'arch_aur' packages will be skipped.{NC}")
+        if not shutil.which("makepkg"):
+            print(f"{YELLOW}Warning: 'makepkg' not found. 'arch_aur' packages will be skipped.{NC}")
         
         # Check for vercmp
         if not shutil.which("vercmp"):
@@ -49,8 +160,7 @@ class Provider(BaseProvider):
         Installs packages one-by-one to show progress.
         Uses helper if any package contains a version string.
         """
-        total = len(packages)
-        all_ok = True
+        failed = []
         
         # Packages with '=' need an AUR helper
         aur_pkgs = [p for p in packages if "=" in p]
@@ -58,21 +168,52 @@ class Provider(BaseProvider):
 
         if pacman_pkgs:
             print(f"{BLUE}Installing {len(pacman_pkgs)} official packages...{NC}")
+            if not self.wait_for_package_lock():
+                self.failed_packages = []
+                return False
             if not run_cmd(["sudo", "pacman", "-S", "--noconfirm", "--needed"] + pacman_pkgs):
-                all_ok = False # Don't stop, just report
+                # One transaction: a single bad name fails all of them
+                rejected = self.rejected_targets(pacman_pkgs)
+                failed += pacman_pkgs if rejected is None else rejected
 
         if aur_pkgs:
             if not self.helper_cmd:
                 print(f"{RED}Error: Cannot install versioned packages '{', '.join(aur_pkgs)}' without an AUR helper.{NC}")
+                self.failed_packages = failed + aur_pkgs
                 return False
                 
             print(f"{BLUE}Installing {len(aur_pkgs)} versioned packages using {self.helper_cmd}...{NC}")
+            if not self.wait_for_package_lock():
+                self.failed_packages = failed
+                return False
             if not run_cmd([self.helper_cmd, "-S", "--noconfirm", "--needed"] + aur_pkgs):
-                all_ok = False
+                failed += aur_pkgs
 
-        return all_ok
+        self.failed_packages = failed
+        return not failed
+
+    def rejected_targets(self, names: list):
+        """
+        After a failed 'pacman -S', which of 'names' pacman refuses to resolve:
+        unknown targets and packages whose dependencies cannot be satisfied.
+        Dry-runs the transaction ('-Sp'). An empty list means it resolves, so
+        the failure was elsewhere (download, disk); None means pacman gave no
+        names to blame.
+        """
+        try:
+            result = run_cmd_capture(["pacman", "-S", "--print", "--print-format", "%n", "--needed"] + names, check=False)
+        except FileNotFoundError:
+            return None
+        if result.returncode == 0:
+            return []
+        blamed = set(re.findall(r"target not found: (\S+)", result.stderr))
+        blamed.update(re.findall(r"required by (\S+)", result.stderr))
+        rejected = [name for name in names if name in blamed]
+        return rejected or None
 
     def remove(self, packages: list) -> bool:
+        if not self.wait_for_package_lock():
+            return False
         return run_cmd(["sudo", "pacman", "-Rs", "--noconfirm"] + packages)
 
     def update(self, ignore_list: list) -> bool:
@@ -80,13 +221,178 @@ class Provider(BaseProvider):
             print(f"{RED}Error: No AUR helper found. Cannot update.{NC}")
             return False
             
-        cmd = [self.helper_cmd, "-Syu", "--noconfirm"]
+        # -Sy then -Su is the same transaction as -Syu, but the refresh
+        # half can be skipped when the sync dbs are fresh.
+        if not self.refresh_metadata():
+            print(f"{RED}Error: Failed to refresh package databases.{NC}")
+            return False
+        cmd = [self.helper_cmd, "-Su", "--noconfirm"]
         if ignore_list:
             print(f"{YELLOW}Ignoring {len(ignore_list)} packages: {', '.join(ignore_list)}{NC}")
             for pkg in ignore_list:
                 cmd.extend(["--ignore", pkg])
         
-        return run_cmd(cmd)
+        return self.wait_for_package_lock() and run_cmd(cmd)
+
+    def upgradable_packages(self, names: list) -> dict:
+        """'pacman -Qu' against the local sync dbs, sizes from 'pacman -Sp'."""
+        try:
+            result = run_cmd_capture(["pacman", "-Qu"], check=False)
+        except FileNotFoundError:
+            return None
+        wanted = set(names)
+        upgrades = {}
+        for line in result.stdout.splitlines():
+            parts = line.split()
+            if len(parts) >= 4 and parts[0] in wanted and parts[2] == "->":
+                upgrades[parts[0]] = {"version": parts[3], "size": None}
+        if upgrades:
+            sizes = run_cmd_capture(["pacman", "-Sp", "--print-format", "%n %s"] + sorted(upgrades), check=False)
+            for line in sizes.stdout.splitlines():
+                name, _, size = line.partition(" ")
+                if name in upgrades and size.isdigit():
+                    upgrades[name]["size"] = int(size)
+        return upgrades
+
+    def upgrade_packages(self, names: list) -> bool:
+        # Arch only supports full upgrades: libraries upgraded here can break packages that were not
+        print(f"{YELLOW}Note: This is a partial upgrade. Run a full 'wcli update' before installing anything else.{NC}")
+        if not self.wait_for_package_lock():
+            return False
+        return run_cmd(["sudo", "pacman", "-S", "--needed", "--noconfirm"] + names)
+
+    def _refresh_metadata(self, repos: list = None) -> bool:
+        print(f"{BLUE}Refreshing package databases...{NC}")
+        if not self.wait_for_package_lock():
+            return False
+        return run_cmd(["sudo", "pacman", "-Sy"])
+
+    def sync_holds(self, wanted: dict, previous: dict) -> bool:
+        """
+        Writes all pins as IgnorePkg into an include file that pacman.conf's
+        [options] section pulls in, so plain 'pacman -Syu' respects them too.
+        """
+        include_line = f"Include = {PACMAN_IGNORE_FILE}"
+        try:
+            has_include = include_line in PACMAN_CONF.read_text()
+        except OSError:
+            has_include = False
+        if not has_include:
+            print(f"{BLUE}Adding '{include_line}' to {PACMAN_CONF}...{NC}")
+            if not run_cmd(["sudo", "sed", "-i", f"/^\\[options\\]/a {include_line}", str(PACMAN_CONF)]):
+                return False
+
+        content = "# Managed by wcli. Do not edit.\n"
+        if wanted:
+            content += f"IgnorePkg = {' '.join(sorted(wanted))}\n"
+        return write_root_file(PACMAN_IGNORE_FILE, content)
+
+    # --- Ephemeral Installs ---
+
+    def ephemeral_files(self) -> dict:
+        """NoExtract for docs and locales; pacman has no switch for fsync, so that is left to eatmydata."""
+        patterns = [path.lstrip("/") for path in EPHEMERAL_EXCLUDES] + ["!usr/share/locale/locale.alias"]
+        return {PACMAN_EPHEMERAL_CONF: f"NoExtract = {' '.join(patterns)}\n"}
+
+    def enable_ephemeral(self) -> bool:
+        """Also includes the NoExtract file from pacman.conf's [options] section."""
+        all_ok = super().enable_ephemeral()
+        include_line = f"Include = {PACMAN_EPHEMERAL_CONF}"
+        try:
+            has_include = include_line in PACMAN_CONF.read_text()
+        except OSError:
+            has_include = False
+        if not has_include and not run_cmd(["sudo", "sed", "-i", f"/^\\[options\\]/a {include_line}", str(PACMAN_CONF)]):
+            all_ok = False
+        return all_ok
+
+    def disable_ephemeral(self) -> bool:
+        """Drops the Include line before the file, so pacman.conf never includes a missing file."""
+        include_line = f"Include = {PACMAN_EPHEMERAL_CONF}"
+        all_ok = True
+        try:
+            has_include = include_line in PACMAN_CONF.read_text()
+        except OSError:
+            has_include = False
+        if has_include and not run_cmd(["sudo", "sed", "-i", f"\\|^{include_line}$|d", str(PACMAN_CONF)]):
+            all_ok = False
+        return super().disable_ephemeral() and all_ok
+
+    # --- Package Cache Bundles ---
+
+    def parse_package_filename(self, filename: str):
+        """'foo-bar-1:2.0-3-x86_64.pkg.tar.zst' -> ('foo-bar', '1:2.0-3')"""
+        if ".pkg.tar" not in filename or filename.endswith(".sig"):
+            return None
+        parts = filename.split(".pkg.tar", 1)[0].rsplit("-", 3)
+        if len(parts) != 4:
+            return None
+        name, version, release, _arch = parts
+        return name, f"{version}-{release}"
+
+    def dependency_closure(self, names: set) -> set:
+        """Follows %DEPENDS% (and %PROVIDES% for virtual names) through the local pacman database."""
+        depends, provides = {}, {}
+        for desc in PACMAN_LOCAL_DB.glob("*/desc"):
+            try:
+                sections = re.findall(r"%(\w+)%\n((?:.+\n?)*)", desc.read_text())
+            except OSError:
+                continue
+            fields = {key: value.split() for key, value in sections}
+            if not fields.get("NAME"):
+                continue
+            name = fields["NAME"][0]
+            depends[name] = [_strip_dep_version(d) for d in fields.get("DEPENDS", [])]
+            for virtual in fields.get("PROVIDES", []):
+                provides.setdefault(_strip_dep_version(virtual), []).append(name)
+        if not depends:
+            return None
+        return dependency_closure_of(names, depends, provides)
+
+    def package_file_digests(self, packages: dict) -> dict:
+        """From each package's gzipped mtree in the local database. %BACKUP% files count as config."""
+        digests = {}
+        for name, version in packages.items():
+            entry = PACMAN_LOCAL_DB / f"{name}-{version}"
+            try:
+                with gzip.open(entry / "mtree", 'rt', errors='surrogateescape') as f:
+                    mtree = f.read()
+                desc = (entry / "desc").read_text(errors='surrogateescape')
+            except (OSError, EOFError):
+                continue
+            backup = re.search(r"%BACKUP%\n((?:.+\n?)*)", desc)
+            config = {"/" + line.split("\t")[0] for line in backup.group(1).splitlines()} if backup else set()
+            digests[name] = [f for f in _mtree_files(mtree) if f[0] not in config]
+        return digests
+
+    def _register_bundle_repo(self, bundle_dir: str, files: list) -> bool:
+        """Indexes the bundle with repo-add and includes it from pacman.conf as [wcli-bundle]."""
+        if not shutil.which("repo-add"):
+            print(f"{RED}Error: 'repo-add' not found. Use '--mode seed'.{NC}")
+            return False
+        db = os.path.join(bundle_dir, f"{BUNDLE_REPO}.db.tar.gz")
+        packages = [os.path.join(bundle_dir, f) for f in files]
+        if not run_cmd(["repo-add", "--quiet", db] + packages):
+            print(f"{RED}Error: repo-add failed.{NC}")
+            return False
+
+        content = (f"# Managed by wcli. Do not edit.\n[{BUNDLE_REPO}]\n"
+                   f"SigLevel = Optional TrustAll\nServer = file://{bundle_dir}\n")
+        if not write_root_file(BUNDLE_REPO_CONF, content):
+            print(f"{RED}Error: Could not write {BUNDLE_REPO_CONF}{NC}")
+            return False
+        include_line = f"Include = {BUNDLE_REPO_CONF}"
+        try:
+            has_include = include_line in PACMAN_CONF.read_text()
+        except OSError:
+            has_include = False
+        if not has_include:
+            # Repos are searched in file order; appending keeps the official ones first
+            print(f"{BLUE}Adding '{include_line}' to {PACMAN_CONF}...{NC}")
+            if not run_cmd(["sudo", "sed", "-i", f"$a {include_line}", str(PACMAN_CONF)]):
+                return False
+        print(f"{GREEN}Registered {bundle_dir} as [{BUNDLE_REPO}]{NC}")
+        return self.refresh_metadata(force=True)
 
     def search(self, package: str) -> bool:
         if self.helper_cmd:
@@ -125,6 +431,9 @@ class Provider(BaseProvider):
         except (subprocess.CalledProcessError, FileNotFoundError):
             return pkg_map
 
+    def segment_key(self, version: str) -> tuple:
+        return pacman_key(version)
+
     def compare_versions(self, v1: str, v2: str) -> int:
         if not self.can_compare: return 0 # Failsafe
         try:
@@ -167,6 +476,8 @@ class Provider(BaseProvider):
             return False
         
         # Use pacman -U to install the specific file
+        if not self.wait_for_package_lock():
+            return False
         return run_cmd(["sudo", "pacman", "-U", "--noconfirm", pkg_file])
 
     def show_package_versions(self, package: str):
@@ -223,16 +534,225 @@ class Provider(BaseProvider):
         }
 
     def install_aur(self, packages: list) -> bool:
-        if not self.helper_cmd:
-            print(f"{RED}Error: No AUR helper found. Cannot install packages.{NC}")
+        # makepkg ships with pacman, so the native pipeline is always the way
+        if not shutil.which("makepkg"):
+            print(f"{RED}Error: 'makepkg' not found. Cannot build AUR packages.{NC}")
             return False
-        
-        print(f"{BLUE}Using '{self.helper_cmd}' to install {len(packages)} AUR packages...{NC}")
-        # Install one by one to show progress
+        return self.build_aur(packages)
+
+    # --- Native AUR Pipeline ---
+
+    def _aur_pkgbases(self, names: list) -> dict:
+        """
+        {pkgname: pkgbase}: split packages are cloned and built under their
+        pkgbase. A directory with a PKGBUILD is its own pkgbase; the other
+        names take one AUR RPC query. Unknown names are left out.
+        """
+        bases = {name: name for name in names if (AUR_BUILD_DIR / name / "PKGBUILD").exists()}
+        remote = [name for name in names if name not in bases]
+        if remote:
+            try:
+                bases.update(aur_rpc_pkgbases(remote))
+            except (OSError, ValueError) as e:
+                print(f"{YELLOW}Warning: AUR RPC query failed ({e}); assuming pkgbase = pkgname{NC}")
+                bases.update({name: name for name in remote})
+        return bases
+
+    def _fetch_aur_source(self, pkgbase: str) -> bool:
+        """
+        Clones or updates the AUR git repo for a pkgbase.
+        Directories without a .git (local PKGBUILDs) are used as-is.
+        """
+        pkg_dir = AUR_BUILD_DIR / pkgbase
+        if pkg_dir.exists():
+            if not (pkg_dir / ".git").exists():
+                return (pkg_dir / "PKGBUILD").exists()
+            return run_cmd_capture(["git", "-C", str(pkg_dir), "pull", "--ff-only", "-q"], check=False).returncode == 0
+        return run_cmd(["git", "clone", "-q", AUR_GIT_URL.format(pkgbase), str(pkg_dir)])
+
+    def _load_srcinfo(self, pkgbase: str) -> dict:
+        """Reads .SRCINFO, generating it with 'makepkg --printsrcinfo' if missing or stale."""
+        pkg_dir = AUR_BUILD_DIR / pkgbase
+        srcinfo = pkg_dir / ".SRCINFO"
+        pkgbuild = pkg_dir / "PKGBUILD"
+        if not srcinfo.exists() or srcinfo.stat().st_mtime < pkgbuild.stat().st_mtime:
+            result = run_cmd_capture(["makepkg", "--printsrcinfo"], cwd=pkg_dir)
+            srcinfo.write_text(result.stdout)
+        return parse_srcinfo(srcinfo)
+
+    def _cached_aur_files(self, info: dict) -> list:
+        """
+        Returns the built package files for this exact pkgver/pkgrel, or []
+        if any of the split packages still has to be built.
+        """
+        version = srcinfo_full_version(info)
+        files = []
+        for name in info["pkgnames"]:
+            matches = sorted(AUR_PKGDEST.glob(f"{name}-{version}-*.pkg.tar.*"))
+            matches = [m for m in matches if not m.name.endswith(".sig")]
+            if not matches:
+                return []
+            files.append(str(matches[-1]))
+        return files
+
+    def _build_aur_package(self, pkgbase: str, make_jobs: int) -> bool:
+        """Runs makepkg for one pkgbase, logging to build.log in its directory."""
+        pkg_dir = AUR_BUILD_DIR / pkgbase
+        env = os.environ.copy()
+        env["PKGDEST"] = str(AUR_PKGDEST)
+        env["MAKEFLAGS"] = f"-j{make_jobs}"
+        with open(pkg_dir / "build.log", 'w') as log:
+            proc = subprocess.run(
+                ["makepkg", "--noconfirm", "--force", "--cleanbuild"],
+                cwd=pkg_dir, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+        return proc.returncode == 0
+
+    def _split_missing_deps(self, deps: set) -> (list, list):
+        """
+        Of the dependency strings not satisfied yet ('pacman -T'), those the
+        sync repos provide and those they do not, which have to come from
+        the AUR.
+        """
+        if not deps:
+            return [], []
+        missing = run_cmd_capture(["pacman", "-T"] + sorted(deps), check=False).stdout.split()
+        if not missing:
+            return [], []
+        result = run_cmd_capture(["pacman", "-S", "--print", "--print-format", "%n"] + missing, check=False)
+        not_found = set(re.findall(r"target not found: (\S+)", result.stderr))
+        return [d for d in missing if d not in not_found], [d for d in missing if d in not_found]
+
+    def _install_aur_files(self, files: list) -> bool:
+        if not files:
+            return True
+        print(f"{BLUE}Installing {len(files)} built AUR packages...{NC}")
+        if not self.wait_for_package_lock():
+            return False
+        return run_cmd(["sudo", "pacman", "-U", "--noconfirm", "--needed"] + files)
+
+    def build_aur(self, packages: list) -> bool:
+        """
+        Native AUR pipeline:
+          1. Resolve the names to their pkgbases, fetch every PKGBUILD and
+             read its .SRCINFO, then those of the dependencies no sync repo
+             provides.
+          2. Install all missing repo dependencies in one pacman call.
+          3. Build independent packages concurrently, wave by wave, in
+             dependency order. Packages whose pkgver/pkgrel is already in
+             the package cache are not rebuilt.
+          4. Install everything with one 'pacman -U'. Only when a later
+             wave has to build against earlier results are those
+             installed before that wave starts.
+        """
+        AUR_PKGDEST.mkdir(parents=True, exist_ok=True)
         all_ok = True
-        for i, pkg in enumerate(packages):
-            print(f"\n--- Installing AUR Pkg {pkg} ({i+1}/{len(packages)}) ---")
-            if not run_cmd([self.helper_cmd, "-S", "--noconfirm", "--needed", pkg]):
-                print(f"{YELLOW}Warning: Failed to install {pkg}{NC}")
+
+        # Fetch the requested PKGBUILDs, then, round by round, the AUR-only
+        # dependencies they pull in, so those are built in dependency order
+        # too. A package that cannot be fetched or read counts as failed,
+        # which skips everything that depends on it.
+        srcinfos = {} # by pkgbase
+        failed = set() # pkgnames and pkgbases
+        aur_names, repo_deps = set(), []
+        to_fetch = list(packages)
+        print(f"{BLUE}Fetching {len(packages)} AUR PKGBUILDs...{NC}")
+        while to_fetch:
+            bases = self._aur_pkgbases(to_fetch)
+            new_bases = sorted(set(bases.values()) - set(srcinfos))
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                fetched = dict(zip(new_bases, pool.map(self._fetch_aur_source, new_bases)))
+            for base, ok in fetched.items():
+                if not ok:
+                    print(f"{YELLOW}Warning: Could not fetch AUR package {base}{NC}")
+                else:
+                    try:
+                        srcinfos[base] = self._load_srcinfo(base)
+                        continue
+                    except (subprocess.CalledProcessError, FileNotFoundError, OSError) as e:
+                        print(f"{YELLOW}Warning: Could not read .SRCINFO for {base}: {e}{NC}")
+                failed.update({base} | {name for name, b in bases.items() if b == base})
                 all_ok = False
+
+            aur_names = {n for info in srcinfos.values() for n in info["pkgnames"] + list(info["provides"])}
+            # The RPC only knows pkgnames; a virtual name may be provided by a pkgbase fetched alongside
+            for name in to_fetch:
+                if name not in bases and name not in aur_names:
+                    print(f"{YELLOW}Warning: {name} is not in the AUR{NC}")
+                    failed.add(name)
+                    all_ok = False
+            deps = {d for info in srcinfos.values() for d in info["depends"]
+                    if _strip_dep_version(d) not in aur_names | failed}
+            repo_deps, aur_deps = self._split_missing_deps(deps)
+            to_fetch = sorted({_strip_dep_version(d) for d in aur_deps} - set(srcinfos) - failed)
+            if to_fetch:
+                print(f"{BLUE}Fetching {len(to_fetch)} AUR dependencies: {', '.join(to_fetch)}{NC}")
+
+        try:
+            waves = order_aur_builds(srcinfos)
+        except ValueError as e:
+            print(f"{RED}Error: {e}{NC}")
+            return False
+
+        # Repo dependencies are installed up front, so parallel makepkg runs
+        # never need to call pacman themselves.
+        if repo_deps:
+            print(f"{BLUE}Installing {len(repo_deps)} build dependencies...{NC}")
+            if not self.wait_for_package_lock() or not run_cmd(["sudo", "pacman", "-S", "--noconfirm", "--needed", "--asdeps"] + repo_deps):
+                print(f"{YELLOW}Warning: Failed to install some build dependencies{NC}")
+                all_ok = False
+
+        cores = os.cpu_count() or 1
+        to_install = []   # built files not yet installed
+        installed = set() # pkgnames installed mid-pipeline
+        for i, wave in enumerate(waves):
+            # Skip anything whose AUR dependencies failed to build
+            blocked = [b for b in wave if {_strip_dep_version(d) for d in srcinfos[b]["depends"]} & failed]
+            for base in blocked:
+                print(f"  {YELLOW}Skipping {base}: an AUR dependency could not be fetched or built{NC}")
+                failed.update(srcinfos[base]["pkgnames"])
+                all_ok = False
+            wave = [b for b in wave if b not in blocked]
+
+            to_build = []
+            for base in wave:
+                cached = self._cached_aur_files(srcinfos[base])
+                if cached:
+                    print(f"  {GREEN}✓ {base} {srcinfo_full_version(srcinfos[base])} (cached){NC}")
+                    to_install.extend(cached)
+                else:
+                    to_build.append(base)
+            if not to_build:
+                continue
+
+            # makepkg needs AUR build deps from earlier waves installed first
+            build_deps = {_strip_dep_version(d) for b in to_build for d in srcinfos[b]["depends"]}
+            build_deps = (build_deps & aur_names) - installed
+            if build_deps:
+                if not self._install_aur_files(to_install):
+                    all_ok = False
+                installed.update(Path(f).name.rsplit('-', 3)[0] for f in to_install)
+                to_install = []
+
+            workers = min(len(to_build), cores)
+            make_jobs = max(1, cores // workers)
+            print(f"{BLUE}Building wave {i+1}/{len(waves)}: {', '.join(to_build)} ({workers} parallel){NC}")
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = dict(zip(to_build, pool.map(lambda b: self._build_aur_package(b, make_jobs), to_build)))
+            for base, ok in results.items():
+                files = self._cached_aur_files(srcinfos[base]) if ok else []
+                if files:
+                    print(f"  {GREEN}✓ Built {base}{NC}")
+                    to_install.extend(files)
+                else:
+                    print(f"  {RED}✗ Failed to build {base} (see {AUR_BUILD_DIR / base / 'build.log'}){NC}")
+                    failed.update(srcinfos[base]["pkgnames"])
+                    all_ok = False
+
+        if not self._install_aur_files(to_install):
+            return False
+        # What was only pulled in as a dependency is installed as one
+        pulled = [n for info in srcinfos.values() for n in info["pkgnames"] if n not in packages and n not in failed]
+        if pulled and not run_cmd(["sudo", "pacman", "-D", "--asdeps"] + pulled):
+            print(f"{YELLOW}Warning: Could not mark {', '.join(pulled)} as dependencies{NC}")
         return all_ok
@@ -1,20 +1,63 @@
 # providers/base_provider.py
 from abc import ABC, abstractmethod
 import subprocess
+import configparser
+import contextvars
+import ctypes
+import select
 import shutil
+import glob
+import hashlib
+import os
+import re
+import time
+from .output import print, run_shown
+from .versions import rpm_key, RELEASE_MIN, RELEASE_MAX
 
 # --- Add colors for warnings ---
 YELLOW = '\033[1;33m'
 RED = '\033[0;31m'
+GREEN = '\033[0;32m'
+BLUE = '\033[0;34m'
 NC = '\033[0m'
 
+# System-wide Flatpak installation (flatpak honours the same variable)
+FLATPAK_SYSTEM_DIR = os.environ.get("FLATPAK_SYSTEM_DIR", "/var/lib/flatpak")
+
+# fsync shim for 'sync --ephemeral': the eatmydata wrapper, or its library for LD_PRELOAD
+EATMYDATA_LIB_GLOBS = ["/usr/lib/*/libeatmydata.so*", "/usr/lib64/libeatmydata.so*", "/usr/lib/libeatmydata.so*"]
+# Inserted after 'sudo' in every command while an ephemeral sync runs, since
+# sudo drops LD_PRELOAD and most other variables: ['env', 'K=V', ..., '/usr/bin/eatmydata'].
+# A contextvar, like the message sink in output.py: the commands are built by
+# module-level helpers, and only the sync that enabled it may see it.
+_ephemeral_prefix = contextvars.ContextVar("wcli_ephemeral_prefix", default=())
+# Paths 'sync --ephemeral' keeps out of the root, as shell globs
+EPHEMERAL_EXCLUDES = ["/usr/share/doc/*", "/usr/share/man/*", "/usr/share/info/*", "/usr/share/locale/*"]
+RPM_EPHEMERAL_MACROS = "/etc/rpm/macros.wcli-ephemeral"
+EPHEMERAL_HEADER = "# Written by 'wcli sync --ephemeral' for the length of one sync. Do not edit.\n"
+
+# rpm's digest algorithm numbers (FILEDIGESTALGO), as hashlib names
+RPM_DIGEST_ALGOS = {"1": "md5", "2": "sha1", "8": "sha256", "9": "sha384", "10": "sha512", "11": "sha224"}
+RPMFILE_UNCHECKED = 1 | 64 # %config and %ghost files: expected to differ from their digests
+PACKAGE_LOCK_WAIT = 600 # Default seconds to wait for a package manager lock (package_lock_timeout)
+PROC_LOCKS = "/proc/locks"
+# inotify(7) events on a lock file's directory that can mean it was released
+LOCK_RELEASE_EVENTS = 0x8 | 0x10 | 0x40 | 0x200 # IN_CLOSE_WRITE, IN_CLOSE_NOWRITE, IN_MOVED_FROM, IN_DELETE
+
+def ephemeral_cmd(cmd: list) -> list:
+    """cmd with the ephemeral prefix after its leading 'sudo', if this context runs an ephemeral sync."""
+    prefix = _ephemeral_prefix.get()
+    if prefix and cmd[:1] == ["sudo"]:
+        return cmd[:1] + list(prefix) + cmd[1:]
+    return cmd
+
 def _run_cmd_interactive(cmd: list) -> bool:
     """
     Helper to run an interactive command (like flatpak install)
     that streams output to the user.
     """
     try:
-        subprocess.run(cmd, check=True)
+        run_shown(ephemeral_cmd(cmd), check=True)
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
@@ -22,11 +65,235 @@ def _run_cmd_interactive(cmd: list) -> bool:
         print(f"\n{YELLOW}Command cancelled.{NC}")
         return False
 
+def _locked_by(path: str) -> list:
+    """PIDs holding a flock/fcntl lock on path, read from /proc/locks."""
+    try:
+        st = os.stat(path)
+        with open(PROC_LOCKS) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    wanted = (os.major(st.st_dev), os.minor(st.st_dev), st.st_ino)
+    pids = []
+    for fields in (line.split() for line in lines):
+        if "->" in fields: # Blocked waiters are listed too
+            continue
+        for i, field in enumerate(fields[1:], 1):
+            if field.count(":") != 2:
+                continue
+            major, minor, inode = field.split(":")
+            try:
+                if (int(major, 16), int(minor, 16), int(inode)) == wanted:
+                    pid = int(fields[i - 1])
+                    pids.append(pid if pid > 0 else None) # OFD locks have no owner PID
+            except ValueError:
+                pass
+            break
+    return pids
+
+def _pid_file_holder(path: str) -> list:
+    """The live PID a pid file names, as a one-item list."""
+    try:
+        with open(path) as f:
+            pid = int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return []
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            state = f.read().rpartition(")")[2].split()[0]
+    except (OSError, IndexError):
+        return []
+    return [] if state in ("Z", "X") else [pid] # An exited, unreaped holder is gone too
+
+def _opened_by(path: str) -> list:
+    """PIDs with path open, as far as /proc lets this user see; [None] if none are visible."""
+    pids = []
+    for fd_dir in glob.glob("/proc/[0-9]*/fd"):
+        try:
+            if any(os.readlink(os.path.join(fd_dir, fd)) == path for fd in os.listdir(fd_dir)):
+                pids.append(int(fd_dir.split("/")[2]))
+        except OSError:
+            continue
+    return pids or [None]
+
+def describe_pid(pid) -> str:
+    """"PID 123 (apt-get install foo)" from /proc/PID/cmdline."""
+    if pid is None:
+        return "an unknown process"
+    try:
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            cmdline = f.read().replace(b"\0", b" ").decode(errors='replace').strip()
+    except OSError:
+        cmdline = ""
+    if len(cmdline) > 80:
+        cmdline = cmdline[:77] + "..."
+    return f"PID {pid} ({cmdline})" if cmdline else f"PID {pid}"
+
+def _watch_dirs(paths: list):
+    """An inotify fd reporting closes and deletes in the directories of paths, or None without inotify."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    watched = [d for d in sorted({os.path.dirname(p) for p in paths})
+               if libc.inotify_add_watch(fd, os.fsencode(d), LOCK_RELEASE_EVENTS) >= 0]
+    if not watched:
+        os.close(fd)
+        return None
+    return fd
+
+def order_build_waves(graph: dict) -> list:
+    """
+    Groups the nodes of a dependency graph { name: {deps, ...} } into waves.
+    Every node in a wave only depends on nodes of earlier waves, so the
+    members of one wave can be built concurrently. Deps outside the graph
+    are ignored.
+    Returns: [[name, ...], ...]
+    """
+    graph = {name: set(deps) & set(graph) - {name} for name, deps in graph.items()}
+    waves = []
+    done = set()
+    while len(done) < len(graph):
+        wave = sorted(n for n, deps in graph.items() if n not in done and deps <= done)
+        if not wave:
+            cycle = sorted(n for n in graph if n not in done)
+            raise ValueError(f"dependency cycle between: {', '.join(cycle)}")
+        waves.append(wave)
+        done.update(wave)
+    return waves
+
+def write_root_file(path: str, content: str) -> bool:
+    """Writes a root-owned config file through 'sudo tee'."""
+    try:
+        subprocess.run(["sudo", "mkdir", "-p", os.path.dirname(path)], check=True)
+        subprocess.run(["sudo", "tee", path], input=content, text=True, stdout=subprocess.DEVNULL, check=True)
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+def diff_holds(wanted: dict, previous: dict) -> (list, list):
+    """
+    Splits a hold change into (to_add, to_remove) package names.
+    A pin whose version or type changed shows up in both lists.
+    """
+    to_remove = sorted(n for n in previous if previous[n] != wanted.get(n))
+    to_add = sorted(n for n in wanted if wanted[n] != previous.get(n))
+    return to_add, to_remove
+
+def format_age(seconds: float) -> str:
+    """3725 -> '1h2m'"""
+    seconds = int(seconds)
+    if seconds < 60: return f"{seconds}s"
+    if seconds < 3600: return f"{seconds // 60}m"
+    if seconds < 86400: return f"{seconds // 3600}h{seconds % 3600 // 60}m"
+    return f"{seconds // 86400}d{seconds % 86400 // 3600}h"
+
+def read_repo_files(paths: list) -> dict:
+    """
+    Parses INI-style repo files (yum/zypp '.repo', Portage repos.conf)
+    into {section: {key: value}}. Unreadable files are skipped.
+    """
+    sections = {}
+    for path in paths:
+        parser = configparser.RawConfigParser(strict=False)
+        try:
+            parser.read(path)
+        except (configparser.Error, UnicodeDecodeError, OSError):
+            continue
+        for section in parser.sections():
+            sections[section] = dict(parser.items(section))
+    return sections
+
+def dependency_closure_of(names: set, depends: dict, provides: dict) -> set:
+    """
+    'names' plus everything they pull in. 'depends' maps installed packages
+    to the names they require; names that are not packages themselves are
+    looked up in 'provides' ({virtual name: [packages]}).
+    """
+    closure, stack = set(), list(names)
+    while stack:
+        name = stack.pop()
+        if name in closure:
+            continue
+        closure.add(name)
+        for dep in depends.get(name, []):
+            stack.extend([dep] if dep in depends else provides.get(dep, []))
+    return closure
+
+def split_rpm_filename(filename: str):
+    """'foo-bar-1.2-3.fc40.x86_64.rpm' -> ('foo-bar', '1.2-3.fc40'); None for .src.rpm and non-rpms."""
+    if not filename.endswith(".rpm") or filename.endswith(".src.rpm"):
+        return None
+    parts = filename[:-len(".rpm")].rsplit(".", 1)[0].rsplit("-", 2)
+    if len(parts) != 3:
+        return None
+    return parts[0], f"{parts[1]}-{parts[2]}"
+
+def rpm_ephemeral_macros() -> str:
+    """rpm macros for an ephemeral sync: no fsync of installed files, no docs, only the C and English locales."""
+    return "%_flush_io 0\n%_excludedocs 1\n%_install_langs C:en:en_US\n"
+
+def rpm_dependency_closure(names: set) -> set:
+    """dependency_closure() for rpm-based systems, from one 'rpm -qa' query."""
+    try:
+        proc = subprocess.run(["rpm", "-qa", "--qf", "%{NAME}\t[%{REQUIRENAME} ]\t[%{PROVIDENAME} ]\n"],
+                              capture_output=True, text=True, check=True, errors='ignore')
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    depends, provides = {}, {}
+    for line in proc.stdout.splitlines():
+        name, requires, provided = (line.split("\t") + ["", ""])[:3]
+        depends.setdefault(name, []).extend(r for r in requires.split() if not r.startswith("rpmlib("))
+        for virtual in provided.split():
+            provides.setdefault(virtual, []).append(name)
+    return dependency_closure_of(names, depends, provides)
+
+def rpm_file_digests(packages: dict) -> dict:
+    """package_file_digests() for rpm-based systems, from one 'rpm -q' query."""
+    if not packages:
+        return {}
+    # '%{=TAG}' repeats a scalar tag on every line of the per-file iteration
+    qf = "[%{=NAME}\t%{=FILEDIGESTALGO}\t%{FILEFLAGS}\t%{FILESTATES}\t%{FILEDIGESTS}\t%{FILENAMES}\n]"
+    try:
+        proc = subprocess.run(["rpm", "-q", "--qf", qf] + sorted(packages), capture_output=True, text=True, errors='surrogateescape')
+    except FileNotFoundError:
+        return None
+    digests = {}
+    for line in proc.stdout.splitlines():
+        fields = line.split("\t", 5)
+        if len(fields) != 6:
+            continue # "package foo is not installed"
+        name, algo, flags, state, digest, path = fields
+        if not digest or state != "0" or int(flags) & RPMFILE_UNCHECKED:
+            continue # Directories, links, files not installed (e.g. excluded docs), config files
+        digests.setdefault(name, []).append((path, RPM_DIGEST_ALGOS.get(algo, "md5"), digest))
+    return digests
+
 class BaseProvider(ABC):
     """
     Abstract base class defining the interface for all distro providers.
     """
 
+    # --- Repository metadata freshness ---
+    # Seconds a metadata refresh stays valid. None means always refresh.
+    max_metadata_age = None
+    # Glob patterns of on-disk metadata files, for metadata_fingerprint().
+    # Their mtimes are the mirrors' modification times, not refresh times.
+    metadata_globs = []
+    # Files whose mtime marks the last complete refresh: the package
+    # manager's own success stamps, and 'refresh_stamp', which wcli sets
+    # and touches after each complete refresh it runs.
+    refresh_stamps = []
+    refresh_stamp = None
+
+    def __init__(self):
+        # [{"action": "refreshed"|"skipped", "seconds": float, "age": float|None}]
+        self.refresh_events = []
+        self._version_keys = {}
+
     @abstractmethod
     def install(self, packages: list) -> bool:
         """Install a list of packages."""
@@ -87,6 +354,378 @@ class BaseProvider(ABC):
         """Prints installed, available, and cached versions of a package."""
         pass
 
+    # --- Native Version Keys ---
+    # Pure-Python equivalents of the native comparison, so checking a whole
+    # package set costs no subprocesses. Providers override segment_key()
+    # and, if their format differs, split_version().
+
+    def segment_key(self, version: str) -> tuple:
+        return rpm_key(version)
+
+    def split_version(self, version: str) -> (int, str, str):
+        """'1:2.0-3' -> (1, '2.0', '3'). Release is None when absent."""
+        epoch = 0
+        match = re.match(r"^(\d+):(.*)$", version)
+        if match:
+            epoch, version = int(match.group(1)), match.group(2)
+        if "-" in version:
+            version, release = version.rsplit("-", 1)
+            return epoch, version, release
+        return epoch, version, None
+
+    def version_key(self, version: str) -> tuple:
+        """A sortable key for an installed (full) version string. Cached per version."""
+        key = self._version_keys.get(version)
+        if key is None:
+            epoch, ver, release = self.split_version(version)
+            release_key = (1, self.segment_key(release)) if release is not None else (1, ())
+            key = (epoch, self.segment_key(ver), release_key)
+            self._version_keys[version] = key
+        return key
+
+    def version_range(self, version: str) -> (tuple, tuple):
+        """
+        The (lo, hi) keys a constraint version covers. Without a release
+        ('1.2') it covers every release of that version.
+        """
+        epoch, ver, release = self.split_version(version)
+        if release is not None:
+            key = self.version_key(version)
+            return key, key
+        ver_key = self.segment_key(ver)
+        return (epoch, ver_key, RELEASE_MIN), (epoch, ver_key, RELEASE_MAX)
+
+    # --- Metadata Freshness Policy ---
+
+    def metadata_age(self):
+        """
+        Seconds since the last complete refresh, from the newest refresh
+        stamp. None if no refresh was ever recorded.
+        """
+        mtimes = []
+        for path in self.refresh_stamps + ([self.refresh_stamp] if self.refresh_stamp else []):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except OSError:
+                pass
+        if not mtimes:
+            return None
+        return max(0.0, time.time() - max(mtimes))
+
+    def metadata_fingerprint(self) -> str:
+        """
+        Hash of the metadata files' names, sizes and mtimes. It changes
+        whenever a refresh brought anything new; "none" if nothing is on disk.
+        """
+        digest = hashlib.sha256()
+        found = False
+        for pattern in self.metadata_globs:
+            for path in sorted(glob.glob(pattern)):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+                found = True
+        return digest.hexdigest()[:16] if found else "none"
+
+    def metadata_is_fresh(self) -> bool:
+        if self.max_metadata_age is None:
+            return False
+        age = self.metadata_age()
+        return age is not None and age < self.max_metadata_age
+
+    def refresh_metadata(self, force: bool = False, repos: list = None) -> bool:
+        """
+        Refreshes repository metadata unless it is younger than max_metadata_age.
+        force=True is for newly added repos (PPA, COPR, OBS, overlay), whose
+        metadata is never on disk yet; providers that can refresh single repos
+        only touch the ones passed in 'repos'.
+        """
+        age = self.metadata_age()
+        age = round(age) if age is not None else None
+        if not force and self.metadata_is_fresh():
+            print(f"{GREEN}Repository metadata is {format_age(age)} old (max {format_age(self.max_metadata_age)}), skipping refresh.{NC}")
+            self.refresh_events.append({"action": "skipped", "seconds": 0.0, "age": age})
+            return True
+        start = time.monotonic()
+        ok = self._refresh_metadata(repos)
+        if ok and not repos and self.refresh_stamp:
+            try:
+                with open(self.refresh_stamp, 'a'):
+                    os.utime(self.refresh_stamp)
+            except OSError as e:
+                print(f"{YELLOW}Warning: Could not record the refresh in {self.refresh_stamp}: {e}{NC}")
+        self.refresh_events.append({"action": "refreshed", "seconds": round(time.monotonic() - start, 2), "age": age, "forced": force, "ok": ok})
+        return ok
+
+    def _refresh_metadata(self, repos: list = None) -> bool:
+        """Runs the native metadata refresh (apt update, pacman -Sy, ...)."""
+        return True
+
+    # --- Package Manager Locks ---
+    # (kind, path) of the locks the native package manager takes for a
+    # transaction: "fcntl" for flock/fcntl locks (listed in /proc/locks),
+    # "pidfile" for files naming the holder's PID, "exists" for lock files
+    # that exist only while held.
+    package_locks = []
+    package_lock_timeout = PACKAGE_LOCK_WAIT
+
+    # --- Failure Attribution ---
+    # A failed call does not mean each package it was given failed: a lock
+    # timeout stops before the package manager runs, and one bad name fails
+    # a whole single-transaction install. 'sync' calls start_failure_report()
+    # before each stage. install() sets failed_packages to the names that
+    # really failed, when it can tell; lock_timed_out records a timeout.
+    failed_packages = None
+    lock_timed_out = False
+
+    def start_failure_report(self):
+        self.failed_packages = None
+        self.lock_timed_out = False
+
+    def package_lock_holders(self) -> list:
+        """[(lock path, holder PID or None)] for the package manager locks held right now."""
+        held = []
+        for kind, path in self.package_locks:
+            if kind == "fcntl":
+                pids = _locked_by(path)
+            elif kind == "pidfile":
+                pids = _pid_file_holder(path)
+            else:
+                pids = _opened_by(path) if os.path.exists(path) else []
+            held.extend((path, pid) for pid in pids if pid != os.getpid())
+        return held
+
+    def wait_for_package_lock(self) -> bool:
+        """
+        Called before each transaction. If another process (unattended-upgrades,
+        PackageKit, a manual pacman) holds the package manager lock, waits for
+        it to be released, up to package_lock_timeout seconds. Wakes up on
+        inotify events in the lock's directory, and polls as a fallback.
+        """
+        held = self.package_lock_holders()
+        if not held:
+            return True
+        start = time.monotonic()
+        next_report = start
+        watch = _watch_dirs([path for _, path in self.package_locks])
+        try:
+            while held:
+                path, pid = held[0]
+                waited = time.monotonic() - start
+                if waited >= self.package_lock_timeout:
+                    print(f"{RED}Error: Timed out after {int(waited)}s waiting for {path}, held by {describe_pid(pid)}.{NC}")
+                    print("Set 'package_lock_timeout' in config.yaml to wait longer.")
+                    if pid is None and os.path.exists(path):
+                        print(f"If no package manager is running, the lock is stale: sudo rm {path}")
+                    self.lock_timed_out = True
+                    return False
+                if time.monotonic() >= next_report:
+                    print(f"{YELLOW}Waiting for {path}, held by {describe_pid(pid)} ({int(waited)}s/{self.package_lock_timeout}s)...{NC}")
+                    next_report += 10
+                timeout = max(0.0, min(5.0, self.package_lock_timeout - waited))
+                if watch is None:
+                    time.sleep(min(1.0, timeout))
+                elif select.select([watch], [], [], timeout)[0]:
+                    try:
+                        while os.read(watch, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+                held = self.package_lock_holders()
+        finally:
+            if watch is not None:
+                os.close(watch)
+        print(f"{GREEN}Package manager lock released after {int(time.monotonic() - start)}s.{NC}")
+        return True
+
+    # --- Ephemeral Installs ---
+    # 'sync --ephemeral' is for throwaway roots (image builds, CI). For that
+    # one run, fsyncs are skipped through eatmydata, and docs and locales are
+    # not unpacked. ephemeral_files() are native config drop-ins written
+    # before the sync and removed after it; ephemeral_env is passed to every
+    # command run through sudo.
+    ephemeral_env = {}
+
+    def ephemeral_files(self) -> dict:
+        """{path: content} of the config drop-ins for an ephemeral sync."""
+        return {}
+
+    def enable_ephemeral(self) -> bool:
+        """Writes the drop-ins and sets the ephemeral prefix. False if any part failed (nothing is reverted)."""
+        env = [f"{key}={value}" for key, value in self.ephemeral_env.items()]
+        wrapper = []
+        if shutil.which("eatmydata"):
+            wrapper = [shutil.which("eatmydata")]
+        else:
+            libs = [path for pattern in EATMYDATA_LIB_GLOBS for path in sorted(glob.glob(pattern))]
+            if libs:
+                env.append(f"LD_PRELOAD={libs[0]}")
+            else:
+                print(f"{YELLOW}Warning: eatmydata is not installed; package managers will still fsync.{NC}")
+        all_ok = True
+        for path, content in self.ephemeral_files().items():
+            print(f"{BLUE}Writing {path}...{NC}")
+            all_ok = write_root_file(path, EPHEMERAL_HEADER + content) and all_ok
+        _ephemeral_prefix.set(tuple((["env"] + env if env else []) + wrapper))
+        return all_ok
+
+    def disable_ephemeral(self) -> bool:
+        """Reverts enable_ephemeral(). Also cleans up after an ephemeral sync that was killed."""
+        _ephemeral_prefix.set(())
+        leftovers = self.ephemeral_leftovers()
+        if not leftovers:
+            return True
+        return _run_cmd_interactive(["sudo", "rm", "-f"] + leftovers)
+
+    def ephemeral_leftovers(self) -> list:
+        """Drop-ins of an ephemeral sync that are still in place."""
+        return [path for path in self.ephemeral_files() if os.path.exists(path)]
+
+    # --- Persistent Version Holds ---
+    # Providers that set this keep exact/maximum pins as native state
+    # (apt holds, dnf versionlock, ...), so 'update' needs no ignore list.
+    supports_holds = False
+
+    def sync_holds(self, wanted: dict, previous: dict) -> bool:
+        """
+        Reconciles native holds from 'previous' to 'wanted'.
+        Both are {pkg_name: {"type": "exact"|"maximum", "version": str}}.
+        Only called when the two differ.
+        """
+        return False
+
+    # --- Declared-only Updates ---
+
+    def upgradable_packages(self, names: list) -> dict:
+        """
+        {name: {"version", "size"}} for those of 'names' that have a newer
+        version in the repo metadata on disk (nothing is refreshed). 'size'
+        is the download size in bytes, or None if unknown.
+        Returns None if this provider cannot tell.
+        """
+        return None
+
+    def upgrade_packages(self, names: list) -> bool:
+        """Upgrades exactly these packages, plus what their new versions require, in one transaction."""
+        print(f"{YELLOW}Warning: Declared-only updates are not supported by the {self.__class__.__name__} provider.{NC}")
+        return False
+
+    # --- Package Cache Bundles ---
+    # Where downloaded package files are kept. 'package_cache_dir' is where
+    # an imported bundle is seeded; the globs list every file to index.
+    package_cache_dir = None
+    package_cache_globs = []
+    # 'seed' copies bundle files into package_cache_dir, 'repo' registers
+    # the bundle as a local repository (see _register_bundle_repo)
+    bundle_import_mode = "seed"
+
+    def parse_package_filename(self, filename: str):
+        """(name, version) for a package file name, or None if it is not one."""
+        return None
+
+    def bundle_relpath(self, path: str) -> str:
+        """Where a cached file goes inside a bundle (and back under package_cache_dir)."""
+        return os.path.basename(path)
+
+    def cached_package_files(self) -> dict:
+        """{(name, version): path} for every package file in the native caches."""
+        files = {}
+        for pattern in self.package_cache_globs:
+            for path in sorted(glob.glob(pattern)):
+                parsed = self.parse_package_filename(os.path.basename(path))
+                if parsed and parsed not in files:
+                    files[parsed] = path
+        return files
+
+    def dependency_closure(self, names: set) -> set:
+        """
+        'names' plus every installed package they depend on, read from the
+        local package database. Returns None if this provider cannot tell.
+        """
+        return None
+
+    def import_package_bundle(self, bundle_dir: str, files: list, mode: str = None) -> bool:
+        """
+        Makes a verified bundle's package files (relative paths) usable by
+        the package manager without network access.
+        """
+        mode = mode or self.bundle_import_mode
+        if mode == "repo":
+            return self._register_bundle_repo(os.path.abspath(bundle_dir), files)
+        if not self.package_cache_dir:
+            print(f"{YELLOW}Warning: {self.__class__.__name__} has no package cache to seed.{NC}")
+            return False
+        print(f"{BLUE}Seeding {self.package_cache_dir} with {len(files)} package files...{NC}")
+        try:
+            subprocess.run(["sudo", "mkdir", "-p", self.package_cache_dir], check=True)
+            subprocess.run(["sudo", "cp", "--parents", "--preserve=timestamps", "-t", self.package_cache_dir] + list(files),
+                           cwd=bundle_dir, check=True)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"{RED}Error: Could not copy package files: {e}{NC}")
+            return False
+        return self._after_seed()
+
+    def _after_seed(self) -> bool:
+        """Reindexes the cache after seeding, where the package manager needs that."""
+        return True
+
+    def _register_bundle_repo(self, bundle_dir: str, files: list) -> bool:
+        print(f"{YELLOW}Warning: Registering a bundle as a repository is not supported by {self.__class__.__name__}. Use '--mode seed'.{NC}")
+        return False
+
+    # --- Integrity Verification ---
+
+    def package_file_digests(self, packages: dict) -> dict:
+        """
+        {name: [(path, algo, hex digest)]} for the regular files of the
+        installed 'packages' ({name: version}), as recorded in the native
+        package database. Config files are left out: they are meant to be
+        edited. Returns None if this provider cannot tell.
+        """
+        return None
+
+    # --- Helper Repo State ---
+    # Declared helper maps this provider handles ("fedora_copr", ...)
+    helper_repo_kinds = ()
+
+    def enabled_helper_repos(self) -> set:
+        """
+        Helper repos (COPRs, PPAs, OBS repos, overlays) enabled on this
+        system, read from the package manager's repo config files.
+        """
+        return set()
+
+    def helper_repo_enabled(self, repo: str, enabled: set) -> bool:
+        return repo in enabled
+
+    def installed_name(self, package: str) -> str:
+        """The key a declared helper package has in get_installed_packages_with_versions()."""
+        return package
+
+    def outdated_src_packages(self, packages: list, installed: dict) -> list:
+        """Installed source-built packages whose recipe now builds a newer version."""
+        return []
+
+    def pending_helper_work(self, kind: str, repo_map: dict, installed: dict, enabled: set = None) -> dict:
+        """
+        Trims a declared {repo: packages} map to real drift: repos that are
+        not enabled yet (with an empty list if only enabling is needed),
+        and packages that are not installed. 'enabled' is a prior
+        enabled_helper_repos() result; it is read fresh if not given.
+        """
+        if kind not in self.helper_repo_kinds or not repo_map:
+            return {}
+        if enabled is None:
+            enabled = self.enabled_helper_repos()
+        pending = {}
+        for repo, packages in repo_map.items():
+            missing = sorted(p for p in packages if self.installed_name(p) not in installed)
+            if missing or not self.helper_repo_enabled(repo, enabled):
+                pending[repo] = missing
+        return pending
+
     # --- Optional Helper Methods ---
     
     def _unsupported(self, feature_name: str) -> bool:
@@ -106,25 +745,96 @@ class BaseProvider(ABC):
     def install_overlay(self, overlay_map: dict) -> bool: return self._unsupported("Gentoo Overlay")
     def install_src(self, packages: list) -> bool: return self._unsupported("Void Src")
 
-    def install_flatpak(self, packages: list) -> bool:
+    # --- Flatpak ---
+
+    def get_installed_flatpaks(self) -> dict:
         """
-        Installs a list of Flatpaks.
+        Returns {app_id: {"branch", "commit"}} for system-wide apps.
+        Read straight from the deploy directories (each branch's 'active'
+        symlink names the deployed commit); 'flatpak list' is only the
+        fallback when they are not there.
         """
+        apps = {}
+        app_dir = os.path.join(FLATPAK_SYSTEM_DIR, "app")
+        if os.path.isdir(app_dir):
+            machine = os.uname().machine
+            for active in sorted(glob.glob(os.path.join(app_dir, "*", "*", "*", "active"))):
+                app_id, arch, branch = active.split(os.sep)[-4:-1]
+                if app_id in apps and arch != machine:
+                    continue
+                try:
+                    apps[app_id] = {"branch": branch, "commit": os.path.basename(os.readlink(active))}
+                except OSError:
+                    continue
+            return apps
+
+        if not shutil.which("flatpak"):
+            return apps
+        try:
+            output = subprocess.run(["flatpak", "list", "--app", "--system", "--columns=application,branch,active:f"],
+                                    capture_output=True, text=True, check=True).stdout
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            print(f"{YELLOW}Warning: Could not list installed Flatpaks: {e}{NC}")
+            return apps
+        for line in output.splitlines():
+            parts = line.split("\t")
+            if len(parts) >= 3:
+                apps[parts[0]] = {"branch": parts[1], "commit": parts[2]}
+        return apps
+
+    def _flatpak_ready(self, remote: str = "flathub") -> bool:
+        """Checks for the flatpak binary, and adds flathub unless the system repo config already has it."""
         if not shutil.which("flatpak"):
             print(f"{RED}Error: 'flatpak' command not found. Cannot install Flatpaks.{NC}")
             deps = self.get_deps()
             print(f"Please install it first: {deps.get('flatpak', 'sudo <your-package-manager> install flatpak')}")
             return False
-        
+        if remote != "flathub":
+            return True
         try:
-            repo_list = subprocess.run(["flatpak", "remotes", "--columns=name"], capture_output=True, text=True, check=True).stdout
-            if "flathub" not in repo_list:
-                print(f"{YELLOW}Warning: 'flathub' remote not found. Adding it now...{NC}")
-                if not _run_cmd_interactive(["sudo", "flatpak", "remote-add", "--if-not-exists", "flathub", "https://flathub.org/repo/flathub.flatpakrepo"]):
-                    print(f"{RED}Error: Failed to add 'flathub' remote. Cannot install packages.{NC}")
-                    return False
-        except Exception as e:
-            print(f"{RED}Error checking flatpak remotes: {e}{NC}")
+            with open(os.path.join(FLATPAK_SYSTEM_DIR, "repo", "config")) as f:
+                if '[remote "flathub"]' in f.read():
+                    return True
+        except OSError:
+            pass
+        print(f"{YELLOW}Warning: 'flathub' remote not found. Adding it now...{NC}")
+        if not _run_cmd_interactive(["sudo", "flatpak", "remote-add", "--if-not-exists", "flathub", "https://flathub.org/repo/flathub.flatpakrepo"]):
+            print(f"{RED}Error: Failed to add 'flathub' remote. Cannot install packages.{NC}")
             return False
+        return True
+
+    def install_flatpak(self, packages: list, remote: str = "flathub") -> bool:
+        """
+        Installs a list of Flatpaks from one remote in a single transaction.
+        """
+        if not packages:
+            return True
+        if not self._flatpak_ready(remote):
+            return False
+        return _run_cmd_interactive(["sudo", "flatpak", "install", "-y", "--noninteractive", remote] + list(packages))
+
+    def pin_flatpaks(self, pins: dict) -> bool:
+        """
+        Moves each app in {app_id: commit} to its commit, then masks the
+        pinned apps so a plain 'flatpak update' leaves them alone.
+        """
+        if not pins:
+            return True
+        ok = True
+        for app_id, commit in pins.items():
+            if not _run_cmd_interactive(["sudo", "flatpak", "update", "-y", "--noninteractive", f"--commit={commit}", app_id]):
+                print(f"{RED}Error: Failed to move {app_id} to commit {commit}{NC}")
+                ok = False
+        return _run_cmd_interactive(["sudo", "flatpak", "mask"] + list(pins)) and ok
+
+    def unpin_flatpaks(self, apps: list) -> bool:
+        """Removes the update masks set by pin_flatpaks()."""
+        if not apps:
+            return True
+        return _run_cmd_interactive(["sudo", "flatpak", "mask", "--remove"] + list(apps))
 
-        return _run_cmd_interactive(["sudo", "flatpak", "install", "-y", "--non-interactive", "flathub"] + packages)
+    def remove_flatpak(self, packages: list) -> bool:
+        """Uninstalls a list of Flatpaks in one transaction."""
+        if not packages:
+            return True
+        return _run_cmd_interactive(["sudo", "flatpak", "uninstall", "-y", "--noninteractive"] + list(packages))
@@ -2,9 +2,13 @@
 import subprocess
 import os
 import shutil
+import glob
 import re
 from pathlib import Path
-from .base_provider import BaseProvider
+from urllib.parse import unquote
+from .base_provider import BaseProvider, write_root_file, diff_holds, dependency_closure_of, ephemeral_cmd, EPHEMERAL_EXCLUDES
+from .output import print, run_shown
+from .versions import dpkg_key
 
 YELLOW = '\033[1;33m'
 RED = '\033[0;31m'
@@ -12,12 +16,22 @@ NC = '\033[0m'
 GREEN = '\033[0;32m'
 BLUE = '\033[0;34m'
 
+APT_PREFERENCES_FILE = "/etc/apt/preferences.d/wcli-pins"
+APT_SOURCES_LIST = "/etc/apt/sources.list"
+APT_SOURCES_DIR = "/etc/apt/sources.list.d"
+APT_BUNDLE_LIST = "/etc/apt/sources.list.d/wcli-bundle.list"
+DPKG_STATUS_FILE = "/var/lib/dpkg/status"
+DPKG_INFO_DIR = "/var/lib/dpkg/info"
+DPKG_DIVERSIONS_FILE = "/var/lib/dpkg/diversions"
+DPKG_EPHEMERAL_CFG = "/etc/dpkg/dpkg.cfg.d/wcli-ephemeral"
+PPA_URL_RE = re.compile(r"ppa\.launchpad(?:content)?\.net/([^/\s]+)/([^/\s]+)/")
+
 def _run_cmd_interactive(cmd: list) -> bool:
     """Helper to run an interactive subprocess command (like apt install)."""
     try:
         env = os.environ.copy()
         env["DEBIAN_FRONTEND"] = "noninteractive"
-        subprocess.run(cmd, check=True, env=env)
+        run_shown(ephemeral_cmd(cmd), check=True, env=env)
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
@@ -29,13 +43,23 @@ def _run_cmd_capture(cmd: list) -> subprocess.CompletedProcess:
     """Helper to run a non-interactive command and capture output."""
     env = os.environ.copy()
     env["DEBIAN_FRONTEND"] = "noninteractive"
-    return subprocess.run(cmd, capture_output=True, text=True, env=env, errors='ignore')
+    return subprocess.run(ephemeral_cmd(cmd), capture_output=True, text=True, env=env, errors='ignore')
 
 
 class Provider(BaseProvider):
     """Debian/Ubuntu provider implementation."""
+
+    metadata_globs = ["/var/lib/apt/lists/*_InRelease", "/var/lib/apt/lists/*_Release"]
+    refresh_stamps = ["/var/lib/apt/periodic/update-success-stamp"] # apt-daily and update-notifier touch it
+    supports_holds = True
+    helper_repo_kinds = ("debian_ppa",)
+    package_cache_dir = "/var/cache/apt/archives"
+    package_cache_globs = ["/var/cache/apt/archives/*.deb"]
+    package_locks = [("fcntl", "/var/lib/dpkg/lock-frontend"), ("fcntl", "/var/lib/dpkg/lock"),
+                     ("fcntl", "/var/cache/apt/archives/lock"), ("fcntl", "/var/lib/apt/lists/lock")]
     
     def __init__(self):
+        super().__init__()
         if not shutil.which("add-apt-repository"):
             print(f"{YELLOW}Warning: 'add-apt-repository' not found. PPAs will not work.{NC}")
             print("Please install 'software-properties-common'.")
@@ -58,31 +82,38 @@ class Provider(BaseProvider):
 
     def install(self, packages: list) -> bool:
         """Installs packages one-by-one to show progress."""
-        all_ok = True
+        failed = []
         total = len(packages)
         for i, pkg in enumerate(packages):
             print(f"\n--- Installing {pkg} ({i+1}/{total}) ---")
+            if not self.wait_for_package_lock():
+                self.failed_packages = failed # The rest were not attempted
+                return False
             if not _run_cmd_interactive(["sudo", "apt", "install", "-y", pkg]):
                 print(f"{YELLOW}Warning: Failed to install {pkg}{NC}")
-                all_ok = False
-        return all_ok
+                failed.append(pkg)
+        self.failed_packages = failed
+        return not failed
 
     def remove(self, packages: list) -> bool:
+        if not self.wait_for_package_lock():
+            return False
         return _run_cmd_interactive(["sudo", "apt", "remove", "-y"] + packages)
 
     def update(self, ignore_list: list) -> bool:
         """Updates packages, respecting holds."""
+        if not self.wait_for_package_lock():
+            return False
         if ignore_list:
             print(f"{YELLOW}Holding {len(ignore_list)} packages: {', '.join(ignore_list)}{NC}")
             if not _run_cmd_interactive(["sudo", "apt-mark", "hold"] + ignore_list):
                 print(f"{RED}Error setting package holds.{NC}")
                 return False
         
-        print(f"{BLUE}Running apt update...{NC}")
-        _run_cmd_interactive(["sudo", "apt", "update"])
+        self.refresh_metadata()
         
         print(f"{BLUE}Running apt upgrade...{NC}")
-        all_ok = _run_cmd_interactive(["sudo", "apt", "upgrade", "-y"])
+        all_ok = self.wait_for_package_lock() and _run_cmd_interactive(["sudo", "apt", "upgrade", "-y"])
         
         if ignore_list:
             print(f"{YELLOW}Un-holding {len(ignore_list)} packages...{NC}")
@@ -92,6 +123,68 @@ class Provider(BaseProvider):
         
         return all_ok
 
+    def upgradable_packages(self, names: list) -> dict:
+        """Reads 'apt list --upgradable', with sizes from 'apt-cache show'."""
+        wanted = {name.split(":")[0]: name for name in names}
+        proc = _run_cmd_capture(["apt", "list", "--upgradable"])
+        if proc.returncode != 0:
+            return None
+        upgrades = {}
+        for match in re.finditer(r"^([^/\s]+)/\S+\s+(\S+)\s+\S+\s+\[upgradable from", proc.stdout, re.M):
+            if match.group(1) in wanted:
+                upgrades[wanted[match.group(1)]] = {"version": match.group(2), "size": None}
+        if upgrades:
+            show = _run_cmd_capture(["apt-cache", "show"] + [f"{n.split(':')[0]}={u['version']}" for n, u in upgrades.items()])
+            for stanza in show.stdout.split("\n\n"):
+                name, size = re.search(r"^Package: (\S+)", stanza, re.M), re.search(r"^Size: (\d+)", stanza, re.M)
+                if name and size and name.group(1) in wanted and upgrades.get(wanted[name.group(1)], {}).get("size") is None:
+                    upgrades[wanted[name.group(1)]]["size"] = int(size.group(1))
+        return upgrades
+
+    def upgrade_packages(self, names: list) -> bool:
+        print(f"{BLUE}Running apt-get install --only-upgrade...{NC}")
+        if not self.wait_for_package_lock():
+            return False
+        return _run_cmd_interactive(["sudo", "apt-get", "install", "--only-upgrade", "-y"] + names)
+
+    def _refresh_metadata(self, repos: list = None) -> bool:
+        print(f"{BLUE}Running apt update...{NC}")
+        if not self.wait_for_package_lock():
+            return False
+        return _run_cmd_interactive(["sudo", "apt", "update"])
+
+    def sync_holds(self, wanted: dict, previous: dict) -> bool:
+        """
+        Exact pins become an apt preference at priority 1001, which keeps
+        (and if needed downgrades to) that version. Maximum pins become
+        'apt-mark hold'.
+        """
+        exact = {n: p for n, p in wanted.items() if p["type"] == "exact"}
+        old_exact = {n: p for n, p in previous.items() if p["type"] == "exact"}
+        all_ok = True
+        if exact != old_exact:
+            stanzas = [f"Package: {n}\nPin: version {p['version']}\nPin-Priority: 1001\n" for n, p in sorted(exact.items())]
+            print(f"{BLUE}Writing {len(exact)} exact pins to {APT_PREFERENCES_FILE}...{NC}")
+            all_ok = write_root_file(APT_PREFERENCES_FILE, "# Managed by wcli. Do not edit.\n\n" + "\n".join(stanzas))
+
+        maximum = {n: p for n, p in wanted.items() if p["type"] == "maximum"}
+        old_maximum = {n: p for n, p in previous.items() if p["type"] == "maximum"}
+        to_hold, to_unhold = diff_holds(maximum, old_maximum)
+        to_unhold = [n for n in to_unhold if n not in maximum]
+        if (to_hold or to_unhold) and not self.wait_for_package_lock():
+            return False
+        if to_unhold and not _run_cmd_interactive(["sudo", "apt-mark", "unhold"] + to_unhold):
+            all_ok = False
+        if to_hold and not _run_cmd_interactive(["sudo", "apt-mark", "hold"] + to_hold):
+            all_ok = False
+        return all_ok
+
+    def ephemeral_files(self) -> dict:
+        """dpkg unpacks without fsync (force-unsafe-io) and skips docs and locales, except copyright files."""
+        lines = ["force-unsafe-io"] + [f"path-exclude={path}" for path in EPHEMERAL_EXCLUDES]
+        lines += ["path-include=/usr/share/doc/*/copyright", "path-include=/usr/share/locale/locale.alias"]
+        return {DPKG_EPHEMERAL_CFG: "\n".join(lines) + "\n"}
+
     def search(self, package: str) -> bool:
         return _run_cmd_interactive(["apt", "search", package])
 
@@ -126,6 +219,9 @@ class Provider(BaseProvider):
         except (subprocess.CalledProcessError, FileNotFoundError):
             return pkg_map
             
+    def segment_key(self, version: str) -> tuple:
+        return dpkg_key(version)
+
     def compare_versions(self, v1: str, v2: str) -> int:
         if not self.can_compare: return 0
         try:
@@ -143,7 +239,9 @@ class Provider(BaseProvider):
         """Downgrades a package to a specific version."""
         print(f"  {BLUE}Attempting to install {package}={version}...{NC}")
         # apt install <pkg=version> is the standard way
-        if not _run_cmd_interactive(["sudo", "apt", "install", "-y", f"{package}={version}"]):
+        if not self.wait_for_package_lock():
+            return False
+        if not _run_cmd_interactive(["sudo", "apt", "install", "-y", "--allow-downgrades", "--allow-change-held-packages", f"{package}={version}"]):
             print(f"  {YELLOW}Could not install {package}={version}. It may not be available in your repos.{NC}")
             return False
         return True
@@ -192,22 +290,137 @@ class Provider(BaseProvider):
             }
         }
 
-    def install_ppa(self, ppa_map: dict) -> bool:
-        if not self.can_add_ppa:
-            print(f"{RED}Error: 'add-apt-repository' is not available. Cannot add PPAs.{NC}")
+    def parse_package_filename(self, filename: str):
+        """'libfoo1_1%3a2.3-1_amd64.deb' -> ('libfoo1', '1:2.3-1')"""
+        parts = filename[:-len(".deb")].split("_") if filename.endswith(".deb") else []
+        if len(parts) != 3:
+            return None
+        return parts[0], unquote(parts[1])
+
+    def dependency_closure(self, names: set) -> set:
+        """
+        Follows Depends/Pre-Depends (and Provides for virtual packages)
+        through the dpkg status file. Multi-Arch: same packages come back
+        arch-qualified ('libc6:amd64'), as dpkg-query lists them.
+        """
+        try:
+            with open(DPKG_STATUS_FILE, 'r') as f:
+                stanzas = f.read().split("\n\n")
+        except OSError:
+            return None
+        depends, provides, qualified = {}, {}, {}
+        strip = lambda dep: re.split(r"[\s(:]", dep.strip(), 1)[0]
+        for stanza in stanzas:
+            fields = dict(re.findall(r"^([\w-]+):[ \t]*(.*(?:\n[ \t].*)*)", stanza, re.M))
+            if "installed" not in fields.get("Status", "").split():
+                continue
+            name = fields["Package"]
+            if fields.get("Multi-Arch") == "same":
+                qualified[name] = f"{name}:{fields.get('Architecture')}"
+            # Every alternative of an 'a | b' clause counts; only installed ones resolve
+            depends[name] = [strip(alt) for key in ("Pre-Depends", "Depends")
+                             for alt in re.split(r"[,|]", fields.get(key, "")) if alt.strip()]
+            for virtual in fields.get("Provides", "").split(","):
+                if virtual.strip():
+                    provides.setdefault(strip(virtual), []).append(name)
+        closure = dependency_closure_of({n.split(":")[0] for n in names}, depends, provides)
+        return {qualified.get(name, name) for name in closure}
+
+    def package_file_digests(self, packages: dict) -> dict:
+        """
+        From /var/lib/dpkg/info/<package>.md5sums, which leaves conffiles
+        out. A file diverted by another package is checked where it was
+        moved to.
+        """
+        diversions = {} # {path: (diverted to, by package)}, from (from, to, package) line triples
+        try:
+            with open(DPKG_DIVERSIONS_FILE, 'r', errors='surrogateescape') as f:
+                lines = f.read().splitlines()
+            for i in range(0, len(lines) - 2, 3):
+                diversions[lines[i]] = (lines[i + 1], lines[i + 2])
+        except OSError:
+            pass
+        digests = {}
+        for name in packages:
+            try:
+                with open(os.path.join(DPKG_INFO_DIR, f"{name}.md5sums"), 'r', errors='surrogateescape') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue
+            files = []
+            for line in lines:
+                digest, _, path = line.partition("  ")
+                if not path:
+                    continue
+                path = "/" + path
+                if path in diversions and diversions[path][1] != name.split(":")[0]:
+                    path = diversions[path][0]
+                files.append((path, "md5", digest))
+            digests[name] = files
+        return digests
+
+    def _register_bundle_repo(self, bundle_dir: str, files: list) -> bool:
+        """Indexes the bundle with dpkg-scanpackages and adds it as a trusted flat 'file:' repo."""
+        if not shutil.which("dpkg-scanpackages"):
+            print(f"{RED}Error: 'dpkg-scanpackages' not found. Install 'dpkg-dev' or use '--mode seed'.{NC}")
             return False
-        
-        if not self.can_import_keys:
-            print(f"{RED}Error: 'dirmngr' is not installed. Cannot import PPA GPG keys.{NC}")
-            print(f"{YELLOW}Please run 'sudo apt install dirmngr' or add 'dirmngr' to your 'base.yaml' and run 'wcli sync' first.{NC}")
+        proc = _run_cmd_capture(["dpkg-scanpackages", "--multiversion", bundle_dir])
+        if proc.returncode != 0:
+            print(f"{RED}Error: dpkg-scanpackages failed: {proc.stderr}{NC}")
             return False
+        # Filenames in the index must be relative to the repo root
+        index = proc.stdout.replace(f"Filename: {bundle_dir}/", "Filename: ./")
+        with open(os.path.join(bundle_dir, "Packages"), 'w') as f:
+            f.write(index)
+        if not write_root_file(APT_BUNDLE_LIST, f"deb [trusted=yes] file:{bundle_dir} ./\n"):
+            print(f"{RED}Error: Could not write {APT_BUNDLE_LIST}{NC}")
+            return False
+        print(f"{GREEN}Registered {bundle_dir} in {APT_BUNDLE_LIST}{NC}")
+        return self.refresh_metadata(force=True)
+
+    def enabled_helper_repos(self) -> set:
+        """'ppa:owner/name' for every enabled PPA in the one-line (.list) and deb822 (.sources) files."""
+        ppas = set()
+        paths = [APT_SOURCES_LIST] + sorted(glob.glob(os.path.join(APT_SOURCES_DIR, "*.list")))
+        paths += sorted(glob.glob(os.path.join(APT_SOURCES_DIR, "*.sources")))
+        for path in paths:
+            try:
+                with open(path, 'r') as f:
+                    text = f.read()
+            except OSError:
+                continue
+            if path.endswith(".sources"):
+                entries = [s for s in re.split(r"\n\s*\n", text) if not re.search(r"^Enabled:\s*no", s, re.M | re.I)]
+            else:
+                entries = [line for line in text.splitlines() if not line.lstrip().startswith("#")]
+            for entry in entries:
+                ppas.update(f"ppa:{owner}/{name}" for owner, name in PPA_URL_RE.findall(entry))
+        return ppas
+
+    def install_ppa(self, ppa_map: dict) -> bool:
+        enabled = self.enabled_helper_repos()
+        if any(not self.helper_repo_enabled(ppa, enabled) for ppa in ppa_map):
+            if not self.can_add_ppa:
+                print(f"{RED}Error: 'add-apt-repository' is not available. Cannot add PPAs.{NC}")
+                return False
+            
+            if not self.can_import_keys:
+                print(f"{RED}Error: 'dirmngr' is not installed. Cannot import PPA GPG keys.{NC}")
+                print(f"{YELLOW}Please run 'sudo apt install dirmngr' or add 'dirmngr' to your 'base.yaml' and run 'wcli sync' first.{NC}")
+                return False
 
         all_ok = True
         all_packages_to_install = []
         needs_update = False
         
         for ppa, packages in ppa_map.items():
-            print(f"Checking PPA: {ppa}...")
+            if self.helper_repo_enabled(ppa, enabled):
+                all_packages_to_install.extend(packages)
+                continue
+            print(f"Adding PPA: {ppa}...")
+            if not self.wait_for_package_lock(): # add-apt-repository runs 'apt update'
+                all_ok = False
+                continue
             proc = _run_cmd_capture(["sudo", "add-apt-repository", "-y", ppa])
             
             if proc.returncode != 0:
@@ -224,8 +437,8 @@ class Provider(BaseProvider):
 
         
         if needs_update:
-            print("Running 'apt update' after adding new PPAs...")
-            if not _run_cmd_interactive(["sudo", "apt", "update"]):
+            print("Refreshing metadata after adding new PPAs...")
+            if not self.refresh_metadata(force=True):
                 print(f"{RED}Error: 'apt update' failed. Stopping PPA install.{NC}")
                 return False
         
@@ -1,7 +1,10 @@
 # providers/fedora.py
 import subprocess
 import re
-from .base_provider import BaseProvider
+import shutil
+from pathlib import Path
+from .base_provider import BaseProvider, diff_holds, read_repo_files, write_root_file, split_rpm_filename, rpm_dependency_closure, rpm_file_digests, ephemeral_cmd, rpm_ephemeral_macros, RPM_EPHEMERAL_MACROS
+from .output import print, run_shown
 
 # --- Add colors ---
 YELLOW = '\033[1;33m'
@@ -10,45 +13,122 @@ NC = '\033[0m'
 GREEN = '\033[0;32m'
 BLUE = '\033[0;34m'
 
+YUM_REPOS_DIR = "/etc/yum.repos.d"
+BUNDLE_REPO = "wcli-bundle"
+DNF5_EPHEMERAL_CONF = "/etc/dnf/libdnf5.conf.d/wcli-ephemeral.conf"
+COPR_URL_RE = re.compile(r"copr\.fedorainfracloud\.org/results/([^/]+)/([^/]+)/")
+
 def run_cmd(cmd: list) -> bool:
     """Helper to run an interactive command."""
     try:
-        # Use subprocess.run directly for output streaming
-        subprocess.run(cmd, check=True)
+        # Not captured, so the output streams
+        run_shown(ephemeral_cmd(cmd), check=True)
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
         
 def run_cmd_capture(cmd: list) -> subprocess.CompletedProcess:
     """Helper to run a non-interactive command and capture output."""
-    return subprocess.run(cmd, check=True, text=True, capture_output=True, errors='ignore')
+    return subprocess.run(ephemeral_cmd(cmd), check=True, text=True, capture_output=True, errors='ignore')
 
 class Provider(BaseProvider):
     """Fedora provider implementation."""
 
+    metadata_globs = ["/var/cache/dnf/*/repodata/repomd.xml", "/var/cache/libdnf5/*/repodata/repomd.xml"]
+    supports_holds = True
+    helper_repo_kinds = ("fedora_copr",)
+    # dnf keeps downloads only with keepcache=True; its cache is per-repo, so bundles become a local repo
+    package_cache_globs = ["/var/cache/dnf/*/packages/*.rpm", "/var/cache/libdnf5/*/packages/*.rpm"]
+    bundle_import_mode = "repo"
+    # rpm's transaction lock, and the pid files dnf 4 keeps for its own
+    package_locks = [("fcntl", "/var/lib/rpm/.rpm.lock"), ("pidfile", "/var/lib/dnf/rpmdb_lock.pid"),
+                     ("pidfile", "/var/cache/dnf/metadata_lock.pid")]
+
+    def _metadata_opts(self) -> list:
+        """Stops dnf from re-checking metadata that the freshness policy considers current."""
+        return ["--setopt=metadata_expire=-1"] if self.metadata_is_fresh() else []
+
+    def _refresh_metadata(self, repos: list = None) -> bool:
+        print(f"{BLUE}Refreshing dnf metadata...{NC}")
+        if not self.wait_for_package_lock():
+            return False
+        return run_cmd(["sudo", "dnf", "makecache", "--refresh"])
+
     def install(self, packages: list) -> bool:
         """Installs packages one-by-one to show progress."""
-        all_ok = True
+        failed = []
         total = len(packages)
         for i, pkg in enumerate(packages):
             # dnf install <pkg-version>
             pkg_name = pkg.replace("==", "-").replace("=", "-")
             print(f"\n--- Installing {pkg_name} ({i+1}/{total}) ---")
-            if not run_cmd(["sudo", "dnf", "install", "-y", pkg_name]):
+            if not self.wait_for_package_lock():
+                self.failed_packages = failed # The rest were not attempted
+                return False
+            if not run_cmd(["sudo", "dnf", "install", "-y"] + self._metadata_opts() + [pkg_name]):
                 print(f"{YELLOW}Warning: Failed to install {pkg_name}{NC}")
-                all_ok = False
-        return all_ok
+                failed.append(pkg)
+        self.failed_packages = failed
+        return not failed
 
     def remove(self, packages: list) -> bool:
+        if not self.wait_for_package_lock():
+            return False
         return run_cmd(["sudo", "dnf", "remove", "-y"] + packages)
 
     def update(self, ignore_list: list) -> bool:
-        cmd = ["sudo", "dnf", "update", "-y"]
+        if not self.refresh_metadata():
+            print(f"{RED}Error: Failed to refresh dnf metadata.{NC}")
+            return False
+        # Metadata is current now, whether refreshed or fresh enough
+        cmd = ["sudo", "dnf", "update", "-y", "--setopt=metadata_expire=-1"]
         if ignore_list:
             print(f"{YELLOW}Ignoring {len(ignore_list)} packages: {', '.join(ignore_list)}{NC}")
             for pkg in ignore_list:
                 cmd.append(f"--exclude={pkg}")
-        return run_cmd(cmd)
+        return self.wait_for_package_lock() and run_cmd(cmd)
+
+    def upgradable_packages(self, names: list) -> dict:
+        """'dnf repoquery --upgrades' from the metadata cache only."""
+        try:
+            result = subprocess.run(["dnf", "repoquery", "--cacheonly", "--upgrades", "--latest-limit=1",
+                                     "--qf", "%{name}\t%{version}-%{release}\t%{downloadsize}\n"] + names,
+                                    text=True, capture_output=True, errors='ignore')
+        except FileNotFoundError:
+            return None
+        if result.returncode != 0:
+            return None
+        wanted = set(names)
+        upgrades = {}
+        for line in result.stdout.splitlines():
+            parts = line.split("\t")
+            if len(parts) == 3 and parts[0] in wanted:
+                upgrades[parts[0]] = {"version": parts[1], "size": int(parts[2]) if parts[2].isdigit() else None}
+        return upgrades
+
+    def upgrade_packages(self, names: list) -> bool:
+        if not self.wait_for_package_lock():
+            return False
+        return run_cmd(["sudo", "dnf", "upgrade", "-y", "--setopt=metadata_expire=-1"] + names)
+
+    def sync_holds(self, wanted: dict, previous: dict) -> bool:
+        """
+        Uses 'dnf versionlock'. Exact pins lock the pinned version, so sync
+        can still move to it; maximum pins lock whatever is installed.
+        """
+        to_add, to_remove = diff_holds(wanted, previous)
+        all_ok = True
+        if to_remove and not run_cmd(["sudo", "dnf", "versionlock", "delete"] + to_remove):
+            all_ok = False
+        specs = [f"{n}-{wanted[n]['version']}" if wanted[n]["type"] == "exact" else n for n in to_add]
+        if specs and not run_cmd(["sudo", "dnf", "versionlock", "add"] + specs):
+            print(f"{YELLOW}Hint: 'dnf versionlock' needs {self.get_deps()['versionlock']}{NC}")
+            all_ok = False
+        return all_ok
+
+    def ephemeral_files(self) -> dict:
+        """rpm macros, plus 'tsflags=nodocs' for dnf5 (dnf 4 has no drop-in directory, so it still installs docs)."""
+        return {RPM_EPHEMERAL_MACROS: rpm_ephemeral_macros(), DNF5_EPHEMERAL_CONF: "[main]\ntsflags=nodocs\n"}
 
     def search(self, package: str) -> bool:
         return run_cmd(["dnf", "search", package])
@@ -103,6 +183,8 @@ class Provider(BaseProvider):
         """Downgrades a package to a specific version."""
         print(f"  {BLUE}Attempting to downgrade {package} to {version}...{NC}")
         # dnf downgrade <pkg-version>
+        if not self.wait_for_package_lock():
+            return False
         if not run_cmd(["sudo", "dnf", "downgrade", "-y", f"{package}-{version}"]):
             print(f"  {YELLOW}Could not downgrade {package}. It may not be available in your repos.{NC}")
             print(f"  {YELLOW}Try running: sudo dnf --showduplicates list {package}{NC}")
@@ -128,7 +210,8 @@ class Provider(BaseProvider):
             "timeshift": "sudo dnf install timeshift",
             "snapper": "sudo dnf install snapper",
             "flatpak": "sudo dnf install flatpak",
-            "rpmdevtools": "sudo dnf install rpmdevtools" # For rpmdev-vercmp
+            "rpmdevtools": "sudo dnf install rpmdevtools", # For rpmdev-vercmp
+            "versionlock": "sudo dnf install 'dnf-command(versionlock)'"
         }
 
     def get_base_packages(self) -> dict:
@@ -151,13 +234,54 @@ class Provider(BaseProvider):
             }
         }
 
+    def parse_package_filename(self, filename: str):
+        return split_rpm_filename(filename)
+
+    def dependency_closure(self, names: set) -> set:
+        return rpm_dependency_closure(names)
+
+    def package_file_digests(self, packages: dict) -> dict:
+        return rpm_file_digests(packages)
+
+    def _register_bundle_repo(self, bundle_dir: str, files: list) -> bool:
+        """Indexes the bundle with createrepo_c and adds it as the 'wcli-bundle' repo."""
+        if not shutil.which("createrepo_c"):
+            print(f"{RED}Error: 'createrepo_c' not found. Install 'createrepo_c'.{NC}")
+            return False
+        if not run_cmd(["createrepo_c", "--quiet", bundle_dir]):
+            print(f"{RED}Error: createrepo_c failed.{NC}")
+            return False
+        repo_file = f"{YUM_REPOS_DIR}/{BUNDLE_REPO}.repo"
+        # Packages keep their original signatures, so gpgcheck stays on
+        content = (f"# Managed by wcli. Do not edit.\n[{BUNDLE_REPO}]\nname=wcli package bundle\n"
+                   f"baseurl=file://{bundle_dir}\nenabled=1\ngpgcheck=1\nmetadata_expire=never\n")
+        if not write_root_file(repo_file, content):
+            print(f"{RED}Error: Could not write {repo_file}{NC}")
+            return False
+        print(f"{GREEN}Registered {bundle_dir} in {repo_file}{NC}")
+        return self.refresh_metadata(force=True)
+
+    def enabled_helper_repos(self) -> set:
+        """'owner/project' for every enabled COPR in /etc/yum.repos.d (dnf4 and dnf5 layouts)."""
+        coprs = set()
+        for section, options in read_repo_files(sorted(Path(YUM_REPOS_DIR).glob("*.repo"))).items():
+            if options.get("enabled", "1").strip() == "0":
+                continue
+            parts = section.split(":")
+            if parts[0] == "copr" and len(parts) == 4:
+                owner = "@" + parts[2][len("group_"):] if parts[2].startswith("group_") else parts[2]
+                coprs.add(f"{owner}/{parts[3]}")
+            match = COPR_URL_RE.search(options.get("baseurl", ""))
+            if match:
+                coprs.add(f"{match.group(1)}/{match.group(2)}")
+        return coprs
+
     def install_copr(self, copr_map: dict) -> bool:
         all_ok = True
         all_packages = []
+        enabled = self.enabled_helper_repos()
         for repo, packages in copr_map.items():
-            # Check if repo is already enabled
-            repo_name = repo.replace('/', '-')
-            if not Path(f"/etc/yum.repos.d/_copr_copr.fedorainfracloud.org_{repo_name}.repo").exists():
+            if not self.helper_repo_enabled(repo, enabled):
                 print(f"Enabling COPR repo: {repo}")
                 if not run_cmd(["sudo", "dnf", "copr", "enable", "-y", repo]):
                     print(f"{YELLOW}Warning: Failed to enable COPR repo: {repo}{NC}")
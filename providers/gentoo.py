@@ -2,7 +2,11 @@
 import subprocess
 import shutil
 import re
-from .base_provider import BaseProvider
+import os
+from pathlib import Path
+from .base_provider import BaseProvider, write_root_file, read_repo_files, dependency_closure_of, ephemeral_cmd
+from .output import print, run_shown
+from .versions import gentoo_key
 
 YELLOW = '\033[1;33m'
 NC = '\033[0m'
@@ -13,19 +17,65 @@ GREEN = '\033[0;32m'
 def run_cmd(cmd: list) -> bool:
     """Helper to run an interactive command."""
     try:
-        subprocess.run(cmd, check=True)
+        run_shown(ephemeral_cmd(cmd), check=True)
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
 def run_cmd_capture(cmd: list) -> subprocess.CompletedProcess:
     """Helper to run a non-interactive command and capture output."""
-    return subprocess.run(cmd, check=True, text=True, capture_output=True, errors='ignore')
+    return subprocess.run(ephemeral_cmd(cmd), check=True, text=True, capture_output=True, errors='ignore')
+
+# --- Emerge tuning ---
+#
+# Shared binary package directory (e.g. an NFS mount). Every package built on
+# one host is stored here with --buildpkg and reused by the others via --usepkg.
+BINPKG_DIR = os.environ.get("WCLI_PKGDIR", "")
+GENTOO_REPO = Path("/var/db/repos/gentoo")
+PACKAGE_MASK_DIR = Path("/etc/portage/package.mask")
+REPOS_CONF = Path("/etc/portage/repos.conf")
+VDB_DIR = Path("/var/db/pkg")
+PKGDIR = BINPKG_DIR or "/var/cache/binpkgs"
+# Binary packages: 'cat/pkg-1.0-r1.tbz2', 'cat/pkg-1.0-r1.gpkg.tar' or (FEATURES=binpkg-multi-instance) 'cat/pkg/pkg-1.0-r1-1.gpkg.tar'
+BINPKG_RE = re.compile(r"^(.+?)-(\d[^-]*(?:-r\d+)?)(?:-\d+)?\.(?:tbz2|xpak|gpkg\.tar)$")
+ATOM_RE = re.compile(r"(?<![\w:/+.-])[a-z0-9+_-]+/([A-Za-z0-9+_-]+?)(?:-\d[^\s\[\]]*)?(?=[\s:\[]|$)")
+
+def _to_atom(pkg: str) -> str:
+    """'app-misc/yq=4.0' -> '=app-misc/yq-4.0'; plain names pass through."""
+    if "=" in pkg and not pkg.startswith(("=", "<", ">", "~")):
+        name, version = pkg.split("=", 1)
+        return f"={name}-{version.lstrip('=')}"
+    return pkg
+
+def emerge_parallel_opts() -> list:
+    """--jobs/--load-average sized from the core count."""
+    cores = os.cpu_count() or 1
+    jobs = max(1, cores // 2)
+    return [f"--jobs={jobs}", f"--load-average={cores}"]
+
+def emerge_cmd(args: list) -> list:
+    """Builds a 'sudo emerge' command that reuses and fills the binary package dir."""
+    cmd = ["sudo"]
+    if BINPKG_DIR:
+        cmd += ["env", f"PKGDIR={BINPKG_DIR}"]
+    return cmd + ["emerge", "--usepkg", "--buildpkg"] + emerge_parallel_opts() + args
 
 class Provider(BaseProvider):
     """Gentoo provider implementation."""
 
+    # 'emerge --sync' is expensive and rate-limited; default to once a day
+    max_metadata_age = 24 * 3600
+    metadata_globs = [str(GENTOO_REPO / "metadata" / "timestamp.chk")]
+    refresh_stamps = metadata_globs # The tree is one repo, stamped at every upstream snapshot
+    supports_holds = True
+    helper_repo_kinds = ("gentoo_overlay",)
+    package_cache_dir = PKGDIR
+    package_cache_globs = [os.path.join(PKGDIR, pattern) for pattern in ("*/*.tbz2", "*/*.gpkg.tar", "*/*/*.gpkg.tar")]
+    # FEATURES is incremental, so this adds to make.conf's for the ephemeral run
+    ephemeral_env = {"FEATURES": "nodoc noinfo noman"}
+
     def __init__(self):
+        super().__init__()
         if not shutil.which("eselect"):
             print(f"{YELLOW}Warning: 'eselect' not found. Overlays will not work.{NC}")
             print("Please install 'app-eselect/eselect-repository'.")
@@ -41,31 +91,92 @@ class Provider(BaseProvider):
             self.can_list = True
 
     def install(self, packages: list) -> bool:
-        """Installs packages one-by-one to show progress."""
-        all_ok = True
-        total = len(packages)
-        for i, pkg in enumerate(packages):
-            # Emerge can take version strings like '=app-misc/yq-4.0'
-            pkg_name = pkg.replace("=", "==") if "=" in pkg else pkg
-            print(f"\n--- Installing {pkg_name} ({i+1}/{total}) ---")
-            if not run_cmd(["sudo", "emerge", "--noreplace", "--verbose", f"={pkg_name}" if "==" in pkg_name else pkg_name]):
-                print(f"{YELLOW}Warning: Failed to install {pkg_name}{NC}")
-                all_ok = False
-        return all_ok
+        """
+        Emerges the whole set in one dependency calculation.
+        --keep-going lets the rest of the batch finish if one package fails.
+        """
+        atoms = [_to_atom(p) for p in packages]
+        print(f"{BLUE}Emerging {len(atoms)} packages in one batch...{NC}")
+        return run_cmd(emerge_cmd(["--noreplace", "--verbose", "--keep-going"] + atoms))
 
     def remove(self, packages: list) -> bool:
         return run_cmd(["sudo", "emerge", "-C", "--verbose"] + packages)
 
+    def sync_holds(self, wanted: dict, previous: dict) -> bool:
+        """
+        Masks everything newer than each pin ('>cat/pkg-1.2') in
+        /etc/portage/package.mask/wcli. Needs package.mask to be a directory.
+        A pin without a category takes the one it is installed under; if
+        that is unknown or ambiguous the pin is left out and this returns
+        False, so 'update' keeps it on the ignore list.
+        """
+        if PACKAGE_MASK_DIR.exists() and not PACKAGE_MASK_DIR.is_dir():
+            print(f"{YELLOW}Warning: {PACKAGE_MASK_DIR} is a file, not a directory. Cannot manage pins.{NC}")
+            return False
+        categories = self._installed_categories() if any("/" not in name for name in wanted) else {}
+        lines = ["# Managed by wcli. Do not edit."]
+        all_masked = True
+        for name, pin in sorted(wanted.items()):
+            atom = name
+            if "/" not in name:
+                found = sorted(categories.get(name, ()))
+                if len(found) != 1:
+                    reason = "is installed in several categories" if found else "is not installed"
+                    print(f"{YELLOW}Warning: '{name}' has no category and {reason}, cannot mask it. Use 'category/{name}'.{NC}")
+                    all_masked = False
+                    continue
+                atom = f"{found[0]}/{name}"
+            lines.append(f"{'>=' if pin.get('strict') else '>'}{atom}-{pin['version']}")
+        return write_root_file(str(PACKAGE_MASK_DIR / "wcli"), "\n".join(lines) + "\n") and all_masked
+
+    def _installed_categories(self) -> dict:
+        """{pkg: {category, ...}} from 'qlist -I'."""
+        categories = {}
+        if not self.can_list: return categories
+        try:
+            result = run_cmd_capture(["qlist", "-I"])
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return categories
+        for line in result.stdout.split('\n'):
+            category, _, name = line.strip().partition('/')
+            if name:
+                categories.setdefault(name, set()).add(category)
+        return categories
+
     def update(self, ignore_list: list) -> bool:
-        # This is complex. We'd have to add to /etc/portage/package.mask
+        # Without native holds we can only tell the user what to mask
         if ignore_list:
             print(f"{YELLOW}Ignoring packages in emerge is manual.{NC}")
             print(f"Please add the following to /etc/portage/package.mask to prevent updates:")
             for pkg in ignore_list:
                 print(f"  >={pkg}")
         
-        run_cmd(["sudo", "emerge", "--sync"])
-        return run_cmd(["sudo", "emerge", "-auDN", "@world"])
+        self.refresh_metadata()
+        return run_cmd(emerge_cmd(["-auDN", "@world"]))
+
+    def upgradable_packages(self, names: list) -> dict:
+        """
+        Parses 'emerge --pretend --update' lines: '[ebuild     U  ] cat/pkg-2.0:slot::repo [1.9]'.
+        Downgrades ('UD') are not upgrades.
+        """
+        try:
+            result = subprocess.run(["emerge", "--pretend", "--quiet", "--update", "--oneshot"] + names,
+                                    text=True, capture_output=True, errors='ignore')
+        except FileNotFoundError:
+            return None
+        wanted = set(names)
+        upgrades = {}
+        for match in re.finditer(r"^\[ebuild\s+U(?!D)[^\]]*\]\s+[\w+.-]+/(\S+?)-(\d\S*)\s+\[", result.stdout, re.M):
+            if match.group(1) in wanted:
+                upgrades[match.group(1)] = {"version": match.group(2).split(":")[0], "size": None}
+        return upgrades
+
+    def upgrade_packages(self, names: list) -> bool:
+        return run_cmd(emerge_cmd(["--update", "--oneshot"] + names))
+
+    def _refresh_metadata(self, repos: list = None) -> bool:
+        print(f"{BLUE}Running 'emerge --sync'...{NC}")
+        return run_cmd(["sudo", "emerge", "--sync"] + (repos or []))
 
     def search(self, package: str) -> bool:
         return run_cmd(["emerge", "-s", package])
@@ -114,6 +225,16 @@ class Provider(BaseProvider):
         except (subprocess.CalledProcessError, FileNotFoundError):
             return pkg_map
             
+    def segment_key(self, version: str) -> tuple:
+        return gentoo_key(version)
+
+    def split_version(self, version: str) -> (int, str, str):
+        """Gentoo revisions are '-rN': '1.2.3-r1'."""
+        match = re.match(r"^(.*)-r(\d+)$", version)
+        if match:
+            return 0, match.group(1), match.group(2)
+        return 0, version, None
+
     def compare_versions(self, v1: str, v2: str) -> int:
         # Use Python's packaging library if available, otherwise string compare
         try:
@@ -176,35 +297,92 @@ class Provider(BaseProvider):
             }
         }
 
-    def install_overlay(self, overlay_map: dict) -> bool:
-        if not self.can_add_overlay:
-            print("Error: 'eselect repository' is not available. Cannot add overlays.")
-            return False
+    # --- Package Cache Bundles ---
+
+    def parse_package_filename(self, filename: str):
+        match = BINPKG_RE.match(filename)
+        return match.groups() if match else None
+
+    def bundle_relpath(self, path: str) -> str:
+        """Keeps the category directories PKGDIR is laid out in."""
+        return os.path.relpath(path, self.package_cache_dir)
+
+    def dependency_closure(self, names: set) -> set:
+        """Follows RDEPEND/PDEPEND atoms in /var/db/pkg. USE-conditional deps are all followed; only installed ones resolve."""
+        depends = {}
+        for entry in VDB_DIR.glob("*/*"):
+            match = re.match(r"^(.+?)-\d", entry.name)
+            if not match:
+                continue
+            atoms = ""
+            for key in ("RDEPEND", "PDEPEND"):
+                try:
+                    atoms += " " + (entry / key).read_text()
+                except OSError:
+                    pass
+            depends[match.group(1)] = ATOM_RE.findall(atoms)
+        if not depends:
+            return None
+        return dependency_closure_of(names, depends, {})
+
+    def package_file_digests(self, packages: dict) -> dict:
+        """From CONTENTS in /var/db/pkg. Files under /etc are CONFIG_PROTECTed, so left out."""
+        digests = {}
+        for name in packages:
+            for contents in sorted(VDB_DIR.glob(f"*/{name}-[0-9]*/CONTENTS")):
+                try:
+                    lines = contents.read_text(errors='surrogateescape').splitlines()
+                except OSError:
+                    continue
+                files = digests.setdefault(name, [])
+                for line in lines:
+                    if line.startswith("obj "):
+                        path, digest, _ = line[len("obj "):].rsplit(" ", 2) # 'obj <path> <md5> <mtime>'
+                        if not path.startswith("/etc/"):
+                            files.append((path, "md5", digest))
+        return digests
 
+    def _after_seed(self) -> bool:
+        """Rebuilds PKGDIR's Packages index so --usepkg sees the new files."""
+        return run_cmd(["sudo", "env", f"PKGDIR={self.package_cache_dir}", "emaint", "binhost", "--fix"])
+
+    def enabled_helper_repos(self) -> set:
+        """Repository names configured in repos.conf (a file, or a directory as eselect-repository writes)."""
+        if REPOS_CONF.is_dir():
+            paths = sorted(p for p in REPOS_CONF.iterdir() if p.is_file() and not p.name.startswith(".") and not p.name.endswith("~"))
+        else:
+            paths = [REPOS_CONF]
+        return set(read_repo_files(paths))
+
+    def installed_name(self, package: str) -> str:
+        """'>=games-util/foo-1.2:0' -> 'foo', matching the qlist-based installed map."""
+        name = re.sub(r"^[<>=~!]+", "", package).split(":")[0].split("/")[-1]
+        return re.sub(r"-\d[^-]*(-r\d+)?$", "", name)
+
+    def install_overlay(self, overlay_map: dict) -> bool:
         all_ok = True
         all_packages = []
-        needs_sync = False
-        
-        try:
-            result = run_cmd_capture(["eselect", "repository", "list", "-i"])
-            enabled_repos = result.stdout
-        except Exception:
-            enabled_repos = ""
+        added = []
+        enabled_repos = self.enabled_helper_repos()
 
         for overlay, packages in overlay_map.items():
             if overlay not in enabled_repos:
+                if not self.can_add_overlay:
+                    print("Error: 'eselect repository' is not available. Cannot add overlays.")
+                    all_ok = False
+                    continue
                 print(f"Adding Gentoo overlay: {overlay}")
                 if not run_cmd(["sudo", "eselect", "repository", "add", overlay, "git"]):
                     print(f"Warning: Failed to add overlay: {overlay}")
                     all_ok = False
                 else:
-                    needs_sync = True
+                    added.append(overlay)
             
             all_packages.extend(packages)
         
-        if needs_sync:
-            print("Running 'emerge --sync' after adding overlays...")
-            if not run_cmd(["sudo", "emerge", "--sync"]):
+        if added:
+            print("Syncing newly added overlays...")
+            if not self.refresh_metadata(force=True, repos=added):
                 print("Error: 'emerge --sync' failed.")
                 return False
         
@@ -2,7 +2,10 @@
 import subprocess
 import hashlib
 import re
-from .base_provider import BaseProvider
+import glob
+import os
+from .base_provider import BaseProvider, diff_holds, read_repo_files, split_rpm_filename, rpm_dependency_closure, rpm_file_digests, ephemeral_cmd, rpm_ephemeral_macros, RPM_EPHEMERAL_MACROS
+from .output import print, run_shown
 
 YELLOW = '\033[1;33m'
 RED = '\033[0;31m'
@@ -10,37 +13,74 @@ NC = '\033[0m'
 GREEN = '\033[0;32m'
 BLUE = '\033[0;34m'
 
+ZYPP_REPOS_DIR = "/etc/zypp/repos.d"
+BUNDLE_REPO = "wcli-bundle"
+ZYPP_CONF = "/etc/zypp/zypp.conf"
+ZYPP_EPHEMERAL_CONF = "/etc/zypp/wcli-ephemeral.conf"
+
 def run_cmd(cmd: list) -> bool:
     """Helper to run an interactive command."""
     try:
-        subprocess.run(cmd, check=True)
+        run_shown(ephemeral_cmd(cmd), check=True)
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
 def run_cmd_capture(cmd: list) -> subprocess.CompletedProcess:
     """Helper to run a non-interactive command and capture output."""
-    return subprocess.run(cmd, check=True, text=True, capture_output=True, errors='ignore')
+    return subprocess.run(ephemeral_cmd(cmd), check=True, text=True, capture_output=True, errors='ignore')
 
 class Provider(BaseProvider):
     """openSUSE provider implementation."""
 
+    metadata_globs = ["/var/cache/zypp/raw/*/repodata/repomd.xml"]
+    supports_holds = True
+    helper_repo_kinds = ("opensuse_obs",)
+    # Only kept with 'keeppackages' enabled on a repo
+    package_cache_globs = ["/var/cache/zypp/packages/*/*/*.rpm"]
+    bundle_import_mode = "repo"
+    # Every zypper command takes zypp's lock, even 'addlock'; rpm has its own
+    package_locks = [("pidfile", "/run/zypp.pid"), ("fcntl", "/var/lib/rpm/.rpm.lock")]
+    # zypp.conf has no drop-ins; ZYPP_CONF points zypper at a copy for the ephemeral run
+    ephemeral_env = {"ZYPP_CONF": ZYPP_EPHEMERAL_CONF}
+
+    def _zypper(self) -> list:
+        """'sudo zypper', with --no-refresh when metadata is fresh enough."""
+        return ["sudo", "zypper"] + (["--no-refresh"] if self.metadata_is_fresh() else [])
+
+    def _refresh_metadata(self, repos: list = None) -> bool:
+        print(f"{BLUE}Refreshing zypper repositories...{NC}")
+        if not self.wait_for_package_lock():
+            return False
+        return run_cmd(["sudo", "zypper", "--gpg-auto-import-keys", "refresh"] + (repos or []))
+
     def install(self, packages: list) -> bool:
         """Installs packages one-by-one to show progress."""
-        all_ok = True
+        failed = []
         total = len(packages)
         for i, pkg in enumerate(packages):
             print(f"\n--- Installing {pkg} ({i+1}/{total}) ---")
-            if not run_cmd(["sudo", "zypper", "install", "--non-interactive", "--no-recommends", pkg]):
+            if not self.wait_for_package_lock():
+                self.failed_packages = failed # The rest were not attempted
+                return False
+            if not run_cmd(self._zypper() + ["install", "--non-interactive", "--no-recommends", pkg]):
                 print(f"{YELLOW}Warning: Failed to install {pkg}{NC}")
-                all_ok = False
-        return all_ok
+                failed.append(pkg)
+        self.failed_packages = failed
+        return not failed
 
     def remove(self, packages: list) -> bool:
+        if not self.wait_for_package_lock():
+            return False
         return run_cmd(["sudo", "zypper", "remove", "--non-interactive"] + packages)
 
     def update(self, ignore_list: list) -> bool:
-        cmd = ["sudo", "zypper", "dup", "--non-interactive", "--no-recommends"]
+        if not self.refresh_metadata():
+            print(f"{RED}Error: Failed to refresh repositories.{NC}")
+            return False
+        cmd = ["sudo", "zypper", "--no-refresh", "dup", "--non-interactive", "--no-recommends"]
+        if not self.wait_for_package_lock():
+            return False
         if ignore_list:
             print(f"{YELLOW}Ignoring {len(ignore_list)} packages: {', '.join(ignore_list)}{NC}")
             # zypper uses 'addlock'
@@ -55,6 +95,60 @@ class Provider(BaseProvider):
             
         return all_ok
 
+    def upgradable_packages(self, names: list) -> dict:
+        """Parses 'zypper list-updates' (no download sizes there)."""
+        try:
+            result = subprocess.run(["zypper", "--no-refresh", "--quiet", "list-updates"], text=True, capture_output=True, errors='ignore')
+        except FileNotFoundError:
+            return None
+        if result.returncode != 0:
+            return None
+        wanted = set(names)
+        upgrades = {}
+        for line in result.stdout.splitlines():
+            cols = [c.strip() for c in line.split("|")]
+            # S | Repository | Name | Current Version | Available Version | Arch
+            if len(cols) >= 6 and cols[2] in wanted:
+                upgrades[cols[2]] = {"version": cols[4], "size": None}
+        return upgrades
+
+    def upgrade_packages(self, names: list) -> bool:
+        if not self.wait_for_package_lock():
+            return False
+        return run_cmd(["sudo", "zypper", "--no-refresh", "update", "--non-interactive", "--no-recommends"] + names)
+
+    def sync_holds(self, wanted: dict, previous: dict) -> bool:
+        """
+        Uses versioned zypper locks ('pkg > 1.2'): newer versions are locked
+        out, while the pinned version itself stays installable.
+        """
+        to_add, to_remove = diff_holds(wanted, previous)
+        if not self.wait_for_package_lock():
+            return False
+        all_ok = True
+        # A versioned lock is only matched by the same spec it was added with
+        unlocks = [self._lock_spec(n, previous[n]) for n in to_remove]
+        if unlocks and not run_cmd(["sudo", "zypper", "removelock"] + unlocks):
+            all_ok = False
+        locks = [self._lock_spec(n, wanted[n]) for n in to_add]
+        if locks and not run_cmd(["sudo", "zypper", "addlock"] + locks):
+            all_ok = False
+        return all_ok
+
+    def _lock_spec(self, name: str, hold: dict) -> str:
+        """'pkg > 1.2', or 'pkg >= 1.2' for a strict upper bound."""
+        return f"{name} {'>=' if hold.get('strict') else '>'} {hold['version']}"
+
+    def ephemeral_files(self) -> dict:
+        """rpm macros, and zypp.conf with rpm.install.excludedocs."""
+        try:
+            with open(ZYPP_CONF) as f:
+                zypp_conf = f.read()
+        except OSError:
+            zypp_conf = ""
+        return {RPM_EPHEMERAL_MACROS: rpm_ephemeral_macros(),
+                ZYPP_EPHEMERAL_CONF: zypp_conf + "\n[main]\nrpm.install.excludedocs = yes\n"}
+
     def search(self, package: str) -> bool:
         return run_cmd(["zypper", "search", package])
 
@@ -108,6 +202,8 @@ class Provider(BaseProvider):
         """Downgrades a package to a specific version."""
         print(f"  {BLUE}Attempting to install {package}-{version}...{NC}")
         # zypper install <pkg-version>
+        if not self.wait_for_package_lock():
+            return False
         if not run_cmd(["sudo", "zypper", "install", "--non-interactive", "--no-recommends", f"{package}-{version}"]):
             print(f"  {YELLOW}Could not install {package}-{version}. It may not be available in your repos.{NC}")
             return False
@@ -149,30 +245,70 @@ class Provider(BaseProvider):
             ]
         }
 
+    def parse_package_filename(self, filename: str):
+        return split_rpm_filename(filename)
+
+    def dependency_closure(self, names: set) -> set:
+        return rpm_dependency_closure(names)
+
+    def package_file_digests(self, packages: dict) -> dict:
+        return rpm_file_digests(packages)
+
+    def _register_bundle_repo(self, bundle_dir: str, files: list) -> bool:
+        """Adds the bundle as a 'plaindir' repo, which zypper indexes itself."""
+        url = f"dir:{bundle_dir}"
+        enabled = self.enabled_helper_repos()
+        if BUNDLE_REPO in enabled:
+            run_cmd(["sudo", "zypper", "removerepo", BUNDLE_REPO])
+        if not run_cmd(["sudo", "zypper", "addrepo", "--type", "plaindir", "--priority", "90", url, BUNDLE_REPO]):
+            print(f"{RED}Error: Failed to add {url} as '{BUNDLE_REPO}'.{NC}")
+            return False
+        print(f"{GREEN}Registered {bundle_dir} as '{BUNDLE_REPO}'{NC}")
+        return self.refresh_metadata(force=True, repos=[BUNDLE_REPO])
+
+    @staticmethod
+    def _obs_alias(repo_url: str) -> str:
+        return f"wcli-obs-{hashlib.md5(repo_url.encode()).hexdigest()[:8]}"
+
+    def enabled_helper_repos(self) -> set:
+        """Aliases and base URLs of the enabled repos in /etc/zypp/repos.d."""
+        repos = set()
+        for alias, options in read_repo_files(sorted(glob.glob(os.path.join(ZYPP_REPOS_DIR, "*.repo")))).items():
+            if options.get("enabled", "1").strip() == "0":
+                continue
+            repos.add(alias)
+            if options.get("baseurl"):
+                repos.add(options["baseurl"].strip().rstrip("/"))
+        return repos
+
+    def helper_repo_enabled(self, repo_url: str, enabled: set) -> bool:
+        """OBS repos match by wcli's alias, or by URL when added by hand."""
+        return self._obs_alias(repo_url) in enabled or repo_url.rstrip("/") in enabled
+
     def install_obs(self, obs_map: dict) -> bool:
         all_ok = True
         all_packages = []
-        
-        try:
-            result = run_cmd_capture(["zypper", "lr", "-a"])
-            existing_repos = result.stdout
-        except Exception:
-            existing_repos = ""
+        enabled = self.enabled_helper_repos()
 
+        added = []
         for repo_url, packages in obs_map.items():
-            alias = f"wcli-obs-{hashlib.md5(repo_url.encode()).hexdigest()[:8]}"
+            alias = self._obs_alias(repo_url)
             
-            if alias not in existing_repos:
+            if not self.helper_repo_enabled(repo_url, enabled):
                 print(f"Adding OBS repo: {repo_url}")
                 if not run_cmd(["sudo", "zypper", "addrepo", "--refresh", "--name", alias, repo_url, alias]):
                     print(f"Warning: Failed to add OBS repo: {repo_url}")
                     all_ok = False
-                else:
-                    run_cmd(["sudo", "zypper", "--gpg-auto-import-keys", "refresh"])
+                    continue
+                added.append(alias)
             
             all_packages.extend(packages)
+
+        # New repos have no metadata yet: refresh just those, once
+        if added:
+            self.refresh_metadata(force=True, repos=added)
         
         if all_packages:
-            if not run_cmd(["sudo", "zypper", "install", "--non-interactive", "--no-recommends", "--allow-vendor-change"] + all_packages):
+            if not run_cmd(self._zypper() + ["install", "--non-interactive", "--no-recommends", "--allow-vendor-change"] + all_packages):
                 all_ok = False
         return all_ok
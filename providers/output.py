@@ -0,0 +1,57 @@
+# providers/output.py
+#
+# Where wcli's messages go. The engine and the providers print through this
+# module's print(), run the commands whose output the user watches through
+# run_shown(), and use its ThreadPoolExecutor. All three go to the terminal,
+# unless the caller set a message sink with message_sink(): then that
+# context's messages and command output go to the sink instead (wcli_api
+# does this for each Session call). The sink is a contextvar, so concurrent
+# callers never see each other's, and sys.stdout is never swapped.
+import builtins
+import contextlib
+import contextvars
+import subprocess
+import sys
+from concurrent import futures
+
+_sink = contextvars.ContextVar("wcli_message_sink", default=None)
+
+@contextlib.contextmanager
+def message_sink(write):
+    """Sends this context's messages to write(text) instead of stdout."""
+    token = _sink.set(write)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+def print(*args, sep=" ", end="\n", file=None, flush=False):
+    """builtins.print(), or the current message sink for what would go to stdout."""
+    write = _sink.get()
+    if write is None or file not in (None, sys.stdout):
+        builtins.print(*args, sep=sep, end=end, file=file, flush=flush)
+        return
+    write((sep or "").join(map(str, args)) + (end or ""))
+
+def run_shown(cmd: list, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run() for a command whose output is shown as it runs. Under a
+    message sink, its stdout and stderr are read into the sink line by line
+    instead of going to file descriptor 1.
+    """
+    write = _sink.get()
+    if write is None:
+        return subprocess.run(cmd, **kwargs)
+    check = kwargs.pop("check", False)
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', **kwargs) as proc:
+        for line in proc.stdout:
+            write(line)
+    if check and proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return subprocess.CompletedProcess(cmd, proc.returncode)
+
+class ThreadPoolExecutor(futures.ThreadPoolExecutor):
+    """Runs each call in a copy of the submitter's context, so workers print to the same sink."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
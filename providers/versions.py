@@ -0,0 +1,265 @@
+# providers/versions.py
+#
+# Pure-Python version keys for each package manager's ordering rules, and the
+# constraint compiler used to check declared packages against installed ones.
+# Keys are plain tuples, so comparing two versions costs no subprocess.
+import re
+
+# --- Version Keys ---
+#
+# Segment tokens are tuples whose first element ranks the token type, so
+# tuples of different types never compare their payloads.
+_TILDE = (-1,)
+_END = (1,)
+_CARET = (1.25,)
+# Releases are compared only when both sides have one. A real release key is
+# wrapped as (1, key); these two sort below/above every one of them.
+RELEASE_MIN = (0,)
+RELEASE_MAX = (2,)
+
+def rpm_key(version: str) -> tuple:
+    """rpmvercmp ordering: numeric > alpha, '~' sorts before and '^' after the end."""
+    tokens = []
+    for match in re.finditer(r"~|\^|\d+|[a-zA-Z]+", version):
+        part = match.group()
+        if part == "~":
+            tokens.append(_TILDE)
+        elif part == "^":
+            tokens.append(_CARET)
+        elif part.isdigit():
+            tokens.append((2, int(part)))
+        else:
+            tokens.append((1.5, part))
+    tokens.append(_END)
+    return tuple(tokens)
+
+def pacman_key(version: str) -> tuple:
+    """
+    pacman's vercmp (libalpm's rpmvercmp): numeric > alpha, any alpha segment
+    left over after the other side ends sorts *before* it ('1.0a', '1.0.a',
+    '1.0rc1' < '1.0'), and between two segments of the same type the one
+    after the longer separator run wins ('2.0.a' > '2.0a', '2___a' > '2_a').
+    Separator runs compare by length only, so '2.0_a' == '2_0.a'. vercmp is
+    not transitive for a numeric vs an alpha segment after runs of different
+    lengths ('1..a' vs '1.1'); there the segment type decides.
+    """
+    tokens = []
+    prev_end = 0
+    for match in re.finditer(r"[0-9]+|[a-zA-Z]+", version):
+        part = match.group()
+        sep = match.start() - prev_end
+        if part.isdigit():
+            tokens.append((2, sep, int(part)))
+        else:
+            tokens.append((0.5, sep, part))
+        prev_end = match.end()
+    tokens.append(_END)
+    return tuple(tokens)
+
+def _dpkg_order(char: str) -> int:
+    if char == "~": return -1
+    if char.isalpha(): return ord(char)
+    return ord(char) + 256
+
+def dpkg_key(version: str) -> tuple:
+    """dpkg's verrevcmp: alternating non-digit and digit runs, '~' before everything."""
+    parts = []
+    for non_digit, digit in re.findall(r"(\D*)(\d*)", version):
+        if not non_digit and not digit:
+            continue
+        parts.append((tuple(_dpkg_order(c) for c in non_digit) + (0,), int(digit or 0)))
+    parts.append(((0,), 0))
+    return tuple(parts)
+
+_GENTOO_SUFFIX = {"alpha": 0, "beta": 1, "pre": 2, "rc": 3, "p": 5}
+_GENTOO_RE = re.compile(r"^(\d+(?:\.\d+)*)([a-z]?)((?:_(?:alpha|beta|pre|rc|p)\d*)*)$")
+
+def gentoo_key(version: str) -> tuple:
+    """PMS ordering: numeric components, optional letter, then _alpha < _beta < _pre < _rc < (none) < _p."""
+    match = _GENTOO_RE.match(version)
+    if not match:
+        return rpm_key(version)
+    numbers, letter, suffixes = match.groups()
+    key = [(2, int(n)) for n in numbers.split(".")]
+    key.append((1, letter))
+    for name, num in re.findall(r"_(alpha|beta|pre|rc|p)(\d*)", suffixes):
+        key.append((_GENTOO_SUFFIX[name], int(num or 0)))
+    key.append((4, 0)) # No further suffix
+    return tuple(key)
+
+# --- Constraint Compiler ---
+
+CLAUSE_RE = re.compile(r"^(==|!=|~=|>=|<=|>|<|=)?\s*([0-9A-Za-z][^\s,]*)$")
+
+class ConstraintError(ValueError):
+    """Raised for constraint strings that cannot be parsed."""
+
+def parse_constraint(text: str) -> list:
+    """
+    '>=1.2,<2.0,!=1.5' -> [('>=', '1.2'), ('<', '2.0'), ('!=', '1.5')]
+    A bare version or '=' means '=='.
+    """
+    clauses = []
+    for raw in str(text).split(","):
+        raw = raw.strip()
+        if not raw:
+            continue
+        match = CLAUSE_RE.match(raw)
+        if not match:
+            raise ConstraintError(f"invalid version constraint '{raw}'")
+        op, version = match.groups()
+        op = "==" if op in (None, "=") else op
+        if version.endswith(".*") and op not in ("==", "!="):
+            raise ConstraintError(f"wildcard '{version}' only works with == or !=")
+        if op == "~=" and len(re.findall(r"\d+", version)) < 2:
+            raise ConstraintError(f"'~={version}' needs at least two version components")
+        clauses.append((op, version))
+    return clauses
+
+def summarize_clauses(clauses: list) -> (str, str):
+    """
+    Classifies clauses for callers that only know the simple pin types:
+    ("latest"|"exact"|"minimum"|"maximum"|"range", representative version).
+    """
+    if not clauses:
+        return "latest", ""
+    ops = {op for op, _ in clauses}
+    if len(clauses) == 1 and ops == {"=="} and not clauses[0][1].endswith(".*"):
+        return "exact", clauses[0][1]
+    if ops <= {"<", "<="}:
+        return "maximum", clauses[0][1]
+    if ops <= {">", ">="}:
+        return "minimum", clauses[0][1]
+    return "range", ",".join(op + v for op, v in clauses)
+
+def upper_bound(clauses: list):
+    """First '<'/'<=' bound as (version, strict), or None."""
+    for op, version in clauses:
+        if op in ("<", "<="):
+            return version, op == "<"
+    return None
+
+def _bump(version: str) -> str:
+    """'6.8' -> '6.9': the first version past a '6.8.*' prefix."""
+    numbers = list(re.finditer(r"\d+", version))
+    last = numbers[-1]
+    return version[:last.start()] + str(int(last.group()) + 1)
+
+def _drop_last(version: str) -> str:
+    """'1.4.2' -> '1.4', the prefix a '~=1.4.2' has to stay within."""
+    numbers = list(re.finditer(r"\d+", version))
+    return version[:numbers[-2].end()]
+
+class IntervalSet:
+    """
+    A union of disjoint intervals over version keys. Each interval is
+    (lo, lo_incl, hi, hi_incl) where lo/hi are (key, version_str), or None
+    for unbounded.
+    """
+
+    def __init__(self, intervals=None):
+        self.intervals = [(None, False, None, False)] if intervals is None else intervals
+
+    @staticmethod
+    def _empty(lo, lo_incl, hi, hi_incl) -> bool:
+        if lo is None or hi is None:
+            return False
+        return lo[0] > hi[0] or (lo[0] == hi[0] and not (lo_incl and hi_incl))
+
+    def intersect(self, other: "IntervalSet") -> "IntervalSet":
+        result = []
+        for a in self.intervals:
+            for b in other.intervals:
+                lo, lo_incl = a[0], a[1]
+                if b[0] is not None and (lo is None or b[0][0] > lo[0] or (b[0][0] == lo[0] and not b[1])):
+                    lo, lo_incl = b[0], b[1]
+                hi, hi_incl = a[2], a[3]
+                if b[2] is not None and (hi is None or b[2][0] < hi[0] or (b[2][0] == hi[0] and not b[3])):
+                    hi, hi_incl = b[2], b[3]
+                if not self._empty(lo, lo_incl, hi, hi_incl):
+                    result.append((lo, lo_incl, hi, hi_incl))
+        result.sort(key=lambda i: () if i[0] is None else (i[0][0],))
+        return IntervalSet(result)
+
+    def is_empty(self) -> bool:
+        return not self.intervals
+
+    def contains(self, key) -> bool:
+        for lo, lo_incl, hi, hi_incl in self.intervals:
+            if lo is not None and (key < lo[0] or (key == lo[0] and not lo_incl)):
+                continue
+            if hi is not None and (key > hi[0] or (key == hi[0] and not hi_incl)):
+                continue
+            return True
+        return False
+
+    def direction(self, key) -> str:
+        """'ok', or which way an installed version has to move: 'upgrade'/'downgrade'."""
+        if self.contains(key):
+            return "ok"
+        # Above every interval -> downgrade; below one or in a gap -> upgrade
+        for lo, lo_incl, hi, hi_incl in self.intervals:
+            if hi is None or key < hi[0] or (key == hi[0] and hi_incl):
+                return "upgrade"
+        return "downgrade"
+
+    def downgrade_target(self):
+        """
+        The newest allowed version, if that is a concrete version string.
+        Exclusive bounds ('<2.0', '6.8.*') have none: the newest version
+        below them is only known to the repos.
+        """
+        if not self.intervals:
+            return None
+        lo, lo_incl, hi, hi_incl = self.intervals[-1]
+        if hi is not None and hi_incl:
+            return hi[1]
+        return None
+
+    def __str__(self):
+        parts = []
+        for lo, lo_incl, hi, hi_incl in self.intervals:
+            if lo is not None and hi is not None and lo[1] == hi[1] and lo_incl and hi_incl:
+                parts.append(f"=={lo[1]}")
+                continue
+            bounds = []
+            if lo is not None: bounds.append((">=" if lo_incl else ">") + lo[1])
+            if hi is not None: bounds.append(("<=" if hi_incl else "<") + hi[1])
+            parts.append(",".join(bounds) or "*")
+        return " | ".join(parts) or "(nothing)"
+
+def compile_clauses(clauses: list, version_range) -> IntervalSet:
+    """
+    Compiles parsed clauses into an IntervalSet. 'version_range(v)' returns
+    the (lo_key, hi_key) span a version string stands for, which is wider
+    than one point when the version omits the release ('1.2' vs '1.2-3').
+    """
+    result = IntervalSet()
+    for op, version in clauses:
+        wildcard = version.endswith(".*")
+        base = version[:-2] if wildcard else version
+        lo_key, hi_key = version_range(base)
+        lo, hi = (lo_key, base), (hi_key, base)
+        if wildcard:
+            after = (version_range(_bump(base))[0], _bump(base))
+            allowed = IntervalSet([(lo, True, after, False)])
+        elif op in ("==", "!="):
+            allowed = IntervalSet([(lo, True, hi, True)])
+        elif op == ">=":
+            allowed = IntervalSet([(lo, True, None, False)])
+        elif op == ">":
+            allowed = IntervalSet([(hi, False, None, False)])
+        elif op == "<=":
+            allowed = IntervalSet([(None, False, hi, True)])
+        elif op == "<":
+            allowed = IntervalSet([(None, False, lo, False)])
+        else: # ~=
+            prefix = _drop_last(base)
+            after = (version_range(_bump(prefix))[0], _bump(prefix))
+            allowed = IntervalSet([(lo, True, after, False)])
+
+        if op == "!=":
+            (a_lo, a_lo_incl, a_hi, a_hi_incl), = allowed.intervals
+            allowed = IntervalSet([(None, False, a_lo, not a_lo_incl), (a_hi, not a_hi_incl, None, False)])
+        result = result.intersect(allowed)
+    return result
@@ -0,0 +1,97 @@
+# Loads the 'wcli' script as a module (see wcli_api.py) against a throwaway
+# SYS_CONFIG_DIR, and provides an in-memory provider to sync against.
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+CONFIG_DIR = Path(tempfile.mkdtemp(prefix="wcli-test-"))
+os.environ["SYS_CONFIG_DIR"] = str(CONFIG_DIR) # Read once, when the engine is loaded
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from wcli_api import engine # noqa: E402
+from providers.base_provider import BaseProvider # noqa: E402
+from providers.versions import dpkg_key # noqa: E402
+
+class StubProvider(BaseProvider):
+    """
+    Installs into a dict. 'failing' packages fail to install; 'pulls_in'
+    maps a package to the dependencies its install brings along.
+    """
+
+    def __init__(self, installed=None, failing=(), pulls_in=None):
+        super().__init__()
+        self.installed = dict(installed or {})
+        self.failing = set(failing)
+        self.pulls_in = pulls_in or {}
+        self.installs = []
+
+    def install(self, packages: list) -> bool:
+        all_ok = True
+        for pkg in packages:
+            self.installs.append(pkg)
+            if pkg in self.failing:
+                all_ok = False
+                continue
+            self.installed[pkg] = "1.0"
+            self.installed.update({dep: "1.0" for dep in self.pulls_in.get(pkg, [])})
+        return all_ok
+
+    def remove(self, packages: list) -> bool:
+        for pkg in packages:
+            self.installed.pop(pkg, None)
+        return True
+
+    def update(self, ignore_list: list) -> bool:
+        return True
+
+    def search(self, package: str) -> bool:
+        return True
+
+    def get_installed_packages(self) -> set:
+        return set(self.installed)
+
+    def get_deps(self) -> dict:
+        return {}
+
+    def get_base_packages(self) -> dict:
+        return {}
+
+    def get_package_version(self, package: str) -> str:
+        return self.installed.get(package)
+
+    def get_installed_packages_with_versions(self) -> dict:
+        return dict(self.installed)
+
+    def compare_versions(self, v1: str, v2: str) -> int:
+        return 0
+
+    def show_package_versions(self, package: str):
+        pass
+
+    def segment_key(self, version: str) -> tuple:
+        return dpkg_key(version)
+
+    def get_installed_flatpaks(self) -> dict:
+        return {}
+
+@pytest.fixture
+def config_dir():
+    """An empty config directory with just a config.yaml, and base.yaml writable by the test."""
+    shutil.rmtree(CONFIG_DIR, ignore_errors=True)
+    (CONFIG_DIR / "packages" / "modules").mkdir(parents=True)
+    (CONFIG_DIR / "packages" / "hosts").mkdir()
+    (CONFIG_DIR / "state").mkdir()
+    (CONFIG_DIR / "config.yaml").write_text("host: test\nenabled_modules: []\n")
+    yield CONFIG_DIR
+
+def sync_args(**overrides) -> argparse.Namespace:
+    """The arguments 'wcli sync --force --no-backup' parses to."""
+    args = dict(dry_run=False, prune=False, force=True, no_backup=True, splay=None, window=None, resume=False,
+                ephemeral=False, allow_live_root=False, explain=False, max_metadata_age=None, retry_failed=False)
+    args.update(overrides)
+    return argparse.Namespace(**args)
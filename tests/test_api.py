@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from conftest import StubProvider, engine
+from providers.base_provider import ephemeral_cmd
+from providers.output import print as wcli_print, run_shown, ThreadPoolExecutor
+from wcli_api import Session, WcliError
+
+def test_concurrent_sessions_keep_their_own_output(capfd):
+    seen = []
+    sessions = {word: Session(provider=StubProvider(), on_message=seen.append) for word in ("left", "right")}
+    both_started = threading.Barrier(2)
+
+    def talk(word):
+        wcli_print(f"{word} 1")
+        both_started.wait()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            list(pool.map(lambda n: wcli_print(f"{word} {n}"), [2]))
+        run_shown(["echo", f"{word} from a command"], check=True)
+
+    threads = [threading.Thread(target=sessions[word]._call, args=(talk, word)) for word in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for word, session in sessions.items():
+        assert session.messages == [f"{word} 1", f"{word} 2", f"{word} from a command"]
+    assert sorted(seen) == sorted(line for session in sessions.values() for line in session.messages)
+    assert capfd.readouterr().out == ""
+
+def test_each_session_waits_for_the_run_lock_as_long_as_it_was_told(config_dir):
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n- foo\n")
+    patient, impatient = Session(provider=StubProvider()), Session(provider=StubProvider(), lock_timeout=0)
+    assert patient.lock_timeout == engine.LOCK_WAIT
+    plan = impatient.plan()
+    with engine.command_lock("sync", "exclusive"):
+        with pytest.raises(WcliError, match="Timed out"):
+            impatient.apply(plan)
+    assert impatient.provider.installs == []
+    assert patient.lock_timeout == engine.LOCK_WAIT
+
+class EphemeralStub(StubProvider):
+    ephemeral_env = {"WCLI_TEST": "1"}
+
+def test_an_ephemeral_prefix_stays_with_the_context_that_enabled_it():
+    provider, seen = EphemeralStub(), {}
+    enabled, checked = threading.Event(), threading.Event()
+    def ephemeral_sync():
+        provider.enable_ephemeral()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            seen["worker"] = pool.submit(ephemeral_cmd, ["sudo", "true"]).result()
+        seen["sync"] = ephemeral_cmd(["sudo", "true"])
+        enabled.set()
+        checked.wait(5)
+        provider.disable_ephemeral()
+        seen["after"] = ephemeral_cmd(["sudo", "true"])
+    thread = threading.Thread(target=ephemeral_sync)
+    thread.start()
+    enabled.wait(5)
+    seen["other"] = ephemeral_cmd(["sudo", "true"]) # While the other thread's sync is ephemeral
+    checked.set()
+    thread.join()
+    assert seen["sync"][:3] == seen["worker"][:3] == ["sudo", "env", "WCLI_TEST=1"]
+    assert seen["other"] == seen["after"] == ["sudo", "true"]
@@ -0,0 +1,151 @@
+from pathlib import Path
+
+import pytest
+
+from providers import arch
+
+# Local PKGBUILD directories, one per pkgbase. 'aur-libs' and 'foo' are
+# split packages; 'libaur-virtual' is only a provides= name.
+SRCINFOS = {
+    "app": """
+pkgbase = app
+	pkgver = 2.0
+	pkgrel = 1
+	epoch = 1
+	arch = x86_64
+	depends = libaur>=1.0
+	depends_x86_64 = glibc
+
+pkgname = app
+""",
+    "aur-libs": """
+pkgbase = aur-libs
+	pkgver = 1.1
+	pkgrel = 3
+	arch = any
+	makedepends = zlib
+	provides = libaur-virtual=1.1
+
+pkgname = libaur
+
+pkgname = libaur-docs
+""",
+    "foo": """
+pkgbase = foo
+	pkgver = 0.5
+	pkgrel = 1
+	arch = x86_64
+	depends = libaur-virtual
+
+pkgname = foo-cli
+
+pkgname = foo-gui
+""",
+    "other": """
+pkgbase = other
+	pkgver = 1
+	pkgrel = 1
+	arch = x86_64
+	depends = gone
+
+pkgname = other
+""",
+}
+
+# What the AUR RPC knows: pkgname -> pkgbase
+AUR_RPC = {"app": "app", "libaur": "aur-libs", "libaur-docs": "aur-libs", "foo-cli": "foo", "foo-gui": "foo", "other": "other"}
+
+@pytest.fixture
+def aur_dir(monkeypatch, tmp_path):
+    for base, text in SRCINFOS.items():
+        (tmp_path / base).mkdir()
+        (tmp_path / base / "PKGBUILD").write_text(f"pkgbase={base}\n")
+        (tmp_path / base / ".SRCINFO").write_text(text)
+    monkeypatch.setattr(arch, "AUR_BUILD_DIR", tmp_path)
+    monkeypatch.setattr(arch, "AUR_PKGDEST", tmp_path / "pkgs")
+    return tmp_path
+
+class LocalAur(arch.Provider):
+    """
+    Builds from the local PKGBUILD directories: makepkg writes empty package
+    files, glibc is installed, zlib is in the repos and everything else
+    has to come from the AUR.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.built, self.installed_files = [], []
+
+    def _split_missing_deps(self, deps):
+        missing = [d for d in deps if d != "glibc"]
+        return [d for d in missing if d == "zlib"], [d for d in missing if d != "zlib"]
+
+    def _build_aur_package(self, pkgbase, make_jobs):
+        self.built.append(pkgbase)
+        info = arch.parse_srcinfo(arch.AUR_BUILD_DIR / pkgbase / ".SRCINFO")
+        for name in info["pkgnames"]:
+            (arch.AUR_PKGDEST / f"{name}-{arch.srcinfo_full_version(info)}-{info['arch'][0]}.pkg.tar.zst").touch()
+        return True
+
+    def _install_aur_files(self, files):
+        self.installed_files.append(sorted(Path(f).name for f in files))
+        return True
+
+@pytest.fixture
+def rpc(monkeypatch):
+    """The AUR RPC queries made. Split pkgnames have no directory of their own, so they go through it."""
+    queries = []
+    def pkgbases(names):
+        queries.append(sorted(names))
+        return {name: AUR_RPC[name] for name in names if name in AUR_RPC}
+    monkeypatch.setattr(arch, "aur_rpc_pkgbases", pkgbases)
+    return queries
+
+@pytest.fixture
+def commands(monkeypatch):
+    ran = []
+    monkeypatch.setattr(arch, "run_cmd", lambda cmd: ran.append(cmd) or True)
+    return ran
+
+def test_parse_srcinfo_reads_split_packages_and_arch_specific_deps(aur_dir):
+    app = arch.parse_srcinfo(aur_dir / "app" / ".SRCINFO")
+    assert app["pkgnames"] == ["app"]
+    assert app["depends"] == {"libaur>=1.0", "glibc"}
+    assert arch.srcinfo_full_version(app) == "1:2.0-1"
+
+    libs = arch.parse_srcinfo(aur_dir / "aur-libs" / ".SRCINFO")
+    assert (libs["pkgbase"], libs["pkgnames"]) == ("aur-libs", ["libaur", "libaur-docs"])
+    assert libs["depends"] == {"zlib"} # makedepends count
+    assert libs["provides"] == {"libaur-virtual"}
+    assert arch.srcinfo_full_version(libs) == "1.1-3"
+
+def test_order_aur_builds_resolves_pkgnames_and_provides_to_pkgbases(aur_dir):
+    srcinfos = {base: arch.parse_srcinfo(aur_dir / base / ".SRCINFO") for base in SRCINFOS}
+    assert arch.order_aur_builds(srcinfos) == [["aur-libs", "other"], ["app", "foo"]]
+
+def test_split_packages_are_fetched_and_built_under_their_pkgbase(aur_dir, rpc, commands):
+    provider = LocalAur()
+    assert provider.build_aur(["app", "foo-cli"])
+    # One RPC query per round; 'app' has a local PKGBUILD and needs none
+    assert rpc == [["foo-cli"], ["libaur", "libaur-virtual"]]
+    assert provider.built[0] == "aur-libs" and sorted(provider.built[1:]) == ["app", "foo"]
+    assert provider.installed_files == [
+        ["libaur-1.1-3-any.pkg.tar.zst", "libaur-docs-1.1-3-any.pkg.tar.zst"], # Before the wave that needs them
+        ["app-1:2.0-1-x86_64.pkg.tar.zst", "foo-cli-0.5-1-x86_64.pkg.tar.zst", "foo-gui-0.5-1-x86_64.pkg.tar.zst"],
+    ]
+    assert ["sudo", "pacman", "-S", "--noconfirm", "--needed", "--asdeps", "zlib"] in commands
+    assert sorted(commands[-1][4:]) == ["foo-gui", "libaur", "libaur-docs"]
+
+def test_cached_builds_are_not_rebuilt(aur_dir, rpc, commands):
+    provider = LocalAur()
+    assert provider.build_aur(["app"])
+    provider.built.clear()
+    assert provider.build_aur(["app"])
+    assert provider.built == []
+
+def test_names_the_aur_does_not_know_fail_with_their_dependents(aur_dir, rpc, commands):
+    provider = LocalAur()
+    assert not provider.build_aur(["app", "other"])
+    assert rpc == [["gone", "libaur"]]
+    assert "other" not in provider.built
+    assert sorted(provider.built) == ["app", "aur-libs"]
@@ -0,0 +1,97 @@
+import argparse
+import subprocess
+
+import pytest
+import yaml
+
+from conftest import StubProvider, engine
+from providers import arch, debian, fedora, gentoo, opensuse, void
+from providers.base_provider import dependency_closure_of, split_rpm_filename
+
+@pytest.mark.parametrize("filename, expected", [
+    ("foo-bar-1.2-3.fc40.x86_64.rpm", ("foo-bar", "1.2-3.fc40")),
+    ("kernel-6.8.9-300.fc40.noarch.rpm", ("kernel", "6.8.9-300.fc40")),
+    ("foo-1.2-3.fc40.src.rpm", None),
+    ("foo.x86_64.rpm", None),
+    ("foo-1.2-3.deb", None),
+])
+def test_split_rpm_filename(filename, expected):
+    assert split_rpm_filename(filename) == expected
+
+@pytest.mark.parametrize("module, filename, expected", [
+    (arch, "foo-bar-1:2.0-3-x86_64.pkg.tar.zst", ("foo-bar", "1:2.0-3")),
+    (arch, "foo-bar-1:2.0-3-x86_64.pkg.tar.zst.sig", None),
+    (arch, "foo-2.0-x86_64.pkg.tar.zst", None),
+    (debian, "libfoo1_1%3a2.3-1_amd64.deb", ("libfoo1", "1:2.3-1")),
+    (debian, "libfoo1_2.3-1.deb", None),
+    (fedora, "python3-foo-1.0-1.fc40.noarch.rpm", ("python3-foo", "1.0-1.fc40")),
+    (opensuse, "libfoo1-2.3-150500.1.2.x86_64.rpm", ("libfoo1", "2.3-150500.1.2")),
+    (gentoo, "bash-5.2_p15-r1-1.gpkg.tar", ("bash", "5.2_p15-r1")),
+    (gentoo, "bash-5.2_p15.tbz2", ("bash", "5.2_p15")),
+    (gentoo, "Packages", None),
+    (void, "foo-bar-1.2_3.x86_64.xbps", ("foo-bar", "1.2_3")),
+    (void, "foo-bar-1.2.x86_64.xbps", None),
+])
+def test_parse_package_filename(module, filename, expected):
+    assert module.Provider().parse_package_filename(filename) == expected
+
+def test_dependency_closure_follows_packages_and_virtual_names():
+    depends = {"app": ["libfoo", "mail-transport-agent"], "libfoo": ["libc", "missing"],
+               "libc": [], "postfix": ["libc"], "unrelated": []}
+    provides = {"mail-transport-agent": ["postfix"]}
+    assert dependency_closure_of({"app"}, depends, provides) == {"app", "libfoo", "libc", "postfix"}
+    assert dependency_closure_of(set(), depends, provides) == set()
+
+class CacheProvider(StubProvider):
+    """Debian package file names, a dependency table, and a cache directory."""
+    bundle_import_mode = "seed"
+    parse_package_filename = debian.Provider.parse_package_filename
+
+    def __init__(self, cache_dir, depends, **kwargs):
+        super().__init__(**kwargs)
+        self.package_cache_dir = str(cache_dir)
+        self.package_cache_globs = [str(cache_dir / "*.deb")]
+        self.depends = depends
+
+    def dependency_closure(self, names):
+        return dependency_closure_of(names, self.depends, {})
+
+@pytest.fixture
+def copies(monkeypatch):
+    """The commands import_package_bundle() runs, without running them."""
+    calls = []
+    def run(cmd, **kwargs):
+        calls.append((cmd, kwargs.get("cwd")))
+        return subprocess.CompletedProcess(cmd, 0)
+    monkeypatch.setattr(subprocess, "run", run)
+    return calls
+
+def test_exported_bundles_import_until_a_file_is_tampered_with(config_dir, tmp_path, copies, capsys):
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n- foo\n- gone\n")
+    cache = tmp_path / "cache"
+    cache.mkdir()
+    for name in ["foo_1.0_amd64.deb", "foo_0.9_amd64.deb", "libfoo1_1%3a2.0-1_amd64.deb"]:
+        (cache / name).write_bytes(name.encode())
+    provider = CacheProvider(cache, {"foo": ["libfoo1"], "libfoo1": []},
+                             installed={"foo": "1.0", "libfoo1": "1:2.0-1"})
+    bundle = tmp_path / "bundle"
+
+    assert not engine.cmd_cache_export(provider, argparse.Namespace(output=str(bundle), from_lock=None))
+    manifest = yaml.safe_load((bundle / engine.BUNDLE_MANIFEST).read_text())
+    assert [(e["name"], e["version"], e["file"]) for e in manifest["packages"]] == [
+        ("foo", "1.0", "foo_1.0_amd64.deb"),
+        ("libfoo1", "1:2.0-1", "libfoo1_1%3a2.0-1_amd64.deb"),
+    ]
+    assert manifest["missing"] == ["gone (not installed)"]
+
+    import_args = argparse.Namespace(bundle=str(bundle), mode=None, verify_only=False)
+    assert engine.cmd_cache_import(provider, import_args)
+    (copy, cwd), = [c for c in copies if "cp" in c[0]]
+    assert cwd == str(bundle.resolve())
+    assert copy[-2:] == ["foo_1.0_amd64.deb", "libfoo1_1%3a2.0-1_amd64.deb"]
+
+    copies.clear()
+    (bundle / "foo_1.0_amd64.deb").write_bytes(b"x" * len(b"foo_1.0_amd64.deb")) # Same size
+    assert not engine.cmd_cache_import(provider, import_args)
+    assert "foo_1.0_amd64.deb (checksum mismatch)" in capsys.readouterr().out
+    assert copies == []
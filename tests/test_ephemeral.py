@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pytest
+
+from conftest import StubProvider, engine, sync_args
+from providers import base_provider
+from providers.base_provider import ephemeral_cmd
+
+class EphemeralProvider(StubProvider):
+    """Writes its drop-ins under a temp dir; each install records the command it would run."""
+    ephemeral_env = {"DEBIAN_FRONTEND": "noninteractive"}
+
+    def __init__(self, drop_in_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.drop_ins = {str(drop_in_dir / "01-nodoc"): "path-exclude /usr/share/doc/*\n",
+                         str(drop_in_dir / "02-unsafe-io"): "force-unsafe-io\n"}
+        self.commands = []
+
+    def ephemeral_files(self):
+        return self.drop_ins
+
+    def install(self, packages):
+        self.commands.append(ephemeral_cmd(["sudo", "install"] + packages))
+        return super().install(packages)
+
+@pytest.fixture
+def root_files(monkeypatch, tmp_path):
+    """Drop-ins written and removed without sudo; 'unwritable' ones fail."""
+    unwritable = set()
+    def write_root_file(path, content):
+        if path in unwritable:
+            return False
+        with open(path, 'w') as f:
+            f.write(content)
+        return True
+    def run_cmd_interactive(cmd):
+        assert cmd[:3] == ["sudo", "rm", "-f"]
+        for path in cmd[3:]:
+            Path(path).unlink(missing_ok=True)
+        return True
+    monkeypatch.setattr(base_provider, "write_root_file", write_root_file)
+    monkeypatch.setattr(base_provider, "_run_cmd_interactive", run_cmd_interactive)
+    monkeypatch.setattr(base_provider.shutil, "which", lambda name: "/usr/bin/eatmydata" if name == "eatmydata" else None)
+    return unwritable
+
+def test_ephemeral_cmd_prefixes_sudo_commands_only(tmp_path, root_files):
+    provider = EphemeralProvider(tmp_path)
+    assert provider.enable_ephemeral()
+    assert ephemeral_cmd(["sudo", "apt-get", "install", "foo"]) == [
+        "sudo", "env", "DEBIAN_FRONTEND=noninteractive", "/usr/bin/eatmydata", "apt-get", "install", "foo"]
+    assert ephemeral_cmd(["apt-cache", "show", "foo"]) == ["apt-cache", "show", "foo"]
+    assert provider.disable_ephemeral()
+    assert ephemeral_cmd(["sudo", "apt-get", "install", "foo"]) == ["sudo", "apt-get", "install", "foo"]
+
+def test_without_the_eatmydata_wrapper_its_library_is_preloaded(tmp_path, root_files, monkeypatch):
+    (tmp_path / "libeatmydata.so.1").touch()
+    monkeypatch.setattr(base_provider, "EATMYDATA_LIB_GLOBS", [str(tmp_path / "libeatmydata.so*")])
+    monkeypatch.setattr(base_provider.shutil, "which", lambda name: None)
+    provider = EphemeralProvider(tmp_path)
+    provider.ephemeral_env = {}
+    assert provider.enable_ephemeral()
+    assert ephemeral_cmd(["sudo", "dnf", "install"]) == ["sudo", "env", f"LD_PRELOAD={tmp_path}/libeatmydata.so.1", "dnf", "install"]
+    provider.disable_ephemeral()
+
+def test_ephemeral_mode_always_reverts(tmp_path, root_files):
+    provider = EphemeralProvider(tmp_path)
+    with pytest.raises(RuntimeError):
+        with engine.ephemeral_mode(provider, True):
+            assert sorted(provider.ephemeral_leftovers()) == sorted(provider.drop_ins)
+            assert ephemeral_cmd(["sudo", "true"])[1] == "env"
+            raise RuntimeError("stage crashed")
+    assert provider.ephemeral_leftovers() == []
+    assert ephemeral_cmd(["sudo", "true"]) == ["sudo", "true"]
+
+    with engine.ephemeral_mode(provider, False):
+        assert provider.ephemeral_leftovers() == []
+        assert ephemeral_cmd(["sudo", "true"]) == ["sudo", "true"]
+
+def test_ephemeral_mode_exits_when_it_cannot_be_set_up(tmp_path, root_files, capsys):
+    provider = EphemeralProvider(tmp_path)
+    root_files.add(str(tmp_path / "02-unsafe-io"))
+    with pytest.raises(SystemExit):
+        with engine.ephemeral_mode(provider, True):
+            pytest.fail("ran without the ephemeral settings")
+    assert provider.ephemeral_leftovers() == [] # The drop-in that was written is gone again
+    assert ephemeral_cmd(["sudo", "true"]) == ["sudo", "true"]
+    assert "nothing was installed" in capsys.readouterr().out
+
+def test_an_ephemeral_sync_installs_through_the_prefix(config_dir, tmp_path, root_files, monkeypatch):
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n- foo\n")
+    monkeypatch.setattr(engine, "is_live_root", lambda: False)
+    provider = EphemeralProvider(tmp_path)
+    engine.cmd_sync(provider, sync_args(ephemeral=True))
+    assert provider.commands == [["sudo", "env", "DEBIAN_FRONTEND=noninteractive", "/usr/bin/eatmydata", "install", "foo"]]
+    assert provider.ephemeral_leftovers() == []
+
+def test_a_plain_sync_cleans_up_after_an_interrupted_ephemeral_one(config_dir, tmp_path, root_files, capsys):
+    provider = EphemeralProvider(tmp_path)
+    (tmp_path / "01-nodoc").write_text("left behind\n")
+    engine.cmd_sync(provider, sync_args())
+    assert provider.ephemeral_leftovers() == []
+    assert "interrupted ephemeral sync" in capsys.readouterr().out
+
+def test_ephemeral_syncs_refuse_the_live_root(config_dir, tmp_path, root_files, monkeypatch):
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n- foo\n")
+    monkeypatch.setattr(engine, "is_live_root", lambda: True)
+    provider = EphemeralProvider(tmp_path)
+    with pytest.raises(SystemExit):
+        engine.cmd_sync(provider, sync_args(ephemeral=True))
+    assert provider.installs == []
+
+    engine.cmd_sync(provider, sync_args(ephemeral=True, dry_run=True)) # Changes nothing
+    engine.cmd_sync(provider, sync_args(ephemeral=True, allow_live_root=True))
+    assert provider.installs == ["foo"]
+
+def test_containers_are_not_the_live_root(monkeypatch):
+    monkeypatch.setenv("container", "podman")
+    assert not engine.is_live_root()
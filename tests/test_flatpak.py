@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from conftest import StubProvider, engine
+from providers import base_provider
+from providers.base_provider import BaseProvider
+
+@pytest.mark.parametrize("items, expected", [
+    (None, {}),
+    (["org.gimp.GIMP"], {"org.gimp.GIMP": {"commit": None, "remote": "flathub"}}),
+    ([{"name": "org.gimp.GIMP", "commit": "abc123"}], {"org.gimp.GIMP": {"commit": "abc123", "remote": "flathub"}}),
+    ([{"name": "com.example.Tool", "remote": "internal"}], {"com.example.Tool": {"commit": None, "remote": "internal"}}),
+    ([{"commit": "abc123"}, 42], {}), # No name
+])
+def test_parse_flatpak_list(items, expected):
+    assert engine.parse_flatpak_list(items) == expected
+
+@pytest.mark.parametrize("first, second, expected", [
+    ({"commit": None, "remote": "flathub"}, {"commit": "abc", "remote": "flathub"}, {"commit": "abc", "remote": "flathub"}),
+    ({"commit": "abc", "remote": "flathub"}, {"commit": None, "remote": "flathub"}, {"commit": "abc", "remote": "flathub"}),
+    ({"commit": "abc", "remote": "flathub"}, {"commit": "def", "remote": "flathub"}, {"commit": "def", "remote": "flathub"}),
+    ({"commit": None, "remote": "internal"}, {"commit": None, "remote": "flathub"}, {"commit": None, "remote": "internal"}),
+])
+def test_merge_flatpaks(first, second, expected):
+    merged, parsed = {}, dict(first)
+    engine.merge_flatpaks(merged, {"org.gimp.GIMP": first})
+    engine.merge_flatpaks(merged, {"org.gimp.GIMP": second})
+    assert merged == {"org.gimp.GIMP": expected}
+    assert first == parsed # Fragments are shared and stay as parsed
+
+@pytest.mark.parametrize("installed, pinned, expected", [
+    ("abc123def", "abc123def", True),
+    ("abc123def", "abc123", True),
+    ("abc123def", "def", False),
+    (None, "abc", False),
+    ("", "", False),
+])
+def test_commit_matches(installed, pinned, expected):
+    assert engine.commit_matches(installed, pinned) == expected
+
+def spec(commit=None, remote="flathub"):
+    return {"commit": commit, "remote": remote}
+
+def app(commit="aaa111"):
+    return {"branch": "stable", "commit": commit}
+
+NO_CHANGE = {"install": {}, "pin": {}, "unpin": [], "remove": []}
+
+@pytest.mark.parametrize("declared, installed, state, prune, changes", [
+    ({"a.App": spec()}, {"a.App": app()}, {}, False, {}),
+    # Only missing apps, batched per remote
+    ({"a.App": spec(), "b.App": spec(), "c.App": spec(remote="internal")}, {"a.App": app()}, {}, False,
+     {"install": {"flathub": ["b.App"], "internal": ["c.App"]}}),
+    # A new pin, a pin already in place, and one whose commit moved on
+    ({"a.App": spec("aaa"), "b.App": spec("bbb"), "c.App": spec("ccc")},
+     {"a.App": app("aaa111"), "b.App": app("bbb222"), "c.App": app("xxx")},
+     {"flatpak_pins": {"b.App": "bbb", "c.App": "ccc"}}, False,
+     {"pin": {"a.App": "aaa", "c.App": "ccc"}}),
+    # A missing pinned app is installed, then moved to its commit
+    ({"a.App": spec("aaa")}, {}, {}, False, {"install": {"flathub": ["a.App"]}, "pin": {"a.App": "aaa"}}),
+    # Pins dropped from the config, or with their app, are lifted
+    ({"a.App": spec()}, {"a.App": app(), "b.App": app()}, {"flatpak_pins": {"a.App": "aaa", "b.App": "bbb"}}, False,
+     {"unpin": ["a.App", "b.App"]}),
+    # Pruning removes only the apps wcli installed
+    ({"a.App": spec()}, {"a.App": app(), "b.App": app(), "mine.App": app()}, {"flatpaks": ["a.App", "b.App", "gone.App"]}, True,
+     {"remove": ["b.App"]}),
+    ({"a.App": spec()}, {"a.App": app(), "b.App": app()}, {"flatpaks": ["a.App", "b.App"]}, False, {}),
+])
+def test_plan_flatpaks(declared, installed, state, prune, changes):
+    assert engine.plan_flatpaks(declared, installed, state, prune) == {**NO_CHANGE, **changes}
+
+def deploy(root, app_id, arch, branch, commit):
+    branch_dir = root / "app" / app_id / arch / branch
+    (branch_dir / commit).mkdir(parents=True)
+    os.symlink(commit, branch_dir / "active")
+
+def test_installed_flatpaks_are_read_from_the_deploy_dirs(tmp_path, monkeypatch):
+    machine = os.uname().machine
+    deploy(tmp_path, "org.gimp.GIMP", machine, "stable", "aaa111")
+    deploy(tmp_path, "org.gimp.GIMP", "zz-other-arch", "stable", "zzz999") # Sorted after the native one
+    deploy(tmp_path, "org.gnome.Builder", machine, "master", "bbb222")
+    (tmp_path / "app" / "org.broken.App" / machine / "stable").mkdir(parents=True) # No 'active' link
+    monkeypatch.setattr(base_provider, "FLATPAK_SYSTEM_DIR", str(tmp_path))
+    monkeypatch.setattr(base_provider.shutil, "which", lambda name: pytest.fail("ran flatpak"))
+
+    assert BaseProvider.get_installed_flatpaks(StubProvider()) == {
+        "org.gimp.GIMP": {"branch": "stable", "commit": "aaa111"},
+        "org.gnome.Builder": {"branch": "master", "commit": "bbb222"},
+    }
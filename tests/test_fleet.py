@@ -0,0 +1,108 @@
+import pytest
+
+from conftest import engine
+
+BASE = {"git": (), "vim": ((">=", "9"),), "nano": ()}
+AT_LEAST_2 = ((">=", "2"),)
+BELOW_3 = (("<", "3"),)
+
+@pytest.mark.parametrize("layers, excluded, expected, touched", [
+    # Nothing on top of base
+    ([], set(), {"git": (), "vim": ((">=", "9"),), "nano": (), "htop": None}, set()),
+    # A new entry, then constrained again by a module
+    ([({"htop": AT_LEAST_2}, False), ({"htop": BELOW_3}, False)], set(),
+     {"htop": AT_LEAST_2 + BELOW_3}, {"htop"}),
+    # Constraints add to base's
+    ([({"git": AT_LEAST_2, "vim": BELOW_3}, False)], set(),
+     {"git": AT_LEAST_2, "vim": ((">=", "9"),) + BELOW_3}, {"git", "vim"}),
+    # Declaring a base entry again changes nothing
+    ([({"git": (), "vim": ()}, False)], set(), {"git": (), "vim": ((">=", "9"),)}, set()),
+    # additional_packages replaces constraints, but only when it has some
+    ([({"vim": BELOW_3}, False), ({"vim": (("==", "9.1"),), "git": ()}, True)], set(),
+     {"vim": (("==", "9.1"),), "git": ()}, {"vim"}),
+    # Exclusions win over base and over every layer
+    ([({"htop": (), "nano": AT_LEAST_2}, False)], {"nano", "htop", "unknown"},
+     {"nano": None, "htop": None, "git": ()}, {"nano"}),
+])
+def test_host_view(layers, excluded, expected, touched):
+    view = engine.HostView("web", BASE, layers, excluded)
+    assert {label: view.get(label) for label in expected} == expected
+    assert view.touched() == touched
+    assert view.base is BASE # Shared, not copied
+
+@pytest.mark.parametrize("old, new, expected", [
+    ({"git": ()}, {"git": ()}, ([], [], [])),
+    ({}, {"git": ()}, ([("git", ())], [], [])),
+    ({"git": ()}, {}, ([], [("git", ())], [])),
+    ({"git": ()}, {"git": AT_LEAST_2}, ([], [], [("git", (), AT_LEAST_2)])),
+    ({"b": (), "a": ()}, {"c": ()}, ([("c", ())], [("a", ()), ("b", ())], [])), # Sorted by label
+])
+def test_diff_entries(old, new, expected):
+    assert engine.diff_entries(old.get, new.get, set(old) | set(new)) == expected
+
+@pytest.mark.parametrize("host_modules, config, expected", [
+    (["srv"], None, ["srv"]), # Another host: only its own file counts
+    (["srv"], {"enabled_modules": ["dev"]}, ["dev", "srv"]),
+    (["dev", "srv"], {"enabled_modules": ["dev"]}, ["dev", "srv"]), # Enabled twice, listed once
+    ([], {"enabled_modules": None}, []),
+])
+def test_host_modules(host_modules, config, expected):
+    assert engine.host_modules({"modules": host_modules}, config) == expected
+
+def test_host_modules_without_a_host_file():
+    assert engine.host_modules(None, {"enabled_modules": ["dev"]}) == ["dev"]
+
+FLEET = {
+    "config.yaml": "host: test\nenabled_modules:\n  - dev\nadditional_packages:\n  - { name: vim, version: \"==9.1\" }\n",
+    "packages/base.yaml": "packages:\n  - git\n  - { name: vim, version: \">=9\" }\n  - nano\n",
+    "packages/modules/srv.yaml": "packages:\n  - { name: git, version: \"<3\" }\n  - nginx\nexclude:\n  - nano\n",
+    "packages/modules/dev.yaml": "packages:\n  - gdb\n",
+    "packages/hosts/web1.yaml": "modules:\n  - srv\n",
+    "packages/hosts/web2.yaml": "modules:\n  - srv\n  - missing\npackages:\n  - htop\n",
+    "packages/hosts/test.yaml": "packages:\n  - { name: git, version: \">=2\" }\n",
+    "packages/hosts/empty.yaml": "",
+}
+
+@pytest.fixture
+def fleet(config_dir):
+    for path, text in FLEET.items():
+        (config_dir / path).write_text(text)
+    return config_dir
+
+def test_load_fleet(fleet, monkeypatch, capsys):
+    loaded = []
+    load_package_file = engine.load_package_file
+    monkeypatch.setattr(engine, "load_package_file", lambda path: loaded.append(path.name) or load_package_file(path))
+
+    base, hosts = engine.load_fleet(engine.load_config())
+    assert base == {"git": (), "vim": ((">=", "9"),), "nano": ()}
+    assert list(hosts) == ["empty", "test", "web1", "web2"]
+    labels = ["git", "vim", "nano", "nginx", "gdb", "htop"]
+    assert {name: [view.get(label) for label in labels] for name, view in hosts.items()} == {
+        "empty": [(), ((">=", "9"),), (), None, None, None],
+        # The local host also gets config.yaml's modules and additional_packages
+        "test": [AT_LEAST_2, (("==", "9.1"),), (), None, (), None],
+        "web1": [BELOW_3, ((">=", "9"),), None, (), None, None],
+        "web2": [BELOW_3, ((">=", "9"),), None, (), None, ()],
+    }
+    assert sorted(loaded) == ["base.yaml", "dev.yaml", "empty.yaml", "missing.yaml", "srv.yaml",
+                              "test.yaml", "web1.yaml", "web2.yaml"] # Each file once
+    assert "Module 'missing' not found" in capsys.readouterr().out
+
+def test_package_files_are_parsed_again_only_when_they_change(config_dir, capsys):
+    path = config_dir / "packages" / "base.yaml"
+    path.write_text("packages:\n  - git\n")
+    first = engine.load_package_file(path)
+    assert engine.load_package_file(path) is first
+
+    path.write_text("packages:\n  - git\n  - vim\n")
+    second = engine.load_package_file(path)
+    assert second is not first and set(second["packages"]) == {"git", "vim"}
+
+    path.write_text("packages: [unclosed\n")
+    assert engine.load_package_file(path) is None
+    assert engine.load_package_file(path) is None
+    assert capsys.readouterr().out.count("Could not parse") == 1 # Failures are remembered too
+
+    path.unlink()
+    assert engine.load_package_file(path) is None
@@ -0,0 +1,45 @@
+import pytest
+
+from providers import gentoo
+
+@pytest.mark.parametrize("cores, expected", [
+    (None, ["--jobs=1", "--load-average=1"]), # os.cpu_count() could not tell
+    (1, ["--jobs=1", "--load-average=1"]),
+    (2, ["--jobs=1", "--load-average=2"]),
+    (8, ["--jobs=4", "--load-average=8"]),
+    (15, ["--jobs=7", "--load-average=15"]),
+])
+def test_emerge_parallel_opts(monkeypatch, cores, expected):
+    monkeypatch.setattr(gentoo.os, "cpu_count", lambda: cores)
+    assert gentoo.emerge_parallel_opts() == expected
+
+@pytest.mark.parametrize("binpkg_dir, args, expected", [
+    ("", ["--update", "--oneshot", "vim"],
+     ["sudo", "emerge", "--usepkg", "--buildpkg", "--jobs=2", "--load-average=4", "--update", "--oneshot", "vim"]),
+    ("/mnt/binhost", ["-auDN", "@world"],
+     ["sudo", "env", "PKGDIR=/mnt/binhost", "emerge", "--usepkg", "--buildpkg", "--jobs=2", "--load-average=4", "-auDN", "@world"]),
+])
+def test_emerge_cmd(monkeypatch, binpkg_dir, args, expected):
+    monkeypatch.setattr(gentoo.os, "cpu_count", lambda: 4)
+    monkeypatch.setattr(gentoo, "BINPKG_DIR", binpkg_dir)
+    assert gentoo.emerge_cmd(args) == expected
+
+@pytest.mark.parametrize("pkg, atom", [
+    ("vim", "vim"),
+    ("app-editors/vim", "app-editors/vim"),
+    ("app-misc/yq=4.0", "=app-misc/yq-4.0"),
+    ("app-misc/yq==4.0", "=app-misc/yq-4.0"),
+    (">=app-misc/yq-4.0", ">=app-misc/yq-4.0"),
+    ("=app-misc/yq-4.0", "=app-misc/yq-4.0"),
+])
+def test_to_atom(pkg, atom):
+    assert gentoo._to_atom(pkg) == atom
+
+def test_install_emerges_the_whole_set_in_one_batch(monkeypatch):
+    ran = []
+    monkeypatch.setattr(gentoo, "run_cmd", lambda cmd: ran.append(cmd) or True)
+    monkeypatch.setattr(gentoo, "BINPKG_DIR", "")
+    assert gentoo.Provider().install(["vim", "app-misc/yq=4.0"])
+    (cmd,) = ran
+    assert cmd[-5:] == ["--noreplace", "--verbose", "--keep-going", "vim", "=app-misc/yq-4.0"]
+    assert cmd[:4] == ["sudo", "emerge", "--usepkg", "--buildpkg"]
@@ -0,0 +1,53 @@
+from conftest import StubProvider, engine, sync_args
+from providers import gentoo, opensuse
+
+def gentoo_provider(monkeypatch, tmp_path, installed):
+    written = {}
+    def write_root_file(path, text):
+        written[path] = text
+        return True
+    monkeypatch.setattr(gentoo, "PACKAGE_MASK_DIR", tmp_path / "package.mask")
+    monkeypatch.setattr(gentoo, "write_root_file", write_root_file)
+    provider = gentoo.Provider()
+    monkeypatch.setattr(provider, "_installed_categories", lambda: installed)
+    return provider, written
+
+def test_gentoo_pins_take_the_installed_category(monkeypatch, tmp_path):
+    provider, written = gentoo_provider(monkeypatch, tmp_path, {"bash": {"app-shells"}})
+    assert provider.sync_holds({"bash": {"type": "exact", "version": "5.2"}}, {})
+    assert ">app-shells/bash-5.2" in written[str(tmp_path / "package.mask" / "wcli")]
+
+def test_gentoo_pins_that_cannot_be_masked_fail_the_sync(monkeypatch, tmp_path):
+    provider, written = gentoo_provider(monkeypatch, tmp_path, {"foo": {"dev-libs", "sys-apps"}})
+    wanted = {
+        "foo": {"type": "exact", "version": "1.0"},
+        "missing": {"type": "exact", "version": "1.0"},
+        "sys-apps/sed": {"type": "maximum", "version": "4.9", "strict": True},
+    }
+    assert not provider.sync_holds(wanted, {})
+    text = written[str(tmp_path / "package.mask" / "wcli")]
+    assert ">=sys-apps/sed-4.9" in text
+    assert "foo" not in text and "missing" not in text
+
+def test_opensuse_locks_are_removed_with_the_spec_they_were_added_with(monkeypatch):
+    ran = []
+    monkeypatch.setattr(opensuse, "run_cmd", lambda cmd: ran.append(cmd) or True)
+    provider = opensuse.Provider()
+    monkeypatch.setattr(provider, "wait_for_package_lock", lambda: True)
+    previous = {"foo": {"type": "maximum", "version": "1.2", "strict": True}, "bar": {"type": "exact", "version": "2.0"}}
+    wanted = {"foo": {"type": "maximum", "version": "1.4"}, "bar": {"type": "exact", "version": "2.0"}}
+    assert provider.sync_holds(wanted, previous)
+    assert ran == [["sudo", "zypper", "removelock", "foo >= 1.2"], ["sudo", "zypper", "addlock", "foo > 1.4"]]
+
+class HoldingProvider(StubProvider):
+    supports_holds = True
+
+    def sync_holds(self, wanted, previous):
+        self.holds_applied_after = list(self.installs)
+        return True
+
+def test_sync_updates_native_holds_before_it_installs(config_dir):
+    (config_dir / "config.yaml").write_text("host: test\nenabled_modules: []\nadditional_packages:\n- name: foo\n  version: '1.0'\n")
+    provider = HoldingProvider()
+    engine.cmd_sync(provider, sync_args())
+    assert provider.installs and provider.holds_applied_after == []
@@ -0,0 +1,71 @@
+import pytest
+
+from conftest import StubProvider, engine
+
+def write_hook(config_dir, name, body, executable=True):
+    path = config_dir / "scripts" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(body)
+    path.chmod(0o755 if executable else 0o644)
+    return path
+
+def test_hook_headers(config_dir):
+    write_hook(config_dir, "10-initramfs", "#!/bin/sh\n# wcli-trigger: linux, linux-lts *-dkms\n"
+               "#  wcli-timeout : 15m\n# wcli-independent: yes\n# wcli-sudo: TRUE\n")
+    write_hook(config_dir, "20-late", "#!/bin/sh\n" + "# filler\n" * 30 + "# wcli-trigger: never-read\n")
+    write_hook(config_dir, "30-bad-timeout", "#!/bin/sh\n# wcli-trigger: foo\n# wcli-timeout: soon\n")
+    write_hook(config_dir, "40-plain-file", "#!/bin/sh\n# wcli-trigger: foo\n", executable=False)
+    write_hook(config_dir, "50-backup~", "#!/bin/sh\n")
+    write_hook(config_dir, ".hidden", "#!/bin/sh\n")
+
+    hooks = {hook["name"]: hook for hook in engine.load_hooks()}
+    assert list(hooks) == ["10-initramfs", "20-late", "30-bad-timeout", "40-plain-file"]
+    initramfs = hooks["10-initramfs"]
+    assert initramfs["triggers"] == ["linux", "linux-lts", "*-dkms"]
+    assert (initramfs["timeout"], initramfs["independent"], initramfs["sudo"], initramfs["error"]) == (900, True, True, None)
+    assert hooks["20-late"]["triggers"] == [] # Past the header lines
+    assert (hooks["20-late"]["timeout"], hooks["20-late"]["independent"]) == (engine.HOOK_TIMEOUT, False)
+    assert hooks["30-bad-timeout"]["error"]
+    assert hooks["40-plain-file"]["error"] == "not executable"
+
+@pytest.mark.parametrize("triggers, names, expected", [
+    (["linux"], ["linux", "linux-lts", "linux-headers"], ["linux"]),
+    (["linux*"], ["linux", "linux-lts", "util-linux"], ["linux", "linux-lts"]),
+    (["*-dkms"], ["nvidia-dkms", "dkms"], ["nvidia-dkms"]),
+    (["libc6"], ["libc6:amd64", "libc6:i386", "libc6-dev:amd64"], ["libc6:amd64", "libc6:i386"]),
+    (["Linux"], ["linux"], []),
+    ([], ["linux"], []),
+])
+def test_hook_matches(triggers, names, expected):
+    assert engine.hook_matches({"triggers": triggers}, names) == expected
+
+def test_a_failed_hook_keeps_its_triggers_until_it_succeeds(config_dir, tmp_path):
+    seen = tmp_path / "seen"
+    hook = write_hook(config_dir, "rebuild", f'#!/bin/sh\n# wcli-trigger: linux *-dkms\necho "$WCLI_TRIGGERS" >> {seen}\nexit 1\n')
+
+    assert not engine.run_hooks(engine.load_hooks(), {"linux": "upgraded", "vim": "installed"})
+    assert engine.load_hook_state()["rebuild"]["pending"] == ["linux"]
+
+    # Nothing else changed: the pending trigger alone runs it again, and it still fails
+    assert not engine.run_hooks(engine.load_hooks(), {})
+    assert not engine.run_hooks(engine.load_hooks(), {"nvidia-dkms": "installed"})
+    assert engine.load_hook_state()["rebuild"]["pending"] == ["linux", "nvidia-dkms"]
+
+    hook.write_text(hook.read_text().replace("exit 1", "exit 0"))
+    assert engine.run_hooks(engine.load_hooks(), {})
+    assert "pending" not in engine.load_hook_state()["rebuild"]
+    assert seen.read_text().splitlines() == ["linux", "linux", "linux nvidia-dkms", "linux nvidia-dkms"]
+    assert engine.run_hooks(engine.load_hooks(), {}) # Nothing due
+    assert len(seen.read_text().splitlines()) == 4
+
+class HelperNames(StubProvider):
+    def installed_name(self, package):
+        return package.split("/")[-1]
+
+def test_plan_package_names_use_the_installed_names():
+    plan = {"downgrade": [("a", "1.0")], "install": {"new": ["b"], "upgrade": ["c"]}, "remove": ["d"],
+            "aur": ["e"], "src": ["f"], **{stage: {} for stage in engine.HELPER_STAGES}}
+    plan["overlay"] = {"guru": ["dev-util/g"]}
+    provider = HelperNames(installed={name: "1.0" for name in "abcdgxyz"})
+    assert engine.plan_package_names(provider, plan) == set("abcdefg")
+    assert engine.untouched_packages(provider, provider.installed, plan) == {"x": "1.0", "y": "1.0", "z": "1.0"}
@@ -0,0 +1,117 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import yaml
+
+from conftest import StubProvider, engine
+from providers import base_provider
+
+def test_state_writes_do_not_wait_for_readers(config_dir):
+    with engine.command_lock("status", "none"), engine.command_lock("verify", "none"):
+        with engine.command_lock("sync", "exclusive", timeout=0):
+            engine.atomic_write_yaml(engine.SYNC_PROGRESS_FILE, {"done": ["install"]})
+    assert yaml.safe_load(engine.SYNC_PROGRESS_FILE.read_text()) == {"done": ["install"]}
+
+def test_readers_note_a_running_writer(config_dir, capsys):
+    with engine.command_lock("sync", "exclusive"):
+        with engine.command_lock("status", "none"):
+            pass
+    assert "'wcli sync'" in capsys.readouterr().out
+
+@pytest.mark.parametrize("args, mode", [
+    (dict(lock="exclusive", dry_run=False), "exclusive"),
+    (dict(lock="exclusive", dry_run=True), "none"), # sync --dry-run, update --declared-only --dry-run
+    (dict(lock="exclusive", list=True), "none"), # backup --list
+    (dict(lock="none"), "none"),
+    (dict(), None),
+])
+def test_runs_that_change_nothing_take_no_lock(args, mode):
+    assert engine.command_lock_mode(argparse.Namespace(**args)) == mode
+
+def proc_locks_line(n, kind, pid, path):
+    st = os.stat(path)
+    return f"{n}: {kind} ADVISORY  WRITE {pid} {os.major(st.st_dev):02x}:{os.minor(st.st_dev):02x}:{st.st_ino} 0 EOF"
+
+def test_locked_by_reads_proc_locks(tmp_path, monkeypatch):
+    lock, other = tmp_path / "lock", tmp_path / "other"
+    lock.touch()
+    other.touch()
+    proc_locks = tmp_path / "locks"
+    proc_locks.write_text("\n".join([
+        proc_locks_line(1, "POSIX ", 1234, lock),
+        proc_locks_line(1, "-> POSIX ", 4321, lock), # Waiting for it, not holding it
+        proc_locks_line(2, "FLOCK ", 5678, other),
+        proc_locks_line(3, "OFDLCK", -1, lock),
+        "4: LEASE  ACTIVE    READ 99 garbage 0 EOF",
+    ]) + "\n")
+    monkeypatch.setattr(base_provider, "PROC_LOCKS", str(proc_locks))
+    assert base_provider._locked_by(str(lock)) == [1234, None]
+    assert base_provider._locked_by(str(other)) == [5678]
+    assert base_provider._locked_by(str(tmp_path / "missing")) == []
+
+def test_pid_file_holder(tmp_path):
+    pid_file = tmp_path / "pid"
+    for text in ["", "not a pid\n"]:
+        pid_file.write_text(text)
+        assert base_provider._pid_file_holder(str(pid_file)) == []
+    pid_file.write_text(f"{os.getpid()}\n")
+    assert base_provider._pid_file_holder(str(pid_file)) == [os.getpid()]
+
+    child = subprocess.Popen(["true"])
+    pid_file.write_text(f"{child.pid}\n")
+    deadline = time.monotonic() + 5
+    while base_provider._pid_file_holder(str(pid_file)) and time.monotonic() < deadline:
+        time.sleep(0.01) # Exited but not reaped yet: a zombie is not a holder
+    assert base_provider._pid_file_holder(str(pid_file)) == []
+    child.wait()
+    assert base_provider._pid_file_holder(str(pid_file)) == []
+    assert base_provider._pid_file_holder(str(tmp_path / "missing")) == []
+
+HOLD_LOCK = """
+import fcntl, sys, time
+f = open(sys.argv[1], 'a')
+fcntl.lockf(f, fcntl.LOCK_EX)
+print("locked", flush=True)
+time.sleep(60)
+"""
+
+@pytest.fixture
+def held_lock(tmp_path):
+    """A lock file held by a child process, until it is killed."""
+    path = tmp_path / "lock"
+    child = subprocess.Popen([sys.executable, "-c", HOLD_LOCK, str(path)], stdout=subprocess.PIPE, text=True)
+    assert child.stdout.readline() == "locked\n"
+    yield path, child
+    child.kill()
+    child.wait()
+
+def test_waiting_for_a_package_lock_times_out(held_lock, capsys):
+    path, child = held_lock
+    provider = StubProvider()
+    provider.package_locks = [("fcntl", str(path))]
+    provider.package_lock_timeout = 0.5
+    assert provider.package_lock_holders() == [(str(path), child.pid)]
+
+    provider.start_failure_report()
+    start = time.monotonic()
+    assert not provider.wait_for_package_lock()
+    assert 0.5 <= time.monotonic() - start < 5
+    assert provider.lock_timed_out
+    assert f"held by PID {child.pid}" in capsys.readouterr().out
+
+def test_a_released_package_lock_is_noticed(held_lock):
+    path, child = held_lock
+    provider = StubProvider()
+    provider.package_locks = [("fcntl", str(path))]
+    provider.package_lock_timeout = 30
+    provider.start_failure_report()
+    threading.Timer(0.3, child.kill).start()
+    start = time.monotonic()
+    assert provider.wait_for_package_lock()
+    assert time.monotonic() - start < 10
+    assert not provider.lock_timed_out
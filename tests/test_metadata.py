@@ -0,0 +1,35 @@
+import os
+import time
+
+from conftest import StubProvider
+
+class RefreshingProvider(StubProvider):
+    def __init__(self, tmp_path):
+        super().__init__()
+        self.refreshes = 0
+        self.refresh_stamp = str(tmp_path / "metadata-refreshed")
+        self.metadata_globs = [str(tmp_path / "lists" / "*_InRelease")]
+
+    def _refresh_metadata(self, repos=None):
+        self.refreshes += 1
+        return True
+
+def test_age_comes_from_the_last_refresh_not_the_mirror_mtimes(tmp_path):
+    (tmp_path / "lists").mkdir()
+    quiet_repo = tmp_path / "lists" / "quiet_InRelease"
+    quiet_repo.write_text("")
+    month_ago = time.time() - 30 * 86400
+    os.utime(quiet_repo, (month_ago, month_ago))
+
+    provider = RefreshingProvider(tmp_path)
+    provider.max_metadata_age = 3600
+    assert provider.metadata_age() is None
+    provider.refresh_metadata()
+    assert provider.metadata_age() < 60
+    provider.refresh_metadata()
+    assert provider.refreshes == 1
+
+def test_a_refresh_of_single_repos_is_not_a_complete_refresh(tmp_path):
+    provider = RefreshingProvider(tmp_path)
+    provider.refresh_metadata(force=True, repos=["ppa:foo/bar"])
+    assert provider.metadata_age() is None
@@ -0,0 +1,37 @@
+import fcntl
+import threading
+import time
+
+import pytest
+
+from conftest import engine
+
+@pytest.fixture
+def prom(config_dir, monkeypatch, tmp_path):
+    path = tmp_path / "textfile" / "wcli.prom"
+    (config_dir / "config.yaml").write_text(f"host: test\nenabled_modules: []\nmetrics_file: {path}\n")
+    monkeypatch.setattr(engine, "run_metrics", engine.RunMetrics())
+    return path
+
+def test_each_command_keeps_its_own_samples(prom, monkeypatch):
+    engine.run_metrics.set("wcli_missing_packages", 3, kind="packages")
+    engine.write_metrics("status")
+    monkeypatch.setattr(engine, "run_metrics", engine.RunMetrics())
+    engine.write_metrics("outdated")
+
+    text = prom.read_text()
+    assert 'wcli_last_run_timestamp_seconds{command="status"}' in text
+    assert 'wcli_last_run_timestamp_seconds{command="outdated"}' in text
+    assert 'wcli_missing_packages{kind="packages"} 3' in text
+    assert prom.stat().st_mode & 0o777 == 0o644
+
+def test_concurrent_commands_merge_one_at_a_time(prom):
+    prom.parent.mkdir()
+    with open(prom.parent / ".wcli.prom.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX) # Another command in the middle of its merge
+        writer = threading.Thread(target=engine.write_metrics, args=("status",))
+        writer.start()
+        time.sleep(0.3)
+        assert writer.is_alive() and not prom.exists()
+    writer.join(timeout=5)
+    assert 'command="status"' in prom.read_text()
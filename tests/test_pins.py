@@ -0,0 +1,19 @@
+import yaml
+
+from conftest import engine
+
+def test_pinning_an_unversioned_last_entry_and_adding_new_ones():
+    text = "host: test\nadditional_packages:\n  - name: zsh\n    version: '5.9'\n  - name: bash\n"
+    edited = engine.edit_pins(text, {"bash": "5.2", "bash-completion": "2.11"})
+    assert yaml.safe_load(edited)["additional_packages"] == [
+        {"name": "zsh", "version": "5.9"},
+        {"name": "bash", "version": "5.2"},
+        {"name": "bash-completion", "version": "2.11"},
+    ]
+    assert edited.startswith(text.rstrip("\n"))
+
+def test_pinning_keeps_comments():
+    text = "additional_packages:\n  - name: bash # login shell\n  - htop\n"
+    edited = engine.edit_pins(text, {"bash": "5.2"})
+    assert "# login shell" in edited
+    assert engine.pinned_versions(yaml.safe_load(edited)) == {"bash": "5.2", "htop": None}
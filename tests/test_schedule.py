@@ -0,0 +1,89 @@
+import argparse
+import time
+
+import pytest
+
+from conftest import StubProvider, engine
+
+def at(clock: str) -> float:
+    """A fixed local time on a fixed day, as a timestamp."""
+    h, m, s = (int(part) for part in clock.split(":"))
+    return time.mktime((2026, 3, 14, h, m, s, 0, 0, -1))
+
+@pytest.mark.parametrize("text, expected", [
+    ("02:00-05:30", (7200, 19800)),
+    ("2:00-5:00", (7200, 18000)),
+    (" 22:00-03:00 ", (79200, 10800)),
+    ("00:00-23:59", (0, 86340)),
+])
+def test_parse_window(text, expected):
+    assert engine.parse_window(text) == expected
+
+@pytest.mark.parametrize("text", ["24:00-05:00", "02:60-05:00", "02:00", "2-5", "02:00-05:00:00", ""])
+def test_parse_window_rejects(text):
+    with pytest.raises(ValueError):
+        engine.parse_window(text)
+
+@pytest.mark.parametrize("window, clock, expected", [
+    ("02:00-05:00", "02:00:00", 3 * 3600),
+    ("02:00-05:00", "04:59:30", 30),
+    ("02:00-05:00", "05:00:00", None),
+    ("02:00-05:00", "01:59:59", None),
+    # Past midnight
+    ("22:00-03:00", "22:00:00", 5 * 3600),
+    ("22:00-03:00", "23:30:00", 3 * 3600 + 1800),
+    ("22:00-03:00", "00:00:00", 3 * 3600),
+    ("22:00-03:00", "02:59:00", 60),
+    ("22:00-03:00", "03:00:00", None),
+    ("22:00-03:00", "12:00:00", None),
+])
+def test_seconds_left_in_window(window, clock, expected):
+    assert engine.seconds_left_in_window(engine.parse_window(window), at(clock)) == expected
+
+def test_splay_delay_is_stable_per_host_and_clamped_to_the_window():
+    delays = {host: engine.splay_delay(host, 3600) for host in ["web1", "web2", "db1"]}
+    assert delays == {host: engine.splay_delay(host, 3600) for host in delays}
+    assert len(set(delays.values())) == 3
+    assert all(0 <= d < 3600 for d in delays.values())
+
+    window = engine.parse_window("02:00-05:00")
+    for host, delay in delays.items():
+        # Plenty of window left: the same delay as without one
+        assert engine.splay_delay(host, 3600, window, at("02:00:00")) == delay
+        # 10 minutes left: the same fraction of those 10 minutes
+        assert engine.splay_delay(host, 3600, window, at("04:50:00")) == int(delay * 600 / 3600)
+        assert engine.splay_delay(host, 3600, window, at("06:00:00")) is None
+
+def test_a_sync_is_a_noop_until_config_or_packages_change(config_dir):
+    provider = StubProvider(installed={"foo": "1.0"})
+    assert not engine.sync_is_noop(provider, prune=False) # Never synced
+
+    engine.record_clean_sync(provider.get_installed_packages_with_versions(), prune=False)
+    assert engine.sync_is_noop(provider, prune=False)
+    assert not engine.sync_is_noop(provider, prune=True)
+
+    provider.installed["foo"] = "1.1"
+    assert not engine.sync_is_noop(provider, prune=False)
+    provider.installed["foo"] = "1.0"
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n- bar\n")
+    assert not engine.sync_is_noop(provider, prune=False)
+
+def schedule_args(**overrides) -> argparse.Namespace:
+    args = dict(splay="30m", window=None, prune=False, user="alice", on_calendar=None)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+@pytest.mark.parametrize("overrides, exec_args, calendar", [
+    ({}, "sync --force --splay 30m", "daily"),
+    ({"window": "02:00-05:00"}, "sync --force --splay 30m --window 02:00-05:00", "02:00"),
+    ({"window": "02:00-05:00", "on_calendar": "Sun 01:00"}, "sync --force --splay 30m --window 02:00-05:00", "Sun 01:00"),
+    ({"prune": True}, "sync --force --splay 30m --prune", "daily"),
+])
+def test_schedule_units(overrides, exec_args, calendar):
+    service, timer = engine.schedule_units(schedule_args(**overrides))
+    exec_start = next(line for line in service.splitlines() if line.startswith("ExecStart="))
+    assert exec_start.endswith(f"/wcli {exec_args}")
+    assert "User=alice\n" in service
+    assert f"Environment=SYS_CONFIG_DIR={engine.SYS_CONFIG_DIR}\n" in service
+    assert f"OnCalendar={calendar}\n" in timer
+    assert "Persistent=true\n" in timer
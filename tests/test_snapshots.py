@@ -0,0 +1,112 @@
+import subprocess
+import time
+
+import pytest
+
+from conftest import engine
+
+DAY = 86400
+AUTO = engine.AUTO_SNAPSHOT_COMMENT
+NOW = time.time()
+
+def stamp(days_ago: float, fmt: str) -> str:
+    return time.strftime(fmt, time.localtime(NOW - days_ago * DAY))
+
+# Auto-snapshots 1, 3, 5, 10, 20 and 30 days old, a manual wcli snapshot
+# and one that is not wcli's
+AGES = {"101": 30, "102": 20, "103": 10, "104": 5, "105": 3, "106": 1}
+
+def snapper_list() -> str:
+    rows = ["number,date,description", "0,,current"]
+    rows += [f"{number},{stamp(age, '%Y-%m-%d %H:%M:%S')},{AUTO}" for number, age in AGES.items()]
+    rows += [f"99,{stamp(40, '%Y-%m-%d %H:%M:%S')},wcli-manual before the upgrade",
+             f"98,{stamp(40, '%Y-%m-%d %H:%M:%S')},\"timeline, hourly\""]
+    return "\n".join(rows) + "\n"
+
+def timeshift_list() -> str:
+    lines = ["Device : /dev/sda2", "", "Num     Name                 Tags  Description",
+             "------------------------------------------------------------------------------"]
+    lines += [f"{i:<4} >  {stamp(age, '%Y-%m-%d_%H-%M-%S')}  O     {AUTO}" for i, age in enumerate(AGES.values())]
+    lines += [f"7    >  {stamp(40, '%Y-%m-%d_%H-%M-%S')}  O     wcli-manual before the upgrade",
+              f"8    >  {stamp(40, '%Y-%m-%d_%H-%M-%S')}  D     "]
+    return "\n".join(lines) + "\n"
+
+def timeshift_name(snapper_number: str) -> str:
+    return stamp(AGES[snapper_number], "%Y-%m-%d_%H-%M-%S")
+
+@pytest.fixture
+def snapshots(monkeypatch):
+    """The snapshot commands run; 'list' answers with the canned lists above, 'create' with a new snapshot."""
+    ran = []
+    def run_cmd(cmd, cwd=None, check=True):
+        ran.append(cmd)
+        if "--list" in cmd:
+            stdout = timeshift_list()
+        elif "list" in cmd:
+            stdout = snapper_list()
+        elif "create" in cmd or "--create" in cmd:
+            stdout = "107\n" if cmd[1] == "snapper" else f"Tagged snapshot '{stamp(0, '%Y-%m-%d_%H-%M-%S')}': ondemand\n"
+        else:
+            stdout = ""
+        return subprocess.CompletedProcess(cmd, 0, stdout, "")
+    monkeypatch.setattr(engine, "run_cmd", run_cmd)
+    return ran
+
+def test_snapper_list(snapshots):
+    listed = engine.list_wcli_snapshots("snapper")
+    assert [(s["id"], s["description"]) for s in listed] == [("99", "wcli-manual before the upgrade")] + [(n, AUTO) for n in AGES]
+    assert abs(listed[-1]["created"] - (NOW - DAY)) < 2
+
+def test_timeshift_list(snapshots):
+    listed = engine.list_wcli_snapshots("timeshift")
+    assert [(s["id"], s["description"]) for s in listed] == (
+        [(stamp(40, "%Y-%m-%d_%H-%M-%S"), "wcli-manual before the upgrade")] + [(timeshift_name(n), AUTO) for n in AGES])
+    assert abs(listed[-1]["created"] - (NOW - DAY)) < 2
+
+@pytest.mark.parametrize("policy, expired", [
+    ({"keep": None, "keep_within": 0}, []),
+    ({"keep": 2, "keep_within": 0}, ["101", "102", "103", "104"]),
+    ({"keep": None, "keep_within": 7 * DAY}, ["101", "102", "103"]),
+    # Either rule keeps a snapshot
+    ({"keep": 2, "keep_within": 7 * DAY}, ["101", "102", "103"]),
+    ({"keep": 4, "keep_within": 2 * DAY}, ["101", "102"]),
+    ({"keep": 10, "keep_within": DAY // 2}, []),
+])
+def test_prune_snapshots(snapshots, policy, expired):
+    assert engine.prune_snapshots("snapper", {**policy, "coalesce": 0})
+    deletes = [cmd for cmd in snapshots if "delete" in cmd]
+    assert deletes == ([["sudo", "snapper", "delete"] + expired] if expired else [])
+
+    snapshots.clear()
+    assert engine.prune_snapshots("timeshift", {**policy, "coalesce": 0})
+    deletes = [cmd[4] for cmd in snapshots if "--delete" in cmd] # One call per snapshot
+    assert deletes == [timeshift_name(n) for n in expired]
+
+def test_prune_snapshots_dry_run(snapshots):
+    assert engine.prune_snapshots("snapper", {"keep": 1, "keep_within": 0, "coalesce": 0}, dry_run=True)
+    assert not [cmd for cmd in snapshots if "delete" in cmd]
+
+def test_a_recent_snapshot_of_the_same_system_is_reused(config_dir, snapshots, monkeypatch):
+    monkeypatch.setattr(engine, "snapshot_tool", lambda: "snapper")
+    config = {"snapshots": {"coalesce": "1h"}}
+    creates = lambda: [cmd for cmd in snapshots if "create" in cmd or "--create" in cmd]
+
+    engine.create_auto_snapshot(config, {"foo": "1.0"})
+    assert len(creates()) == 1
+    assert engine.yaml.safe_load(engine.SNAPSHOT_STATE_FILE.read_text())["id"] == "107"
+    engine.create_auto_snapshot(config, {"foo": "1.0"})
+    assert len(creates()) == 1
+
+    engine.create_auto_snapshot(config, {"foo": "1.1"}) # A package changed
+    assert len(creates()) == 2
+    monkeypatch.setattr(engine, "snapshot_tool", lambda: "timeshift") # Another tool
+    engine.create_auto_snapshot(config, {"foo": "1.1"})
+    assert len(creates()) == 3
+    engine.create_auto_snapshot({}, {"foo": "1.1"}) # No coalescing
+    assert len(creates()) == 4
+
+    state = engine.yaml.safe_load(engine.SNAPSHOT_STATE_FILE.read_text())
+    state["created"] -= 2 * 3600
+    engine.SNAPSHOT_STATE_FILE.write_text(engine.yaml.safe_dump(state))
+    engine.create_auto_snapshot(config, {"foo": "1.1"}) # Too old
+    assert len(creates()) == 5
@@ -0,0 +1,129 @@
+import time
+from types import MappingProxyType
+
+import pytest
+
+from conftest import StubProvider, engine, sync_args
+
+def declare(config_dir, *packages):
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n" + "".join(f"- {p}\n" for p in packages))
+
+def test_resume_finishes_a_partly_failed_sync(config_dir, capsys):
+    declare(config_dir, "foo", "bar")
+    provider = StubProvider(failing={"bar"})
+    engine.cmd_sync(provider, sync_args())
+    assert "foo" in provider.installed and "bar" not in provider.installed
+    assert engine.SYNC_PROGRESS_FILE.exists()
+
+    provider.failing.clear()
+    engine.cmd_sync(provider, sync_args(resume=True))
+    assert "bar" in provider.installed
+    assert provider.installs == ["foo", "bar", "bar"] # foo is not installed again
+    assert not engine.SYNC_PROGRESS_FILE.exists()
+    assert "Sync complete!" in capsys.readouterr().out
+
+def test_known_failures_are_skipped_until_retried(config_dir, capsys):
+    declare(config_dir, "foo", "bar")
+    provider = StubProvider(failing={"bar"})
+    engine.cmd_sync(provider, sync_args())
+    assert set(engine.load_failures()) == {"bar"}
+
+    engine.cmd_sync(provider, sync_args())
+    assert provider.installs == ["foo", "bar"]
+    assert "bar: still failing since" in capsys.readouterr().out
+
+    provider.failing.clear()
+    engine.cmd_sync(provider, sync_args(retry_failed=True))
+    assert "bar" in provider.installed
+    assert engine.load_failures() == {}
+
+def test_resume_tolerates_dependencies_of_finished_stages(config_dir):
+    declare(config_dir, "foo", "bar")
+    provider = StubProvider(installed={"libc": "2.36"}, failing={"bar"}, pulls_in={"foo": ["libfoo"]})
+    engine.cmd_sync(provider, sync_args())
+    assert "libfoo" in provider.installed
+
+    provider.failing.clear()
+    engine.cmd_sync(provider, sync_args(resume=True))
+    assert "bar" in provider.installed
+    assert not engine.SYNC_PROGRESS_FILE.exists()
+
+def test_resume_refuses_and_names_packages_changed_outside_the_plan(config_dir, capsys):
+    declare(config_dir, "foo", "bar")
+    provider = StubProvider(installed={"libc": "2.36"}, failing={"bar"})
+    engine.cmd_sync(provider, sync_args())
+
+    provider.installed["libc"] = "2.37"
+    with pytest.raises(SystemExit):
+        engine.cmd_sync(provider, sync_args(resume=True))
+    assert "libc 2.36 -> 2.37" in capsys.readouterr().out
+
+class OneTransactionProvider(StubProvider):
+    """Installs all or nothing, like 'pacman -S', and reports the names it rejected."""
+
+    def install(self, packages: list) -> bool:
+        self.installs += packages
+        rejected = [pkg for pkg in packages if pkg in self.failing]
+        if not rejected:
+            self.installed.update({pkg: "1.0" for pkg in packages})
+        self.failed_packages = rejected
+        return not rejected
+
+def test_only_rejected_names_of_a_single_transaction_are_recorded(config_dir):
+    declare(config_dir, "foo", "bar", "baz")
+    provider = OneTransactionProvider(failing={"bar"})
+    engine.cmd_sync(provider, sync_args())
+    assert not provider.installed
+    assert set(engine.load_failures()) == {"bar"}
+
+class LockedProvider(StubProvider):
+    """Times out waiting for the package manager lock."""
+
+    def install(self, packages: list) -> bool:
+        self.lock_timed_out = True
+        return False
+
+def test_nothing_is_recorded_when_a_stage_times_out_on_the_lock(config_dir):
+    declare(config_dir, "foo", "bar")
+    provider = LockedProvider()
+    engine.cmd_sync(provider, sync_args())
+    assert engine.load_failures() == {}
+    assert engine.SYNC_PROGRESS_FILE.exists()
+
+def test_sync_records_drift_as_it_left_the_system(config_dir):
+    declare(config_dir, "foo", "bar")
+    engine.cmd_sync(StubProvider(failing={"bar"}), sync_args())
+    packages = (("kind", "packages"),)
+    assert engine.run_metrics.gauges["wcli_missing_packages"][packages] == 1
+    assert engine.run_metrics.gauges["wcli_installed_packages"][packages] == 1
+    assert engine.run_metrics.gauges["wcli_constraint_violations"][()] == 0
+
+class SlowQueries(StubProvider):
+    """Each system query takes QUERY_TIME."""
+    QUERY_TIME = 0.3
+    helper_repo_kinds = ("fedora_copr",)
+
+    def get_installed_packages_with_versions(self):
+        time.sleep(self.QUERY_TIME)
+        return super().get_installed_packages_with_versions()
+
+    def get_installed_flatpaks(self):
+        time.sleep(self.QUERY_TIME)
+        return {"org.example.App": "stable"}
+
+    def enabled_helper_repos(self):
+        time.sleep(self.QUERY_TIME)
+        return {"owner/project"}
+
+def test_facts_are_gathered_concurrently_and_read_only():
+    provider = SlowQueries(installed={"foo": "1.0"})
+    start = time.monotonic()
+    facts, result = engine.gather_facts(provider, lambda: time.sleep(SlowQueries.QUERY_TIME) or "parsed")
+    assert time.monotonic() - start < 2.5 * SlowQueries.QUERY_TIME # Four waits, run side by side
+    assert result == "parsed"
+
+    assert isinstance(facts.installed, MappingProxyType) and isinstance(facts.flatpaks, MappingProxyType)
+    assert facts.helper_repos == frozenset({"owner/project"})
+    assert dict(facts.installed) == {"foo": "1.0"}
+    with pytest.raises(TypeError):
+        facts.installed["bar"] = "2.0"
@@ -0,0 +1,125 @@
+import subprocess
+
+import pytest
+
+from conftest import StubProvider, engine
+from providers import arch, debian, gentoo
+
+APT_LIST = """Listing... Done
+curl/jammy-updates 7.81.0-1ubuntu1.16 amd64 [upgradable from: 7.81.0-1ubuntu1.15]
+libc6/jammy-updates,jammy-security 2.35-0ubuntu3.8 amd64 [upgradable from: 2.35-0ubuntu3.7]
+vim/jammy-updates 2:8.2.3995-1ubuntu2.17 amd64 [upgradable from: 2:8.2.3995-1ubuntu2.16]
+"""
+
+APT_SHOW = """Package: curl
+Version: 7.81.0-1ubuntu1.16
+Size: 194562
+
+Package: libc6
+Version: 2.35-0ubuntu3.8
+Size: 3235610
+
+Package: libc6
+Version: 2.35-0ubuntu3.8
+Size: 2911144
+"""
+
+PACMAN_QU = """linux 6.9.1.arch1-1 -> 6.9.2.arch1-1
+firefox 126.0-1 -> 126.0.1-1 [ignored]
+vim 9.1.0-1 -> 9.1.1-1
+"""
+
+PACMAN_SP = """linux 137000000
+firefox
+"""
+
+EMERGE_PRETEND = """[ebuild     U  ] sys-devel/gcc-14.1.0:14::gentoo [13.2.1_p20240210:13::gentoo]
+[ebuild     U  ] app-editors/vim-9.1.0418 [9.1.0]
+[ebuild  N     ] dev-libs/newlib-1.0
+[ebuild     UD ] x11-libs/gtk+-3.24.41 [3.24.42]
+[ebuild   R    ] app-shells/bash-5.2_p26
+"""
+
+@pytest.fixture
+def canned(monkeypatch):
+    """Answers subprocess.run() from {command prefix: stdout}; anything else fails."""
+    outputs = {}
+    def run(cmd, **kwargs):
+        stdout = next((out for prefix, out in outputs.items() if tuple(cmd[:len(prefix)]) == prefix), None)
+        return subprocess.CompletedProcess(cmd, 0 if stdout is not None else 1, stdout or "", "")
+    monkeypatch.setattr(subprocess, "run", run)
+    return outputs
+
+def test_apt_list_upgradable(canned):
+    canned.update({("apt", "list"): APT_LIST, ("apt-cache", "show"): APT_SHOW})
+    assert debian.Provider().upgradable_packages(["curl", "libc6:amd64", "git"]) == {
+        "curl": {"version": "7.81.0-1ubuntu1.16", "size": 194562},
+        "libc6:amd64": {"version": "2.35-0ubuntu3.8", "size": 3235610}, # The first stanza
+    }
+
+def test_apt_list_upgradable_fails(canned):
+    assert debian.Provider().upgradable_packages(["curl"]) is None
+
+def test_pacman_qu(canned):
+    canned.update({("pacman", "-Qu"): PACMAN_QU, ("pacman", "-Sp"): PACMAN_SP})
+    assert arch.Provider().upgradable_packages(["linux", "firefox", "git"]) == {
+        "linux": {"version": "6.9.2.arch1-1", "size": 137000000},
+        "firefox": {"version": "126.0.1-1", "size": None},
+    }
+
+def test_emerge_pretend(canned):
+    canned[("emerge",)] = EMERGE_PRETEND
+    assert gentoo.Provider().upgradable_packages(["gcc", "vim", "newlib", "gtk+", "bash"]) == {
+        "gcc": {"version": "14.1.0", "size": None}, # Without the slot and repo
+        "vim": {"version": "9.1.0418", "size": None},
+    }
+
+class Upgradable(StubProvider):
+    """Overlay packages are installed under their bare name; 'available' is what the repos offer."""
+    helper_repo_kinds = ("gentoo_overlay",)
+
+    def __init__(self, available, **kwargs):
+        super().__init__(**kwargs)
+        self.available = available
+        self.asked = None
+
+    def installed_name(self, package):
+        return package.split("/")[-1]
+
+    def upgradable_packages(self, names):
+        self.asked = names
+        return self.available if self.available is None else {n: u for n, u in self.available.items() if n in names}
+
+def test_declared_upgrade_set(config_dir):
+    (config_dir / "packages" / "base.yaml").write_text(
+        "packages:\n"
+        "  - curl\n"
+        "  - { name: vim, version: \"<9.1\" }\n"
+        "  - { name: git, version: \">=2.30\" }\n"
+        "  - missing\n"
+        "gentoo_overlay:\n"
+        "  guru:\n"
+        "    - dev-util/tool\n")
+    provider = Upgradable({
+        "curl": {"version": "8.1", "size": 1000},
+        "vim": {"version": "9.1.2", "size": 2000},
+        "git": {"version": "2.45", "size": None},
+        "tool": {"version": "3.0", "size": None},
+        "undeclared": {"version": "2.0", "size": 10},
+    }, installed={"curl": "8.0", "vim": "9.0", "git": "2.40", "tool": "2.0", "undeclared": "1.0"})
+    declared = engine.get_declared_packages(engine.load_config())
+
+    upgrades, held = engine.declared_upgrade_set(provider, declared, provider.installed)
+    assert provider.asked == ["curl", "git", "tool", "vim"]
+    assert upgrades == {
+        "curl": {"old": "8.0", "new": "8.1", "size": 1000},
+        "git": {"old": "2.40", "new": "2.45", "size": None},
+        "tool": {"old": "2.0", "new": "3.0", "size": None},
+    }
+    assert len(held) == 1 and held[0].startswith("vim 9.1.2 (outside ")
+
+def test_declared_upgrade_set_when_the_provider_cannot_tell(config_dir):
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n  - curl\n")
+    provider = Upgradable(None, installed={"curl": "8.0"})
+    declared = engine.get_declared_packages(engine.load_config())
+    assert engine.declared_upgrade_set(provider, declared, provider.installed) == (None, None)
@@ -0,0 +1,120 @@
+import argparse
+import hashlib
+import os
+import subprocess
+
+import pytest
+
+from conftest import StubProvider, engine
+from providers import base_provider, debian
+from providers.arch import _mtree_files
+
+def verify_args(**overrides) -> argparse.Namespace:
+    args = dict(packages=[], all=False, jobs=2, no_cache=False)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+# Two packages, as 'rpm -q --qf' prints them: one line per file
+RPM_OUTPUT = "\t".join(["bash", "8", "0", "0", "aa11", "/usr/bin/bash"]) + "\n" \
+    + "\t".join(["bash", "8", "1", "0", "bb22", "/etc/bashrc"]) + "\n" \
+    + "\t".join(["bash", "8", "0", "0", "", "/usr/share/bash"]) + "\n" \
+    + "\t".join(["bash", "8", "0", "2", "cc33", "/usr/share/doc/bash/README"]) + "\n" \
+    + "\t".join(["sed", "(none)", "0", "0", "dd44", "/usr/bin/sed"]) + "\n" \
+    + "\t".join(["sed", "8", "64", "0", "ee55", "/var/log/sed.log"]) + "\n" \
+    + "package missing is not installed\n"
+
+def test_rpm_digests_are_read_per_file_from_one_query(monkeypatch):
+    calls = []
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 1, stdout=RPM_OUTPUT, stderr="")
+    monkeypatch.setattr(subprocess, "run", run)
+    digests = base_provider.rpm_file_digests({"bash": "5.2", "sed": "4.9", "missing": "1.0"})
+
+    assert digests == {"bash": [("/usr/bin/bash", "sha256", "aa11")], "sed": [("/usr/bin/sed", "md5", "dd44")]}
+    (cmd,) = calls
+    assert cmd[-3:] == ["bash", "missing", "sed"]
+    assert cmd[3].startswith("[%{=NAME}\t%{=FILEDIGESTALGO}\t") # Scalars repeated on every file's line
+
+def test_mtree_listings_apply_set_defaults_and_skip_metadata():
+    mtree = "\n".join([
+        "#mtree",
+        "/set type=file uid=0 gid=0 mode=644",
+        "./.PKGINFO time=1 size=10 sha256digest=00",
+        "./usr time=1 mode=755 type=dir",
+        "./usr/bin/foo time=1 mode=755 size=3 sha256digest=aa",
+        "./usr/bin/foo-link time=1 type=link link=foo",
+        "./usr/share/a\\040b time=1 size=3 sha256digest=bb",
+        "/unset uid",
+        "./usr/share/nodigest time=1 size=3",
+    ])
+    assert _mtree_files(mtree) == [("/usr/bin/foo", "sha256", "aa"), ("/usr/share/a b", "sha256", "bb")]
+
+def test_dpkg_digests_follow_diversions_by_other_packages(monkeypatch, tmp_path):
+    # dpkg names the file after ${binary:Package}: arch-qualified for Multi-Arch: same
+    (tmp_path / "foo:amd64.md5sums").write_text("aa11  usr/bin/foo\nbb22  usr/bin/tool\ncc33  usr/bin/own\n")
+    (tmp_path / "diversions").write_text(
+        "/usr/bin/tool\n/usr/bin/tool.real\nbar\n"
+        "/usr/bin/own\n/usr/bin/own.orig\nfoo\n")
+    monkeypatch.setattr(debian, "DPKG_INFO_DIR", str(tmp_path))
+    monkeypatch.setattr(debian, "DPKG_DIVERSIONS_FILE", str(tmp_path / "diversions"))
+    digests = debian.Provider().package_file_digests({"foo:amd64": "1.0", "nomd5sums": "1.0"})
+    assert digests == {"foo:amd64": [
+        ("/usr/bin/foo", "md5", "aa11"),
+        ("/usr/bin/tool.real", "md5", "bb22"), # Diverted away by bar
+        ("/usr/bin/own", "md5", "cc33"), # foo's own diversion: its file stays put
+    ]}
+
+def test_cached_digests_are_reused_until_the_file_changes(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"one")
+    expected = hashlib.sha256(b"one").hexdigest()
+
+    status, entry, hashed = engine.check_file(str(path), "sha256", expected, None)
+    assert (status, hashed) == ("ok", True)
+    assert engine.check_file(str(path), "sha256", expected, entry)[::2] == ("ok", False)
+    # A cached digest with a different algorithm does not count
+    assert engine.check_file(str(path), "md5", hashlib.md5(b"one").hexdigest(), entry)[::2] == ("ok", True)
+
+    path.write_bytes(b"two")
+    os.utime(path, ns=(entry[1], entry[1])) # Same mtime and size: ctime still changed
+    status, _, hashed = engine.check_file(str(path), "sha256", expected, entry)
+    assert (status, hashed) == ("modified", True)
+
+    assert engine.check_file(str(tmp_path / "gone"), "sha256", expected, entry)[0] == "missing"
+    assert engine.check_file(str(tmp_path), "sha256", expected, None)[0] == "modified"
+
+def test_verify_cache_round_trips(config_dir):
+    cache = {"/usr/bin/foo": (1, 2, 3, 4, "sha256", "aa"), "/usr/bin/a\tb": (5, 6, 7, 8, "md5", "bb")}
+    engine.save_verify_cache(cache)
+    assert engine.load_verify_cache() == cache
+
+class DigestProvider(StubProvider):
+    def __init__(self, digests, **kwargs):
+        super().__init__(**kwargs)
+        self.digests = digests
+
+    def package_file_digests(self, packages):
+        return {name: self.digests[name] for name in packages if name in self.digests}
+
+def test_problems_are_grouped_by_the_file_that_declares_the_package(config_dir, tmp_path, capsys):
+    (config_dir / "packages" / "base.yaml").write_text("packages:\n- foo\n- baz\n")
+    (config_dir / "packages" / "hosts" / "test.yaml").write_text("packages:\n- bar\n")
+    good = tmp_path / "good"
+    good.write_bytes(b"good")
+    digest = hashlib.sha256(b"good").hexdigest()
+    provider = DigestProvider({
+        "foo": [(str(good), "sha256", digest), (str(tmp_path / "gone"), "sha256", digest)],
+        "bar": [(str(good), "sha256", "0" * 64)],
+        "baz": [(str(good), "sha256", digest)],
+    }, installed={"foo": "1", "bar": "1", "baz": "1"})
+
+    with pytest.raises(SystemExit):
+        engine.cmd_verify(provider, verify_args())
+    out = capsys.readouterr().out
+    assert "Verifying 4 files of 3 packages" in out
+    base, host = out.index("packages/base.yaml"), out.index("packages/hosts/test.yaml")
+    assert base < out.index("foo") and host < out.index("bar")
+    assert "baz" not in out.split("Verifying")[1].split("\n", 1)[1]
+    assert f"missing   {tmp_path / 'gone'}" in out
+    assert f"modified  {good}" in out
@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import StubProvider
+from providers.versions import pacman_key
+
+def sign(a, b):
+    return (a > b) - (a < b)
+
+# Expected results of pacman's `vercmp a b`, from its test suite.
+VERCMP = [
+    ("1.5.0", "1.5.0", 0),
+    ("1.5.1", "1.5.0", 1),
+    ("1.5.1", "1.5", 1),
+    ("1.0", "1.0.0", -1),
+    ("1.01", "1.1", 0),
+    ("1.0.", "1.0", 0),
+    # alpha segments
+    ("1.0a", "1.0alpha", -1),
+    ("1.0alpha", "1.0b", -1),
+    ("1.0b", "1.0beta", -1),
+    ("1.0beta", "1.0rc", -1),
+    ("1.0rc", "1.0", -1),
+    ("1.0rc1", "1.0", -1),
+    ("1.0a1", "1.0", -1),
+    ("1.1", "1.0a", 1),
+    # alpha-dotted versions
+    ("1.5.a", "1.5", -1),
+    ("1.0.a", "1.0", -1),
+    ("1.0.a1", "1.0", -1),
+    ("1.5.b", "1.5.a", 1),
+    ("1.5.1", "1.5.b", 1),
+    # same content, different separators
+    ("2.0", "2_0", 0),
+    ("2.0_a", "2_0.a", 0),
+    ("2.0a", "2.0.a", -1),
+    ("2___a", "2_a", 1),
+]
+
+@pytest.mark.parametrize("a, b, expected", VERCMP)
+def test_pacman_key_matches_vercmp(a, b, expected):
+    assert sign(pacman_key(a), pacman_key(b)) == expected
+    assert sign(pacman_key(b), pacman_key(a)) == -expected
+
+class PacmanProvider(StubProvider):
+    def segment_key(self, version):
+        return pacman_key(version)
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("1.5.0-1", "1.5.0-1", 0),
+    ("1.5.0-2", "1.5.0-1", 1),
+    ("1.5.0-1", "1.5.1-1", -1),
+    ("1.5-2", "1.5.a-1", 1),
+    ("1:1.0-1", "2.0-1", 1),
+    ("1:1.0-1", "1:1.0a-1", 1),
+    ("0:1.0-1", "1.0-1", 0),
+])
+def test_full_pacman_versions_match_vercmp(a, b, expected):
+    provider = PacmanProvider()
+    assert sign(provider.version_key(a), provider.version_key(b)) == expected
@@ -0,0 +1,83 @@
+import subprocess
+
+from providers import void
+
+def write_template(repo, name, depends=""):
+    (repo / "srcpkgs" / name).mkdir(parents=True)
+    (repo / "srcpkgs" / name / "template").write_text(f"pkgname={name}\nversion=1.0\nrevision=1\ndepends=\"{depends}\"\n")
+
+def src_provider(monkeypatch, tmp_path, commands):
+    def run_cmd(cmd, cwd=None):
+        commands.append(cmd)
+        return "bootstrap-update" not in cmd or "fail-bootstrap" not in str(cwd)
+
+    def run_cmd_capture(cmd, cwd=None, check=True):
+        # Only 'glibc' is in the binary repos
+        found = cmd[0] == "git" or cmd[-1] == "glibc"
+        return subprocess.CompletedProcess(cmd, 0 if found else 2, stdout="abc123\n", stderr="")
+
+    monkeypatch.setattr(void, "run_cmd", run_cmd)
+    monkeypatch.setattr(void, "run_cmd_capture", run_cmd_capture)
+    provider = void.Provider()
+    provider.can_build_src = True
+    provider.src_repo_path = tmp_path
+    provider.waves = [] # Templates in build order
+    monkeypatch.setattr(provider, "get_installed_packages", set)
+    monkeypatch.setattr(provider, "_prepare_masterdirs", lambda count: [f"masterdir-wcli-{n}" for n in range(count)])
+
+    def build_one(template, masterdir, jobs):
+        provider.waves.append(template)
+        return template != "broken"
+
+    monkeypatch.setattr(provider, "_build_one", build_one)
+    return provider
+
+def test_shared_unbuilt_dependencies_build_first_and_once(monkeypatch, tmp_path):
+    write_template(tmp_path, "libshared", "glibc")
+    write_template(tmp_path, "glibc")
+    write_template(tmp_path, "a", "libshared>=1.0")
+    write_template(tmp_path, "b", "libshared")
+    commands = []
+    provider = src_provider(monkeypatch, tmp_path, commands)
+    assert provider.install_src(["a", "b"])
+    assert provider.waves[0] == "libshared"
+    assert sorted(provider.waves[1:]) == ["a", "b"]
+
+def test_a_missing_template_skips_only_that_package(monkeypatch, tmp_path):
+    write_template(tmp_path, "a")
+    write_template(tmp_path, "broken")
+    write_template(tmp_path, "c", "broken")
+    commands = []
+    provider = src_provider(monkeypatch, tmp_path, commands)
+    assert not provider.install_src(["a", "missing", "c"])
+    assert commands[-1][-1:] == ["a"] and "c" not in commands[-1]
+    assert provider.failed_packages == ["missing", "c"]
+
+def test_a_failed_bootstrap_update_stops_the_build(monkeypatch, tmp_path):
+    repo = tmp_path / "fail-bootstrap"
+    write_template(repo, "a")
+    commands = []
+    provider = src_provider(monkeypatch, tmp_path, commands)
+    provider.src_repo_path = repo
+    assert not provider.install_src(["a"])
+    assert provider.waves == []
+
+def test_installed_names_keep_their_hyphens(monkeypatch):
+    listing = "ii gtk+3-devel-3.24.41_1     GTK+ version 3 - development files\nii zsh-5.9_3                  Z shell\n"
+    monkeypatch.setattr(void, "run_cmd_capture", lambda cmd, cwd=None, check=True: subprocess.CompletedProcess(cmd, 0, stdout=listing))
+    provider = void.Provider()
+    assert provider.get_installed_packages() == {"gtk+3-devel", "zsh"}
+    assert provider.get_installed_packages_with_versions() == {"gtk+3-devel": "3.24.41_1", "zsh": "5.9_3"}
+
+def test_installed_packages_with_a_bumped_template_are_rebuilt(monkeypatch, tmp_path):
+    write_template(tmp_path, "a")
+    write_template(tmp_path, "b")
+    commands = []
+    provider = src_provider(monkeypatch, tmp_path, commands)
+    installed = {"a": "0.9_1", "b": "1.0_1"}
+    assert provider.outdated_src_packages(["a", "b", "c"], installed) == ["a"]
+
+    monkeypatch.setattr(provider, "get_installed_packages", lambda: set(installed))
+    assert provider.install_src(["a"])
+    assert provider.waves == ["a"]
+    assert commands[-1][-2:] == ["-u", "a"]
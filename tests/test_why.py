@@ -0,0 +1,121 @@
+import argparse
+
+import pytest
+
+from conftest import StubProvider, engine
+
+# A host file that enables a module and excludes a base package,
+# and a config.yaml that overrides a constraint
+FILES = {
+    "config.yaml": """host: test
+enabled_modules: []
+additional_packages:
+  - { name: vim, version: ">=9.1" }
+""",
+    "packages/base.yaml": """packages:
+  - git
+  - vim
+  - htop
+  - nano
+arch_aur:
+  - yay
+""",
+    "packages/hosts/test.yaml": """modules:
+  - dev
+packages:
+  - { name: git, version: ">=2.30" }
+exclude:
+  - nano
+""",
+    "packages/modules/dev.yaml": """packages:
+  - { name: git, version: "<3" }
+  - { name: vim, version: "<9" }
+  - htop
+""",
+}
+
+DEV = "module 'dev', enabled at packages/hosts/test.yaml:2"
+
+@pytest.fixture
+def tree(config_dir):
+    for path, text in FILES.items():
+        (config_dir / path).write_text(text)
+    return config_dir
+
+def events(provenance, label):
+    return [(e["file"], e["line"], e["action"], e.get("constraint"), e.get("via")) for e in provenance[label]["events"]]
+
+def test_every_declaration_override_and_exclusion_is_recorded_in_merge_order(tree):
+    provenance = engine.get_declared_packages(engine.load_config())["provenance"]
+    assert events(provenance, "git") == [
+        ("packages/base.yaml", 2, "declared", None, None),
+        ("packages/hosts/test.yaml", 4, "constrained", ">=2.30", None),
+        ("packages/modules/dev.yaml", 2, "constrained", "<3", DEV),
+    ]
+    assert provenance["git"]["result"] == ">=2.30,<3"
+    assert events(provenance, "vim") == [
+        ("packages/base.yaml", 3, "declared", None, None),
+        ("packages/modules/dev.yaml", 3, "constrained", "<9", DEV),
+        ("config.yaml", 4, "overridden", ">=9.1", None),
+    ]
+    assert provenance["vim"]["result"] == ">=9.1"
+    assert events(provenance, "htop") == [
+        ("packages/base.yaml", 4, "declared", None, None),
+        ("packages/modules/dev.yaml", 4, "declared again", None, DEV),
+    ]
+    assert provenance["htop"]["result"] == "latest"
+    assert events(provenance, "nano") == [
+        ("packages/base.yaml", 5, "declared", None, None),
+        ("packages/hosts/test.yaml", 6, "excluded", None, None),
+    ]
+    assert provenance["nano"]["result"] == "excluded"
+    assert events(provenance, "aur:yay") == [("packages/base.yaml", 7, "declared", None, None)]
+
+def test_modules_enabled_in_config_yaml_point_there(tree):
+    (tree / "config.yaml").write_text("host: test\nenabled_modules:\n  - dev\n")
+    provenance = engine.get_declared_packages(engine.load_config())["provenance"]
+    assert provenance["htop"]["events"][-1]["via"] == "module 'dev', enabled at config.yaml:3"
+
+@pytest.mark.parametrize("package, labels", [
+    ("git", ["git"]),
+    ("yay", ["aur:yay"]),
+    ("aur:yay", ["aur:yay"]),
+    ("ya", []),
+    ("missing", []),
+])
+def test_find_provenance(tree, package, labels):
+    provenance = engine.get_declared_packages(engine.load_config())["provenance"]
+    assert engine.find_provenance(provenance, package) == labels
+
+def why(package, provider=None):
+    return engine.cmd_why(provider or StubProvider(), argparse.Namespace(package=package))
+
+def test_why(tree, capsys):
+    assert why("git")
+    assert capsys.readouterr().out.splitlines() == [
+        f"{engine.BLUE}git{engine.NC}: >=2.30,<3",
+        "  packages/base.yaml:2  declared in 'packages'",
+        "  packages/hosts/test.yaml:4  constrained in 'packages' (>=2.30)",
+        f"  packages/modules/dev.yaml:2  constrained in 'packages' (<3)  [{DEV}]",
+    ]
+    assert why("nano")
+    assert capsys.readouterr().out.splitlines() == [
+        f"{engine.BLUE}nano{engine.NC}: excluded",
+        "  packages/base.yaml:5  declared in 'packages'",
+        "  packages/hosts/test.yaml:6  excluded",
+    ]
+    assert not why("curl", StubProvider(installed={"curl": "8.0"}))
+    assert "It is installed (8.0)" in capsys.readouterr().out
+
+def test_why_uses_the_saved_index_until_the_config_changes(tree, capsys):
+    provenance = engine.get_declared_packages(engine.load_config())["provenance"]
+    provenance["git"]["result"] = "from the saved index"
+    engine.save_provenance(provenance)
+    assert why("git")
+    assert f"{engine.BLUE}git{engine.NC}: from the saved index" in capsys.readouterr().out
+
+    (tree / "packages" / "base.yaml").write_text("packages:\n  - htop\n  - git\n")
+    assert why("git")
+    out = capsys.readouterr().out
+    assert f"{engine.BLUE}git{engine.NC}: >=2.30,<3" in out
+    assert "packages/base.yaml:3  declared in 'packages'" in out
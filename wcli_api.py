@@ -0,0 +1,182 @@
+# wcli_api.py
+#
+# Importable API over the wcli engine, for programs that would otherwise run
+# 'wcli status' or 'wcli sync --dry-run' and scrape their output. A Session
+# keeps one provider, the parsed config files and the installed-package
+# facts across calls:
+#
+#   from wcli_api import Session
+#   session = Session()
+#   plan = session.plan()
+#   if plan.pending:
+#       result = session.apply(plan)
+#
+# The config directory is SYS_CONFIG_DIR, as for the CLI. Nothing is
+# printed: the engine's messages, and the output of the package managers it
+# runs, are kept in Session.messages and passed to on_message if given.
+# Output is routed per call (providers/output.py), never by swapping
+# sys.stdout, so sessions can be used from several threads at once.
+import contextlib
+import importlib.util
+import io
+import re
+import sys
+from collections import namedtuple
+from importlib.machinery import SourceFileLoader
+from pathlib import Path
+
+ENGINE_MODULE = "wcli_engine"
+MESSAGES_MAX = 1000 # Lines kept in Session.messages
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+def _load_engine():
+    """The 'wcli' script beside this file, imported once as a module."""
+    if ENGINE_MODULE in sys.modules:
+        return sys.modules[ENGINE_MODULE]
+    path = Path(__file__).resolve().with_name("wcli")
+    if str(path.parent) not in sys.path:
+        sys.path.insert(0, str(path.parent)) # For 'providers'
+    loader = SourceFileLoader(ENGINE_MODULE, str(path))
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(ENGINE_MODULE, loader))
+    sys.modules[ENGINE_MODULE] = module
+    loader.exec_module(module)
+    return module
+
+engine = _load_engine()
+from providers.output import message_sink # noqa: E402 (on the path once the engine is loaded)
+
+class WcliError(Exception):
+    """An operation failed; the message is what the CLI would have printed."""
+
+# A declared official package checked against its constraints. 'allowed' is
+# the compiled constraint ('>=1.2,<2'), 'sources' the files constraining it.
+PackageState = namedtuple("PackageState", ["name", "installed", "constraint", "allowed", "sources"])
+# 'stages' is {stage: work}, as in state/sync-progress.yaml; 'pending' the
+# stages with work, in the order they run; 'constraints' is
+# {"install"|"upgrade"|"downgrade"|"unresolved"|"conflicts"|"ok": [PackageState]}.
+Plan = namedtuple("Plan", ["stages", "pending", "constraints", "ignored_helpers", "prune", "facts", "declared"])
+ApplyResult = namedtuple("ApplyResult", ["applied", "failed"])
+# 'kinds' is {kind: {"declared", "missing", ...}}, see status_summary() in wcli.
+Status = namedtuple("Status", ["kinds", "constraints", "in_sync"])
+
+class Session:
+    """One provider and its caches, reused across any number of queries."""
+
+    def __init__(self, provider=None, lock_timeout: int = None, on_message=None):
+        self.messages = []
+        self.on_message = on_message # Called with each message line, without colors
+        self.provider = provider or self._call(engine.get_provider)
+        self.lock_timeout = engine.LOCK_WAIT if lock_timeout is None else lock_timeout # For apply()'s run lock
+        self._loaded = None # (config file signature, config, declared)
+        self._facts = None
+
+    def _call(self, func, *args, **kwargs):
+        """Runs an engine function with its output captured; its exits become WcliError."""
+        out = io.StringIO()
+        write = self._sink(out)
+        try:
+            with message_sink(write):
+                return func(*args, **kwargs)
+        except SystemExit:
+            raise WcliError(" ".join(ANSI_RE.sub("", out.getvalue()).split()) or "wcli exited") from None
+        finally:
+            write("\n") # Ends a last line printed without one
+            del self.messages[:-MESSAGES_MAX]
+
+    def _sink(self, out: io.StringIO):
+        """A message sink that keeps this call's output in 'out' and hands on each complete line."""
+        pending = []
+        def write(text: str):
+            out.write(text)
+            pending.append(text)
+            if "\n" not in text:
+                return
+            *lines, rest = "".join(pending).split("\n")
+            pending[:] = [rest] if rest else []
+            for line in (ANSI_RE.sub("", line).rstrip() for line in lines):
+                if line.strip():
+                    self.messages.append(line)
+                    if self.on_message:
+                        self.on_message(line)
+        return write
+
+    def _load(self) -> (dict, dict):
+        """config.yaml and the declared package lists, parsed again only after a config file changed."""
+        files = [engine.CONFIG_FILE] + sorted(engine.PACKAGES_DIR.rglob("*.yaml"))
+        signature = []
+        for path in files:
+            with contextlib.suppress(OSError):
+                stat = path.stat()
+                signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+        if not self._loaded or self._loaded[0] != signature:
+            config = self._call(engine.load_config)
+            self._loaded = (signature, config, self._call(engine.get_declared_packages, config))
+        return self._loaded[1], self._loaded[2]
+
+    def config(self) -> dict:
+        return self._load()[0]
+
+    def declared(self) -> dict:
+        """Every declared package list, as get_declared_packages() returns them."""
+        return self._load()[1]
+
+    def facts(self, refresh: bool = False):
+        """Installed packages, Flatpaks and helper repos (a wcli Facts), kept until refresh()."""
+        if refresh or self._facts is None:
+            self._facts = self._call(engine.gather_facts, self.provider)[0]
+        return self._facts
+
+    def refresh(self):
+        """Forgets the facts, e.g. after packages were changed outside this session."""
+        self._facts = None
+
+    @staticmethod
+    def _package_states(result: dict, installed) -> dict:
+        return {action: [PackageState(pkg.name, installed.get(pkg.name), pkg.constraint or None,
+                                      str(pkg.allowed) if pkg.clauses and pkg.allowed is not None else None,
+                                      sorted({source for _, _, source in pkg.clauses if source}))
+                         for pkg in pkgs]
+                for action, pkgs in result.items()}
+
+    def constraints(self, constrained_only: bool = False) -> dict:
+        """The declared official packages checked against their constraints (what 'wcli outdated' reports)."""
+        declared = self.declared()["packages"]
+        if constrained_only:
+            declared = {name: pkg for name, pkg in declared.items() if pkg.clauses}
+        installed = self.facts().installed
+        return self._package_states(self._call(engine.evaluate_constraints, self.provider, declared, installed), installed)
+
+    def status(self) -> Status:
+        """What 'wcli status' reports."""
+        facts = self.facts()
+        summary = self._call(engine.status_summary, self.provider, facts, self.declared())
+        return Status(summary["kinds"], self._package_states(summary["constraints"], facts.installed), summary["in_sync"])
+
+    def plan(self, prune: bool = False) -> Plan:
+        """What 'wcli sync' would do, without doing it."""
+        declared, facts = self.declared(), self.facts()
+        stages, result = self._call(engine.build_sync_plan, self.provider, facts, declared, prune)
+        pending = [stage for stage in engine.SYNC_STAGES if engine.stage_has_work(stages, stage)]
+        ignored = [key for key in engine.REPO_KEYS if declared[key] and key not in self.provider.helper_repo_kinds]
+        return Plan(stages, pending, self._package_states(result, facts.installed), ignored, prune, facts, declared)
+
+    def apply(self, plan: Plan, snapshot: bool = True) -> ApplyResult:
+        """
+        Applies a plan as 'wcli sync --force' would, under the same exclusive
+        lock, checkpoint and state files. Refuses a plan that packages
+        outside it changed under.
+        """
+        if not plan.pending:
+            return ApplyResult([], [])
+        failed = self._call(self._apply_locked, plan, snapshot)
+        self._facts = None
+        return ApplyResult([stage for stage in plan.pending if stage not in failed], failed)
+
+    def _apply_locked(self, plan: Plan, snapshot: bool) -> list:
+        with engine.command_lock("api", "exclusive", self.lock_timeout):
+            current = self.provider.get_installed_packages_with_versions()
+            changed = engine.changed_outside_plan(engine.untouched_packages(self.provider, plan.facts.installed, plan.stages), current)
+            if changed:
+                raise WcliError(f"Packages outside the plan changed since it was made ({', '.join(changed)}). Plan again.")
+            return engine.execute_sync(self.provider, self.config(), plan.facts, plan.declared, plan.stages,
+                                       snapshot=snapshot, prune=plan.prune)